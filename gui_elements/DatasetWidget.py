@@ -439,7 +439,8 @@ class Worker(QThread):
 
     def run(self):
         self.dataset_config_editor.update_config()
-        self.cassi_system.load_dataset(self.dataset_config_editor.directories_combo.currentText(),self.dataset_config_editor.datasets_directory.text())
+        # the same scenes are reloaded many times from the GUI, they are kept in the dataset cache
+        self.cassi_system.load_dataset(self.dataset_config_editor.directories_combo.currentText(),self.dataset_config_editor.datasets_directory.text(), use_cache=True)
 
         self.dataset_config_editor.dataset_loaded.emit(self.cassi_system.dataset.shape[1], self.cassi_system.dataset.shape[0], self.cassi_system.dataset.shape[2],
                                                        self.cassi_system.dataset_wavelengths[0], self.cassi_system.dataset_wavelengths[-1])
@@ -22,40 +22,9 @@ if __name__ == '__main__':
     cassi_system.load_dataset(dataset_name, config_dataset["datasets directory"])
 
 
-    cassi_system.generate_multiple_patterns(config_patterns,nb_of_acq)
-
-    # PROPAGATION : Propagate the pattern grid to the detector plane
-    cassi_system.propagate_coded_aperture_grid()
-
-    # FILTERING CUBE : Generate the filtering cubes
-    cassi_system.generate_multiple_filtering_cubes(nb_of_acq)
-
-    # ACQUISITION : Simulate the acquisition with psf (use_psf is optional)
-    cassi_system.multiple_image_acquisitions(use_psf=False,nb_of_filtering_cubes=nb_of_acq,chunck_size=50)
-
-    # Save the acquisition
-    cassi_system.result_directory =results_directory
+    # ACQUISITION : Simulate the acquisitions one pattern at a time (use_psf is optional)
+    # Each shot is appended to the container as soon as it is simulated : running the script again resumes an interrupted run
     os.makedirs(results_directory, exist_ok=True)
 
-    save_config_file("config_system", cassi_system.system_config, cassi_system.result_directory)
-    save_config_file("config_pattern", config_patterns,cassi_system.result_directory)
-    save_config_file("config_acquisition", config_acquisition, cassi_system.result_directory)
-
-    save_data_in_hdf5("interpolated_scene",cassi_system.interpolated_scene, cassi_system.result_directory)
-    save_data_in_hdf5("panchro",cassi_system.panchro,cassi_system.result_directory)
-
-    save_data_in_hdf5("wavelengths",cassi_system.optical_model.system_wavelengths,cassi_system.result_directory)
-    save_data_in_hdf5("list_of_compressed_measurements",cassi_system.list_of_measurements,cassi_system.result_directory)
-    save_data_in_hdf5("list_of_filtering_cubes",cassi_system.list_of_filtering_cubes,cassi_system.result_directory)
-    save_data_in_hdf5("list_of_patterns",cassi_system.list_of_patterns,cassi_system.result_directory)
-
-
-
-
-
-
-
-
-
-
-
+    cassi_system.checkpointed_image_acquisitions(os.path.join(results_directory, "acquisition.h5"), config_patterns, nb_of_acq,
+                                                 config_acquisition=config_acquisition, use_psf=False, chunck_size=50)
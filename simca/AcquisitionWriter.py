@@ -0,0 +1,286 @@
+import atexit
+import multiprocessing as mp
+import numpy as np
+import queue
+import time
+import traceback
+import yaml
+import h5py
+from multiprocessing import resource_tracker
+from simca.functions_acquisition import create_shared_array, attach_shared_arrays, release_shared_memories
+from simca.functions_general_purpose import write_dataset_in_hdf5, append_shot_in_hdf5
+
+
+class AcquisitionWriter:
+    """
+    Background process writing arrays in an HDF5 container, so that the simulation can go on while the data is written to disk.
+
+    The arrays are copied in shared memory blocks and handed to the writer process through a bounded queue : when the
+    queue is full, the calls block until the writer catches up. Errors raised in the writer process are raised again in
+    the main process on the next call, and a RuntimeError is raised instead of blocking if the writer process died or
+    did not catch up within the timeout. The writer is closed at exit if it was not closed before, so that the remaining
+    arrays are written before the program exits.
+    """
+
+    def __init__(self, file_path, max_queue_size=4, compression="lzf", compression_opts=None, mode="w", timeout=None):
+        """
+
+        Args:
+            file_path (str): path to the HDF5 container
+            max_queue_size (int): maximum number of arrays waiting to be written
+            compression (str): "gzip", "lzf" or None
+            compression_opts (int): compression level, for gzip
+            mode (str): "w" to create the file, "a" to add data to an existing file
+            timeout (float): maximum waiting time for the writer process, when the queue is full, on flush and on close -- in seconds (default = no limit, as long as the writer process is alive)
+
+        """
+
+        self.file_path = file_path
+        self.timeout = timeout
+
+        self.tasks = mp.Queue(max_queue_size)
+        self.errors = mp.SimpleQueue()
+        self.flushed = mp.Event()
+
+        # the writer must share the resource tracker of the main process to release the shared memory blocks
+        resource_tracker.ensure_running()
+        self.process = mp.Process(target=writer_process, args=(file_path, mode, self.tasks, self.errors, self.flushed, compression, compression_opts), daemon=True)
+        self.process.start()
+
+        self.is_closed = False
+
+        # the daemon writer process would be killed at exit with arrays still queued
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def write(self, name, data):
+        """
+        Write an array in the container, in the background. An existing dataset with the same name is replaced
+
+        Args:
+            name (str): name of the dataset
+            data (numpy.ndarray): data to write, it is copied before the call returns
+
+        """
+
+        self.put_array_task("write", name, data)
+
+    def write_shot(self, shot_datasets):
+        """
+        Append the arrays of one shot to the per-shot datasets of the container, in the background (cf. append_shot_in_hdf5). The file is flushed after each shot
+
+        Args:
+            shot_datasets (dict): arrays of the shot, by dataset name. None values are skipped, the arrays are copied before the call returns
+
+        """
+
+        descriptors = {}
+        for name, data in shot_datasets.items():
+            if data is not None:
+                shm, descriptors[name] = create_shared_array(np.asarray(data))
+                shm.close()
+
+        self.put_task(("shot", None, descriptors))
+
+    def write_configs(self, configs, group=None):
+        """
+        Write configuration dictionaries as YAML attributes of the container, in the background
+
+        Args:
+            configs (dict): configuration dictionaries, by name
+            group (str): name of the group whose attributes are written, created if needed (default = the file)
+
+        """
+
+        self.put_task(("configs", group, configs))
+
+    def put_array_task(self, kind, name, data):
+        """
+        Copy an array in a shared memory block and hand it to the writer process
+
+        Args:
+            kind (str): kind of task for the writer process
+            name (str): name of the dataset
+            data (numpy.ndarray): data to write
+
+        """
+
+        shm, descriptor = create_shared_array(data)
+        # the writer process releases the block once the data is written
+        shm.close()
+
+        self.put_task((kind, name, descriptor))
+
+    def put_task(self, task):
+        """
+        Hand a task to the writer process, blocking while the queue is full
+
+        Args:
+            task (tuple): kind, dataset name and payload of the task
+
+        """
+
+        if self.is_closed:
+            raise ValueError("The acquisition writer is closed")
+
+        self.raise_errors()
+        self.put_in_queue(task)
+
+    def put_in_queue(self, task):
+        """
+        Put a task in the queue of the writer process, waiting while the queue is full as long as the writer process is alive
+
+        Args:
+            task (tuple): task, or None to stop the writer process
+
+        """
+
+        start_time = time.monotonic()
+        while True:
+            self.check_process(start_time)
+            try:
+                self.tasks.put(task, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def flush(self):
+        """
+        Wait until all the arrays handed to the writer are written to disk
+        """
+
+        self.flushed.clear()
+        self.put_task(("flush", None, None))
+
+        start_time = time.monotonic()
+        while not self.flushed.wait(0.1):
+            self.check_process(start_time)
+
+        self.raise_errors()
+
+    def close(self):
+        """
+        Write the remaining arrays, close the container and stop the writer process
+        """
+
+        if self.is_closed:
+            return
+
+        atexit.unregister(self.close)
+
+        try:
+            self.put_in_queue(None)
+
+            start_time = time.monotonic()
+            while self.process.is_alive():
+                self.process.join(0.1)
+                self.check_process(start_time)
+            self.check_process()
+        finally:
+            self.is_closed = True
+            if self.process.is_alive():
+                self.process.terminate()
+
+        self.raise_errors()
+
+    def check_process(self, start_time=None):
+        """
+        Raise an error if the writer process died, or if the timeout is exceeded
+
+        Args:
+            start_time (float): start of the wait, cf. time.monotonic -- in seconds (default = the timeout is not checked)
+
+        """
+
+        if not self.process.is_alive() and self.process.exitcode not in [None, 0]:
+            self.raise_errors()
+            raise RuntimeError(f"The acquisition writer of {self.file_path} died (exit code {self.process.exitcode}), the data not written yet is lost")
+
+        if start_time is not None and self.timeout is not None and time.monotonic() - start_time > self.timeout:
+            raise RuntimeError(f"The acquisition writer of {self.file_path} did not catch up within {self.timeout} s")
+
+    def raise_errors(self):
+        """
+        Raise the first error that occurred in the writer process, if any
+        """
+
+        if not self.errors.empty():
+            name, error_traceback = self.errors.get()
+            raise RuntimeError(f"The acquisition writer failed to write '{name}' in {self.file_path} :\n{error_traceback}")
+
+
+def writer_process(file_path, mode, tasks, errors, flushed, compression, compression_opts):
+    """
+    Process writing the arrays handed by an AcquisitionWriter in an HDF5 container, until it receives None
+
+    Args:
+        file_path (str): path to the HDF5 container
+        mode (str): h5py opening mode of the file
+        tasks (multiprocessing.Queue): tasks (kind, dataset name, payload) to process
+        errors (multiprocessing.SimpleQueue): queue where the errors are reported
+        flushed (multiprocessing.Event): event set once the tasks handed before a flush task are processed
+        compression (str): "gzip", "lzf" or None
+        compression_opts (int): compression level, for gzip
+    """
+
+    try:
+        h5_file = h5py.File(file_path, mode)
+    except Exception:
+        errors.put((file_path, traceback.format_exc()))
+        h5_file = None
+
+    while True:
+        task = tasks.get()
+
+        if task is None:
+            break
+
+        kind, name, payload = task
+        shared_memories, arrays = [], []
+
+        try:
+            if kind == "write":
+                shared_memories, arrays = attach_shared_arrays([payload])
+            elif kind == "shot":
+                shared_memories, arrays = attach_shared_arrays(list(payload.values()))
+
+            if kind == "flush":
+                if h5_file is not None:
+                    h5_file.flush()
+                flushed.set()
+                continue
+
+            if h5_file is None:
+                continue
+
+            if kind == "configs":
+                target = h5_file if name is None else h5_file.require_group(name)
+                for config_name, config in payload.items():
+                    target.attrs[config_name] = yaml.safe_dump(config)
+
+            elif kind == "write":
+                if name in h5_file:
+                    del h5_file[name]
+                write_dataset_in_hdf5(h5_file, name, arrays[0], compression, compression_opts)
+
+            elif kind == "shot":
+                name = "shot " + str(int(h5_file.attrs.get("completed shots", 0)))
+                append_shot_in_hdf5(h5_file, dict(zip(payload.keys(), arrays)), compression, compression_opts)
+
+            h5_file.flush()
+
+        except Exception:
+            errors.put((name, traceback.format_exc()))
+
+        finally:
+            # the views must be deleted before the blocks are released
+            arrays = None
+            release_shared_memories(shared_memories)
+
+    if h5_file is not None:
+        h5_file.close()
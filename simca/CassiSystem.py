@@ -1,44 +1,195 @@
+from simca import __version__
 from simca.OpticalModel import OpticalModel
+from simca.AcquisitionWriter import AcquisitionWriter
+from simca.DiskCache import DiskCache
+from simca.CompiledInstrument import CompiledInstrument
 from simca.functions_acquisition import *
 from simca.functions_patterns_generation import *
 from simca.functions_scenes import *
 from simca.functions_general_purpose import *
+from simca.functions_raytracing import get_ray_tracing_backend
 from scipy.signal import convolve
+import copy
 
 
 
+OPTICS_SECTIONS = ["system architecture", "detector", "coded aperture", "spectral range"]
+SPECTRAL_SAMPLING_KEYS = [("spectral range", "wavelength min"), ("spectral range", "wavelength max"), ("spectral range", "number of spectral samples")]
+
+
+def get_optics_config_hash(system_config):
+    """
+    Get a hash of the optics of a system configuration, cf. CassiSystem.get_optics_hash
+
+    Args:
+        system_config (dict): system configuration
+
+    Returns:
+        str: hexadecimal hash
+    """
+
+    # the backend is hashed even when it is not set, since it changes the rounding of the propagated grids
+    system_config = dict(system_config)
+    system_config["system architecture"] = dict(system_config["system architecture"], **{"ray tracing backend": get_ray_tracing_backend(system_config)})
+
+    return get_config_hash(system_config, OPTICS_SECTIONS, extra=__version__)
+
+
 class CassiSystem():
     """Class that contains the cassi system main attributes and methods"""
 
-    def __init__(self, system_config=None, system_config_path=None):
+    # Derived attributes of the system, grouped in stages. Each stage depends on configuration keys (a whole section, or a key of a section)
+    # and on upstream stages, listed before it : when the configuration is updated, only the stages depending on the changed keys are invalidated
+    STAGES = {"optical model": {"config keys": [("system architecture",), ("detector",), ("coded aperture",)] + SPECTRAL_SAMPLING_KEYS,
+                                "stages": [],
+                                "attributes": ["optical_model"]},
+              "coded aperture grid": {"config keys": [("coded aperture",)],
+                                      "stages": [],
+                                      "attributes": ["X_coded_aper_coordinates", "Y_coded_aper_coordinates"]},
+              "detector grid": {"config keys": [("detector",)],
+                                "stages": [],
+                                "attributes": ["X_detector_coordinates_grid", "Y_detector_coordinates_grid"]},
+              "propagated grids": {"config keys": [("system architecture",)] + SPECTRAL_SAMPLING_KEYS,
+                                   "stages": ["coded aperture grid"],
+                                   "attributes": ["X_coordinates_propagated_coded_aperture", "Y_coordinates_propagated_coded_aperture"]},
+              "inverse propagated grids": {"config keys": [("system architecture",)] + SPECTRAL_SAMPLING_KEYS,
+                                           "stages": ["detector grid"],
+                                           "attributes": ["X_coordinates_inverse_propagated_detector", "Y_coordinates_inverse_propagated_detector"]},
+              "interpolation plan": {"config keys": [],
+                                     "stages": ["propagated grids", "detector grid"],
+                                     "attributes": ["interpolation_plan", "forward_operator"]},
+              "filtering cube": {"config keys": [],
+                                 "stages": ["interpolation plan", "inverse propagated grids"],
+                                 "attributes": ["filtering_cube", "list_of_filtering_cubes"]},
+              "interpolated dataset": {"config keys": [("spectral range",), ("system architecture", "system type")],
+                                       "stages": ["coded aperture grid", "detector grid"],
+                                       "attributes": ["dataset_interpolated"]},
+              "measurement": {"config keys": [("system architecture",)],
+                              "stages": ["propagated grids", "filtering cube", "interpolated dataset"],
+                              "attributes": ["measurement", "measurements", "list_of_measurements", "last_filtered_interpolated_scene", "list_of_filtered_scenes",
+                                             "interpolated_scene", "panchro", "scene_labels"]}}
+
+    # invalidated attributes set to None, as when they are not generated yet
+    RESET_ATTRIBUTES = ["interpolation_plan", "forward_operator", "X_coordinates_inverse_propagated_detector", "Y_coordinates_inverse_propagated_detector"]
+
+    # invalidated attributes recomputed on their first access, the other ones are deleted
+    RECOMPUTED_ATTRIBUTES = {"optical_model": lambda system: system.set_up_optical_model(),
+                             "X_coded_aper_coordinates": lambda system: system.set_up_coded_aperture_grid(),
+                             "Y_coded_aper_coordinates": lambda system: system.set_up_coded_aperture_grid(),
+                             "X_detector_coordinates_grid": lambda system: system.set_up_detector_grid(),
+                             "Y_detector_coordinates_grid": lambda system: system.set_up_detector_grid(),
+                             "X_coordinates_propagated_coded_aperture": lambda system: system.propagate_coded_aperture_grid(),
+                             "Y_coordinates_propagated_coded_aperture": lambda system: system.propagate_coded_aperture_grid(),
+                             "filtering_cube": lambda system: system.regenerate_filtering_cube()}
+
+    def __init__(self, system_config=None, system_config_path=None, nb_of_workers=None, cache_directory=None):
 
         """
 
         Args:
             system_config_path (str): path to the configs file
             system_config (dict): system configuration
+            nb_of_workers (int): number of worker processes used for the interpolations, 1 to interpolate in the calling process (default = number of CPUs)
+            cache_directory (str): directory of the persistent cache of the propagated grids and interpolation plans, shared by all the processes using it (default = no cache)
 
         """
 
+        self.nb_of_workers = nb_of_workers
+        self.acquisition_writer = None
+        self.disk_cache = DiskCache(cache_directory) if cache_directory is not None else None
+
         self.set_up_system(system_config=system_config, system_config_path=system_config_path)
 
+    def __getattr__(self, name):
+
+        # only called for missing attributes : the attributes invalidated by a configuration update are recomputed on their first access
+        stale_attributes = self.__dict__.get("stale_attributes")
+        if stale_attributes is None or name not in stale_attributes:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        stale_attributes.discard(name)
+        try:
+            self.RECOMPUTED_ATTRIBUTES[name](self)
+        except Exception:
+            # the attribute stays stale, so that it can be recomputed once the cause of the error is fixed
+            stale_attributes.add(name)
+            raise
+
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def __setattr__(self, name, value):
+
+        # an assigned attribute is up to date, even when it is regenerated explicitly instead of on its first access
+        stale_attributes = self.__dict__.get("stale_attributes")
+        if stale_attributes is not None:
+            stale_attributes.discard(name)
+
+        super().__setattr__(name, value)
+
     def update_config(self, system_config_path=None, system_config=None):
 
         """
-        Update the system configuration file and re-initialize the grids for the coded aperture and the detector
+        Update the system configuration file. Only the derived attributes depending on the changed keys are invalidated (cf. STAGES), and they are recomputed when they are used again
 
         Args:
             system_config_path (str): path to the configs file
-            system_config (dict): system configuration
+            system_config (dict): system configuration, it can be the current configuration modified in place
         Returns:
             dict: updated system configuration
 
         """
 
-        self.set_up_system(system_config_path=system_config_path, system_config=system_config)
+        if system_config_path is not None:
+            system_config = load_yaml_config(system_config_path)
+        elif system_config is None:
+            system_config = self.system_config
+
+        # the changes are found against a copy of the previous configuration, in case it was modified in place
+        changed_keys = get_changed_config_keys(self.previous_system_config, system_config)
+
+        self.system_config = system_config
+        self.previous_system_config = copy.deepcopy(system_config)
+
+        self.invalidate(changed_keys)
 
         return self.system_config
 
+    def invalidate(self, changed_keys):
+        """
+        Invalidate the derived attributes depending on changed configuration keys, and the attributes of the downstream stages (cf. STAGES)
+
+        Args:
+            changed_keys (list): paths of the changed keys (tuples of keys, e.g. ("detector", "number of pixels along X"), or ("detector",) for a whole section)
+
+        Returns:
+            list: names of the invalidated stages
+        """
+
+        invalidated_stages = []
+
+        for stage_name, stage in self.STAGES.items():
+            # a changed key matches a dependency if it is inside it (a key of a section) or if it contains it (a whole section)
+            depends_on_changed_keys = any(changed_key[:len(config_key)] == config_key or config_key[:len(changed_key)] == changed_key
+                                          for changed_key in changed_keys for config_key in stage["config keys"])
+
+            if not depends_on_changed_keys and not any(upstream_stage in invalidated_stages for upstream_stage in stage["stages"]):
+                continue
+
+            invalidated_stages.append(stage_name)
+
+            for attribute in stage["attributes"]:
+                if attribute in self.RESET_ATTRIBUTES:
+                    setattr(self, attribute, None)
+                elif attribute in self.__dict__ or attribute in self.stale_attributes:
+                    self.__dict__.pop(attribute, None)
+                    if attribute in self.RECOMPUTED_ATTRIBUTES:
+                        self.stale_attributes.add(attribute)
+
+        return invalidated_stages
+
     def set_up_system(self, system_config_path=None, system_config=None):
 
         """
@@ -55,33 +206,94 @@ class CassiSystem():
         elif system_config is not None:
             self.system_config = system_config
 
+        self.previous_system_config = copy.deepcopy(self.system_config)
+        self.stale_attributes = set()
+
+        self.set_up_optical_model()
+        self.set_up_coded_aperture_grid()
+        self.set_up_detector_grid()
+
+        self.interpolation_plan = None
+        self.cropped_interpolation_plan = None
+        self.forward_operator = None
+        self.X_coordinates_inverse_propagated_detector = None
+        self.Y_coordinates_inverse_propagated_detector = None
+
+    def set_up_optical_model(self):
+        """
+        Create the optical model of the system
+
+        Returns:
+            OpticalModel: optical model
+        """
+
         self.optical_model = OpticalModel(self.system_config)
 
+        return self.optical_model
+
+    def set_up_coded_aperture_grid(self):
+        """
+        Create the coordinates grid of the coded aperture
+
+        Returns:
+            tuple: X and Y coordinates of the coded aperture pixels (numpy.ndarray of shape H x L)
+        """
+
         self.X_coded_aper_coordinates, self.Y_coded_aper_coordinates = self.create_coordinates_grid(
             self.system_config["coded aperture"]["number of pixels along X"],
             self.system_config["coded aperture"]["number of pixels along Y"],
             self.system_config["coded aperture"]["pixel size along X"],
             self.system_config["coded aperture"]["pixel size along Y"])
 
+        return self.X_coded_aper_coordinates, self.Y_coded_aper_coordinates
+
+    def set_up_detector_grid(self):
+        """
+        Create the coordinates grid of the detector
+
+        Returns:
+            tuple: X and Y coordinates of the detector pixels (numpy.ndarray of shape R x C)
+        """
+
         self.X_detector_coordinates_grid, self.Y_detector_coordinates_grid = self.create_coordinates_grid(
             self.system_config["detector"]["number of pixels along X"],
             self.system_config["detector"]["number of pixels along Y"],
             self.system_config["detector"]["pixel size along X"],
             self.system_config["detector"]["pixel size along Y"])
 
-    def load_dataset(self, directory, dataset_name):
+        return self.X_detector_coordinates_grid, self.Y_detector_coordinates_grid
+
+    def load_dataset(self, directory, dataset_name, lazy=False, use_cache=False):
         """
         Loading the dataset and related attributes
 
         Args:
             directory (str): name of the directory containing the dataset
             dataset_name (str): dataset name
+            lazy (bool): if True, the dataset is a LazyDataset handle and only the region used by the acquisitions is read from the disk (cf. get_dataset)
+            use_cache (bool): if True, the dataset and its spectral resamplings are kept in the dataset cache of the process (cf. get_dataset_cache), and reused until the file is modified.
+                The cached arrays are read-only, since they are shared. The cache holds 2 GiB of arrays by default, larger datasets are not cached : the cap is raised with get_dataset_cache(max_bytes=...),
+                and lazy datasets are not counted in it (default = the dataset is loaded and resampled again by each call)
 
         Returns:
             list: a list containing the dataset (shape= R_dts x C_dts x W_dts), the corresponding wavelengths (shape= W_dts), the labeled dataset, the label names and the ignored labels
         """
 
-        dataset, wavelengths_vec, dataset_labels, label_names, ignored_labels = get_dataset(directory, dataset_name)
+        if use_cache:
+            file_path = get_dataset_path(directory, dataset_name)
+            dataset_key = ("dataset", os.path.abspath(file_path), os.stat(file_path).st_mtime_ns, lazy)
+
+            dataset_data = get_dataset_cache().get(dataset_key)
+            if dataset_data is None:
+                dataset_data = get_dataset_cache().put(dataset_key, get_dataset(directory, dataset_name, lazy=lazy))
+        else:
+            dataset_key = None
+            dataset_data = get_dataset(directory, dataset_name, lazy=lazy)
+
+        dataset, wavelengths_vec, dataset_labels, label_names, ignored_labels = dataset_data
+
+        # the key identifies the dataset in the cache as long as the dataset attribute is not replaced
+        self.dataset_cache_key = (dataset, dataset_key)
 
         self.dataset = dataset
         self.dataset_labels = dataset_labels
@@ -98,16 +310,38 @@ class CassiSystem():
 
         return list_dataset_data
 
-    def interpolate_dataset_along_wavelengths(self, new_wavelengths_sampling, chunk_size):
+    def get_region_of_interest(self):
+        """
+        Get the size of the region of the dataset seen by the instrument : the detector footprint for DD-CASSI systems, the coded aperture cropped to the dataset for SD-CASSI systems.
+        The region starts at the first row and column of the dataset, as in match_dataset_to_instrument
+
+        Returns:
+            tuple: number of rows and number of columns of the region
+        """
+
+        if self.system_config["system architecture"]["system type"] == "SD-CASSI":
+            try:
+                self.dataset
+            except :
+                raise ValueError("The dataset must be loaded first")
+
+            return crop_center(self.X_coded_aper_coordinates, self.dataset.shape[1], self.dataset.shape[0]).shape
+
+        return self.X_detector_coordinates_grid.shape
+
+    def interpolate_dataset_along_wavelengths(self, new_wavelengths_sampling, chunk_size, region_of_interest=None, kind=None, bandwidth=None):
         """
         Interpolate the dataset cube along the wavelength axis to match the system sampling
 
         Args:
             new_wavelengths_sampling (numpy.ndarray): new wavelengths on which to interpolate the dataset (shape = W)
-            chunk_size (int): chunk size for the multiprocessing
+            chunk_size (int): number of rows resampled at once
+            region_of_interest (tuple): number of rows and columns of the region to interpolate, from the first row and column of the dataset (cf. get_region_of_interest). Default is the whole dataset
+            kind (str): "linear", "cubic", "box" or "gaussian", cf. spectral_resampling_matrix (default = "resampling kind" of the "spectral range" configuration, or "linear")
+            bandwidth (float): width of the spectral response functions for the "box" and "gaussian" kinds (default = "resampling bandwidth" of the "spectral range" configuration, or the spacing of the new wavelengths)
 
         Returns:
-            numpy.ndarray : interpolated dataset cube along the wavelength axis (shape = R_dts x C_dts x W)
+            numpy.ndarray : interpolated dataset cube along the wavelength axis (shape = R_dts x C_dts x W, or cropped to the region of interest)
 
         """
         try:
@@ -115,9 +349,40 @@ class CassiSystem():
         except :
             raise ValueError("The dataset must be loaded first")
 
+        spectral_range = self.system_config["spectral range"]
+        if kind is None:
+            kind = spectral_range.get("resampling kind", "linear")
+        if bandwidth is None:
+            bandwidth = spectral_range.get("resampling bandwidth", None)
+
         if self.dataset_wavelengths[0] <= new_wavelengths_sampling[0] and self.dataset_wavelengths[-1] >= new_wavelengths_sampling[-1]:
 
-            self.dataset_interpolated = interpolate_data_along_wavelength(self.dataset,self.dataset_wavelengths,new_wavelengths_sampling, chunk_size)
+            bands = get_resampling_bands(self.dataset_wavelengths, new_wavelengths_sampling, kind)
+
+            dataset_cache_key = getattr(self, "dataset_cache_key", (None, None))
+            if dataset_cache_key[0] is self.dataset and dataset_cache_key[1] is not None:
+                interpolation_key = ("interpolated", dataset_cache_key[1], tuple(np.asarray(new_wavelengths_sampling).tolist()),
+                                     None if region_of_interest is None else tuple(region_of_interest), kind,
+                                     None if bandwidth is None else tuple(np.ravel(bandwidth).tolist()))
+                dataset_interpolated = get_dataset_cache().get(interpolation_key)
+                if dataset_interpolated is not None:
+                    self.dataset_interpolated = dataset_interpolated
+                    return self.dataset_interpolated
+            else:
+                interpolation_key = None
+
+            # the region is cropped before the interpolation, so that the pixels the instrument does not see are neither read nor interpolated
+            if region_of_interest is not None:
+                dataset = self.dataset[0:region_of_interest[0], 0:region_of_interest[1], bands]
+            else:
+                dataset = self.dataset[:, :, bands]
+
+            self.dataset_interpolated = interpolate_data_along_wavelength(dataset,self.dataset_wavelengths[bands],new_wavelengths_sampling, chunk_size,
+                                                                          kind=kind, bandwidth=bandwidth)
+
+            if interpolation_key is not None:
+                self.dataset_interpolated = get_dataset_cache().put(interpolation_key, self.dataset_interpolated)
+
             return self.dataset_interpolated
         else:
             raise ValueError("The new wavelengths sampling must be inside the dataset wavelengths range")
@@ -136,9 +401,13 @@ class CassiSystem():
 
         pattern_type = config_pattern['pattern']['type']
 
+        # an optional seed makes the random patterns reproducible, without changing the state of the global numpy random generator
+        seed = config_pattern['pattern'].get('seed')
+        rng = np.random.default_rng(seed) if seed is not None else None
+
         if pattern_type == "random":
             pattern= generate_random_pattern((self.system_config["coded aperture"]["number of pixels along Y"],self.system_config["coded aperture"]["number of pixels along X"]),
-                                        config_pattern['pattern']['ROM'])
+                                        config_pattern['pattern']['ROM'], rng=rng)
 
         elif pattern_type == "slit":
             pattern= generate_slit_pattern((self.system_config["coded aperture"]["number of pixels along Y"],self.system_config["coded aperture"]["number of pixels along X"]),
@@ -146,10 +415,10 @@ class CassiSystem():
                                       config_pattern['pattern']['slit width'])
 
         elif pattern_type == "blue-noise type 1":
-            pattern= generate_blue_noise_type_1_pattern((self.system_config["coded aperture"]["number of pixels along Y"], self.system_config["coded aperture"]["number of pixels along X"]))
+            pattern= generate_blue_noise_type_1_pattern((self.system_config["coded aperture"]["number of pixels along Y"], self.system_config["coded aperture"]["number of pixels along X"]), rng=rng)
 
         elif pattern_type == "blue-noise type 2":
-            pattern= generate_blue_noise_type_2_pattern((self.system_config["coded aperture"]["number of pixels along Y"], self.system_config["coded aperture"]["number of pixels along X"]))
+            pattern= generate_blue_noise_type_2_pattern((self.system_config["coded aperture"]["number of pixels along Y"], self.system_config["coded aperture"]["number of pixels along X"]), rng=rng)
 
         elif pattern_type == "custom h5 pattern":
             pattern= load_custom_pattern((self.system_config["coded aperture"]["number of pixels along Y"], self.system_config["coded aperture"]["number of pixels along X"]),
@@ -158,6 +427,7 @@ class CassiSystem():
             raise ValueError("patterntype is not supported for single patterngeneration, change it in the 'pattern.yml' config file")
 
         self.pattern= pattern
+        self.forward_operator = None
 
         return pattern
 
@@ -175,9 +445,13 @@ class CassiSystem():
         list_of_patterns = list()
         pattern_type = config_pattern['pattern']['type']
 
+        # an optional seed makes the random patterns reproducible, without changing the state of the global numpy random generator
+        seed = config_pattern['pattern'].get('seed')
+        rng = np.random.default_rng(seed) if seed is not None else None
+
         if pattern_type == "random":
             for i in range(number_of_patterns):
-                pattern= generate_random_pattern((self.system_config["coded aperture"]["number of pixels along Y"], self.system_config["coded aperture"]["number of pixels along X"]),config_pattern['pattern']['ROM'])
+                pattern= generate_random_pattern((self.system_config["coded aperture"]["number of pixels along Y"], self.system_config["coded aperture"]["number of pixels along X"]),config_pattern['pattern']['ROM'], rng=rng)
                 list_of_patterns.append(pattern)
 
         elif pattern_type == "slit":
@@ -192,18 +466,18 @@ class CassiSystem():
             list_of_patterns = generate_ln_orthogonal_pattern(size=(self.system_config["coded aperture"]["number of pixels along Y"],
                                                                     self.system_config["coded aperture"]["number of pixels along X"]),
                                                             W=self.system_config["spectral range"]["number of spectral samples"],
-                                                            N=number_of_patterns)
+                                                            N=number_of_patterns, rng=rng)
 
         elif pattern_type == "blue-noise type 1":
 
             for i in range(number_of_patterns):
-                pattern= generate_blue_noise_type_1_pattern((self.system_config["coded aperture"]["number of pixels along Y"], self.system_config["coded aperture"]["number of pixels along X"]))
+                pattern= generate_blue_noise_type_1_pattern((self.system_config["coded aperture"]["number of pixels along Y"], self.system_config["coded aperture"]["number of pixels along X"]), rng=rng)
                 list_of_patterns.append(pattern)
 
         elif pattern_type == "blue-noise type 2":
 
             for i in range(number_of_patterns):
-                pattern= generate_blue_noise_type_2_pattern((self.system_config["coded aperture"]["number of pixels along Y"], self.system_config["coded aperture"]["number of pixels along X"]))
+                pattern= generate_blue_noise_type_2_pattern((self.system_config["coded aperture"]["number of pixels along Y"], self.system_config["coded aperture"]["number of pixels along X"]), rng=rng)
                 list_of_patterns.append(pattern)
 
         elif pattern_type == "custom h5":
@@ -220,60 +494,361 @@ class CassiSystem():
 
 
 
-    def generate_filtering_cube(self):
+    def generate_interpolation_plan(self):
+        """
+        Generate the interpolation plan between the propagated coded aperture grids and the detector grid. The plan is reused by all following filtering cubes and SD measurements until the coded aperture grid is propagated again
+
+        Returns:
+            InterpolationPlan: interpolation plan from the propagated coded aperture grids (H x L x W) to the detector grid (R x C)
+        """
+
+        if self.disk_cache is not None:
+            # the plan only depends on the grids
+            cache_key = get_config_hash({"interpolation plan": get_arrays_hash(self.X_coordinates_propagated_coded_aperture, self.Y_coordinates_propagated_coded_aperture,
+                                                                               self.X_detector_coordinates_grid, self.Y_detector_coordinates_grid)},
+                                        extra=__version__)
+            cached_plan = self.disk_cache.load(cache_key)
+            if cached_plan is not None:
+                self.interpolation_plan = InterpolationPlan.from_arrays(**cached_plan)
+                return self.interpolation_plan
+
+        self.interpolation_plan = InterpolationPlan(X_init=self.X_coordinates_propagated_coded_aperture,
+                                                    Y_init=self.Y_coordinates_propagated_coded_aperture,
+                                                    X_target=self.X_detector_coordinates_grid,
+                                                    Y_target=self.Y_detector_coordinates_grid,
+                                                    nb_of_workers=self.nb_of_workers)
+
+        if self.disk_cache is not None:
+            self.disk_cache.save(cache_key, {"vertices": self.interpolation_plan.vertices,
+                                             "weights": self.interpolation_plan.weights,
+                                             "init_shape": np.array(self.interpolation_plan.init_shape),
+                                             "target_shape": np.array(self.interpolation_plan.target_shape)})
+
+        return self.interpolation_plan
+
+    def generate_cropped_interpolation_plan(self, X_input_grid, Y_input_grid):
+        """
+        Propagate a cropped coded aperture grid and generate its interpolation plan to the detector grid, as for the SD-CASSI measurements.
+        The plan is reused as long as the same grid is requested and the propagated grids are neither propagated again nor invalidated
+
+        Args:
+            X_input_grid (numpy.ndarray): x coordinates of the cropped coded aperture grid
+            Y_input_grid (numpy.ndarray): y coordinates of the cropped coded aperture grid
+
+        Returns:
+            InterpolationPlan: interpolation plan from the propagated cropped grids to the detector grid (R x C)
+        """
+
+        input_grid_hash = get_arrays_hash(X_input_grid, Y_input_grid)
+
+        # the plan of the last cropped grid is still the current one if the grids were not propagated again since
+        if self.cropped_interpolation_plan is not None and self.interpolation_plan is not None:
+            cropped_grid_hash, cropped_interpolation_plan = self.cropped_interpolation_plan
+            if cropped_grid_hash == input_grid_hash and cropped_interpolation_plan is self.interpolation_plan:
+                return self.interpolation_plan
+
+        self.propagate_coded_aperture_grid(X_input_grid=X_input_grid, Y_input_grid=Y_input_grid)
+        self.generate_interpolation_plan()
+
+        self.cropped_interpolation_plan = (input_grid_hash, self.interpolation_plan)
+
+        return self.interpolation_plan
+
+    def get_optics_hash(self):
+        """
+        Get a hash of the optics-relevant sections of the system configuration ("system architecture", "detector", "coded aperture" and "spectral range"),
+        of the ray tracing backend and of the library version. Systems with the same hash have the same propagated grids and interpolation plans
+
+        Returns:
+            str: hexadecimal hash
+        """
+
+        return get_optics_config_hash(self.system_config)
+
+    def propagated_grids_are_regular(self):
+        """
+        Check if the propagated coded aperture grids and the detector grid are regular, i.e. the propagation does not distort the coded aperture grid (as with the "higher-order" propagation type)
+
+        Returns:
+            bool: True if the filtering cubes can be generated with shifts of the patterns
+        """
+
+        return (is_regular_grid(self.X_coordinates_propagated_coded_aperture, self.Y_coordinates_propagated_coded_aperture)
+                and is_regular_grid(self.X_detector_coordinates_grid, self.Y_detector_coordinates_grid))
+
+    def generate_filtering_cube(self, method="forward"):
         """
         Generate filtering cube : each slice of the cube is a propagated pattern interpolated on the detector grid
 
+        Args:
+            method (str): "forward" to interpolate the propagated coded aperture grids on the detector grid, "inverse" to read the pattern at the coded aperture positions imaged on each detector pixel (see inverse_propagate_detector_grid)
+
         Returns:
            numpy.ndarray: filtering cube generated according to the optical system & the pattern configuration (R x C x W)
 
         """
 
-        self.filtering_cube = interpolate_data_on_grid_positions(data=self.pattern,
-                                                                 X_init=self.X_coordinates_propagated_coded_aperture,
-                                                                 Y_init=self.Y_coordinates_propagated_coded_aperture,
-                                                                 X_target=self.X_detector_coordinates_grid,
-                                                                 Y_target=self.Y_detector_coordinates_grid)
+        if method == "inverse":
+            if self.X_coordinates_inverse_propagated_detector is None:
+                self.inverse_propagate_detector_grid()
+
+            self.filtering_cube = generate_inverse_filtering_cubes(self.pattern,
+                                                                   self.X_coded_aper_coordinates,
+                                                                   self.Y_coded_aper_coordinates,
+                                                                   self.X_coordinates_inverse_propagated_detector,
+                                                                   self.Y_coordinates_inverse_propagated_detector)
+        elif method != "forward":
+            raise ValueError("method should be forward or inverse")
+        elif self.propagated_grids_are_regular():
+            self.filtering_cube = generate_shifted_filtering_cubes(self.pattern,
+                                                                   self.X_coordinates_propagated_coded_aperture,
+                                                                   self.Y_coordinates_propagated_coded_aperture,
+                                                                   self.X_detector_coordinates_grid,
+                                                                   self.Y_detector_coordinates_grid)
+        else:
+            if self.interpolation_plan is None:
+                self.generate_interpolation_plan()
+
+            self.filtering_cube = self.interpolation_plan.apply(self.pattern)
 
+        self.filtering_cube_method = method
+        self.filtering_cube_pattern_index = None
+        self.forward_operator = None
 
         return self.filtering_cube
 
-    def generate_multiple_filtering_cubes(self, number_of_patterns):
+    def regenerate_filtering_cube(self):
+        """
+        Generate the filtering cube again, with the method and the pattern it was last generated with : the current pattern (cf. generate_filtering_cube),
+        or the last pattern of list_of_patterns used by generate_multiple_filtering_cubes, whose filtering cubes are then generated again too
+
+        Returns:
+            numpy.ndarray: filtering cube generated according to the current optical system
+        """
+
+        method = getattr(self, "filtering_cube_method", "forward")
+        pattern_index = getattr(self, "filtering_cube_pattern_index", None)
+
+        if pattern_index is None:
+            return self.generate_filtering_cube(method=method)
+
+        return self.generate_multiple_filtering_cubes(pattern_index + 1, method=method)[-1]
+
+    def generate_multiple_filtering_cubes(self, number_of_patterns, method="forward"):
         """
         Generate multiple filtering cubes, each cube corresponds to a pattern, and for each pattern, each slice is a propagated coded apertureinterpolated on the detector grid
 
         Args:
             number_of_patterns (int): number of patterns to generate
+            method (str): "forward" or "inverse", cf. generate_filtering_cube
         Returns:
             list: filtering cubes generated according to the current optical system and the pattern configuration
 
         """
+        # the last filtering cube is kept as filtering_cube
+        self.filtering_cube_method = method
+        self.filtering_cube_pattern_index = number_of_patterns - 1
+
+        if method == "inverse":
+            if self.X_coordinates_inverse_propagated_detector is None:
+                self.inverse_propagate_detector_grid()
+
+            filtering_cubes = generate_inverse_filtering_cubes(np.array(self.list_of_patterns[:number_of_patterns]),
+                                                               self.X_coded_aper_coordinates,
+                                                               self.Y_coded_aper_coordinates,
+                                                               self.X_coordinates_inverse_propagated_detector,
+                                                               self.Y_coordinates_inverse_propagated_detector)
+            self.list_of_filtering_cubes = list(filtering_cubes)
+            self.filtering_cube = self.list_of_filtering_cubes[-1]
+
+            return self.list_of_filtering_cubes
+
+        elif method != "forward":
+            raise ValueError("method should be forward or inverse")
+
+        if self.propagated_grids_are_regular():
+            filtering_cubes = generate_shifted_filtering_cubes(np.array(self.list_of_patterns[:number_of_patterns]),
+                                                               self.X_coordinates_propagated_coded_aperture,
+                                                               self.Y_coordinates_propagated_coded_aperture,
+                                                               self.X_detector_coordinates_grid,
+                                                               self.Y_detector_coordinates_grid)
+            self.list_of_filtering_cubes = list(filtering_cubes)
+            self.filtering_cube = self.list_of_filtering_cubes[-1]
+
+            return self.list_of_filtering_cubes
+
         self.list_of_filtering_cubes = []
 
+        if self.interpolation_plan is None:
+            self.generate_interpolation_plan()
+
         for idx in range(number_of_patterns):
 
-            self.filtering_cube = interpolate_data_on_grid_positions(data=self.list_of_patterns[idx],
-                                                                     X_init=self.X_coordinates_propagated_coded_aperture,
-                                                                     Y_init=self.Y_coordinates_propagated_coded_aperture,
-                                                                     X_target=self.X_detector_coordinates_grid,
-                                                                     Y_target=self.Y_detector_coordinates_grid)
+            self.filtering_cube = self.interpolation_plan.apply(self.list_of_patterns[idx])
 
             self.list_of_filtering_cubes.append(self.filtering_cube)
 
         return self.list_of_filtering_cubes
 
-    def image_acquisition(self, use_psf=False, chunck_size=50):
+    def generate_forward_operator(self):
+        """
+        Generate the sparse forward operator H of the acquisition (pattern, propagation and spectral sum), so that measurement = H @ scene.ravel()
+        For DD-CASSI systems, the scene is sampled on the detector grid (R x C x W). For SD-CASSI systems, the scene is sampled on the last propagated coded aperture grid (H x L x W). The PSF is not included
+
+        Returns:
+            scipy.sparse.csr_matrix: forward operator (shape = (R*C) x (number of scene voxels))
+        """
+
+        if self.system_config["system architecture"]["system type"] == "DD-CASSI":
+
+            try:
+                self.filtering_cube
+            except:
+                raise ValueError("Please generate filtering cube first")
+
+            self.forward_operator = generate_dd_forward_operator(self.filtering_cube)
+
+        elif self.system_config["system architecture"]["system type"] == "SD-CASSI":
+
+            if self.interpolation_plan is None:
+                self.generate_interpolation_plan()
+
+            pattern_crop = crop_center(self.pattern, self.interpolation_plan.init_shape[1], self.interpolation_plan.init_shape[0])
+
+            self.forward_operator = generate_sd_forward_operator(pattern_crop, self.interpolation_plan)
+
+        return self.forward_operator
+
+    def apply_forward_operator(self, scene):
+        """
+        Compute the compressed measurement of a scene with the sparse forward operator
+
+        Args:
+            scene (numpy.ndarray): observed scene, sampled as expected by the forward operator (R x C x W for DD-CASSI, H x L x W for SD-CASSI)
+
+        Returns:
+            numpy.ndarray: compressed measurement (R x C)
+        """
+
+        if self.forward_operator is None:
+            self.generate_forward_operator()
+
+        if scene.size != self.forward_operator.shape[1]:
+            raise ValueError("The scene size does not match the forward operator, please generate it again")
+
+        measurement = self.forward_operator @ np.nan_to_num(scene).ravel()
+
+        return measurement.reshape(self.X_detector_coordinates_grid.shape)
+
+    def apply_adjoint_operator(self, measurement):
+        """
+        Back-project a compressed measurement in the scene space, with the exact adjoint of the forward model (transpose of the forward operator)
+
+        Args:
+            measurement (numpy.ndarray): compressed measurement (R x C)
+
+        Returns:
+            numpy.ndarray: back-projected scene, sampled as expected by the forward operator (R x C x W for DD-CASSI, H x L x W for SD-CASSI)
+        """
+
+        if self.system_config["system architecture"]["system type"] == "DD-CASSI":
+
+            try:
+                self.filtering_cube
+            except:
+                raise ValueError("Please generate filtering cube first")
+
+            back_projected_scene = generate_dd_adjoint_measurement(measurement, self.filtering_cube)
+
+        elif self.system_config["system architecture"]["system type"] == "SD-CASSI":
+
+            if self.interpolation_plan is None:
+                self.generate_interpolation_plan()
+
+            pattern_crop = crop_center(self.pattern, self.interpolation_plan.init_shape[1], self.interpolation_plan.init_shape[0])
+
+            back_projected_scene = generate_sd_adjoint_measurement(measurement, pattern_crop, self.interpolation_plan)
+
+        return back_projected_scene
+
+    def compile_instrument(self, scene_wavelengths=None, scene_shape=None, use_psf=False, kind=None, bandwidth=None):
+        """
+        Compile the current state of the instrument (pattern, filtering cube or interpolation plan, spectral resampling and PSF) in a
+        CompiledInstrument, whose measurement of a scene is a single sparse matrix-vector product. It is used to measure many scenes
+        sharing the same wavelengths sampling, without loading them in the system
+
+        Args:
+            scene_wavelengths (numpy.ndarray): wavelengths sampling of the scenes (default = wavelengths of the loaded dataset)
+            scene_shape (tuple): number of rows and columns of the scenes, for SD-CASSI systems (default = shape of the loaded dataset)
+            use_psf (bool): if True, the PSF is applied to the measurements
+            kind (str): "linear", "cubic", "box" or "gaussian", cf. spectral_resampling_matrix (default = "resampling kind" of the "spectral range" configuration, or "linear")
+            bandwidth (float): width of the spectral response functions for the "box" and "gaussian" kinds (default = "resampling bandwidth" of the "spectral range" configuration, or the spacing of the new wavelengths)
+
+        Returns:
+            CompiledInstrument: compiled instrument
+        """
+
+        if scene_wavelengths is None or (scene_shape is None and self.system_config["system architecture"]["system type"] == "SD-CASSI"):
+            try:
+                self.dataset
+            except :
+                raise ValueError("The dataset must be loaded first, or the scenes wavelengths and shape must be given")
+            if scene_wavelengths is None:
+                scene_wavelengths = self.dataset_wavelengths
+            if scene_shape is None:
+                scene_shape = self.dataset.shape[:2]
+
+        spectral_range = self.system_config["spectral range"]
+        if kind is None:
+            kind = spectral_range.get("resampling kind", "linear")
+        if bandwidth is None:
+            bandwidth = spectral_range.get("resampling bandwidth", None)
+
+        scene_wavelengths = np.asarray(scene_wavelengths)
+        system_wavelengths = self.optical_model.system_wavelengths
+
+        if scene_wavelengths[0] > system_wavelengths[0] or scene_wavelengths[-1] < system_wavelengths[-1]:
+            raise ValueError("The system wavelengths sampling must be inside the scenes wavelengths range")
+
+        bands = get_resampling_bands(scene_wavelengths, system_wavelengths, kind)
+        resampling_matrix = spectral_resampling_matrix(scene_wavelengths[bands], system_wavelengths, kind, bandwidth)
+
+        if self.system_config["system architecture"]["system type"] == "DD-CASSI":
+
+            forward_operator = self.generate_forward_operator()
+            scene_shape = self.X_detector_coordinates_grid.shape
+
+        elif self.system_config["system architecture"]["system type"] == "SD-CASSI":
+
+            X_coded_aper_coordinates_crop = crop_center(self.X_coded_aper_coordinates, scene_shape[1], scene_shape[0])
+            Y_coded_aper_coordinates_crop = crop_center(self.Y_coded_aper_coordinates, scene_shape[1], scene_shape[0])
+
+            self.generate_cropped_interpolation_plan(X_coded_aper_coordinates_crop, Y_coded_aper_coordinates_crop)
+
+            forward_operator = self.generate_forward_operator()
+            scene_shape = X_coded_aper_coordinates_crop.shape
+
+        # the spectral resampling of each pixel is folded in the forward operator
+        nb_of_scene_pixels = scene_shape[0] * scene_shape[1]
+        compiled_operator = forward_operator @ sp.kron(sp.identity(nb_of_scene_pixels, format="csr"), resampling_matrix, format="csr")
+
+        return CompiledInstrument(compiled_operator, scene_shape, self.X_detector_coordinates_grid.shape, bands=bands,
+                                  psf=self.optical_model.psf if use_psf else None)
+
+    def image_acquisition(self, use_psf=False, chunck_size=50, keep_filtered_scene=True, nb_of_threads=1):
         """
         Run the acquisition/measurement process depending on the cassi system type
 
         Args:
             chunck_size (int): default block size for the interpolation
+            keep_filtered_scene (bool): if False, the measurement is computed without the filtered scene cube (R x C x W) and last_filtered_interpolated_scene is set to None
+            nb_of_threads (int): number of threads used for the DD-CASSI measurement, if the filtered scene is not kept
 
         Returns:
             numpy.ndarray: compressed measurement (R x C)
         """
 
-        dataset = self.interpolate_dataset_along_wavelengths(self.optical_model.system_wavelengths, chunck_size)
+        dataset = self.interpolate_dataset_along_wavelengths(self.optical_model.system_wavelengths, chunck_size, region_of_interest=self.get_region_of_interest())
 
         if dataset is None:
             return None
@@ -288,9 +863,13 @@ class CassiSystem():
 
             scene = match_dataset_to_instrument(dataset, self.filtering_cube)
 
-            measurement_in_3D = generate_dd_measurement(scene, self.filtering_cube, chunck_size)
+            if keep_filtered_scene:
+                measurement_in_3D = generate_dd_measurement(scene, self.filtering_cube, chunck_size)
+                self.last_filtered_interpolated_scene = measurement_in_3D
+            else:
+                self.measurement = generate_dd_compressed_measurement(scene, self.filtering_cube, chunck_size, nb_of_threads)
+                self.last_filtered_interpolated_scene = None
 
-            self.last_filtered_interpolated_scene = measurement_in_3D
             self.interpolated_scene = scene
 
             if dataset_labels is not None:
@@ -309,46 +888,55 @@ class CassiSystem():
 
             filtered_scene = scene * np.tile(pattern_crop[..., np.newaxis], (1, 1, scene.shape[2]))
 
-            self.propagate_coded_aperture_grid(X_input_grid=X_coded_aper_coordinates_crop, Y_input_grid=Y_coded_aper_coordinates_crop)
+            interpolation_plan = self.generate_cropped_interpolation_plan(X_coded_aper_coordinates_crop, Y_coded_aper_coordinates_crop)
 
-            sd_measurement = interpolate_data_on_grid_positions(filtered_scene,
-                                                                self.X_coordinates_propagated_coded_aperture,
-                                                                self.Y_coordinates_propagated_coded_aperture,
-                                                                self.X_detector_coordinates_grid,
-                                                                self.Y_detector_coordinates_grid)
+            if keep_filtered_scene:
+                sd_measurement = interpolation_plan.apply(filtered_scene)
+                self.last_filtered_interpolated_scene = sd_measurement
+            else:
+                self.measurement = interpolation_plan.apply_and_sum(filtered_scene)
+                self.last_filtered_interpolated_scene = None
 
-            self.last_filtered_interpolated_scene = sd_measurement
             self.interpolated_scene = scene
 
             if dataset_labels is not None:
-                scene_labels = match_dataset_labels_to_instrument(dataset_labels, self.last_filtered_interpolated_scene)
+                scene_labels = match_dataset_labels_to_instrument(dataset_labels, self.X_detector_coordinates_grid)
                 self.scene_labels = scene_labels
 
         self.panchro = np.sum(self.interpolated_scene, axis=2)
 
-        if use_psf:
+        if use_psf and not keep_filtered_scene and self.optical_model.psf is not None:
+            # the filtered scene was not kept : the PSF is the same for all wavelengths, so it is applied once to the compressed measurement
+            self.measurement = convolve(self.measurement, self.optical_model.psf, mode='same')
+            self.panchro = convolve(self.panchro, self.optical_model.psf, mode='same')
+        elif use_psf:
             self.apply_psf()
         else:
             print("No PSF was applied")
 
         # Calculate the other two arrays
-        self.measurement = np.sum(self.last_filtered_interpolated_scene, axis=2)
+        if keep_filtered_scene:
+            self.measurement = np.sum(self.last_filtered_interpolated_scene, axis=2)
 
 
         return self.measurement
 
-    def multiple_image_acquisitions(self, use_psf=False, nb_of_filtering_cubes=1,chunck_size=50):
+    def multiple_image_acquisitions(self, use_psf=False, nb_of_filtering_cubes=1,chunck_size=50, batched=False):
         """
         Run the acquisition process depending on the cassi system type
 
         Args:
             chunck_size (int): default block size for the dataset
+            batched (bool): if True, the measurements of all the patterns are computed in one pass over the scene, without the filtering cubes and the filtered scenes (cf. batched_image_acquisitions)
 
         Returns:
-             list: list of compressed measurements (list of numpy.ndarray of size R x C)
+             list: list of compressed measurements (list of numpy.ndarray of size R x C), or stack of compressed measurements (numpy.ndarray of size N x R x C) if batched
         """
 
-        dataset = self.interpolate_dataset_along_wavelengths(self.optical_model.system_wavelengths, chunck_size)
+        if batched:
+            return self.batched_image_acquisitions(use_psf=use_psf, nb_of_patterns=nb_of_filtering_cubes, chunck_size=chunck_size)
+
+        dataset = self.interpolate_dataset_along_wavelengths(self.optical_model.system_wavelengths, chunck_size, region_of_interest=self.get_region_of_interest())
         if dataset is None:
             return None
         dataset_labels = self.dataset_labels
@@ -389,19 +977,16 @@ class CassiSystem():
 
             self.interpolated_scene = scene
 
+            # the cropped grid is the same for every pattern : it is propagated and triangulated only once, and reused by the following calls
+            interpolation_plan = self.generate_cropped_interpolation_plan(X_coded_aper_coordinates_crop, Y_coded_aper_coordinates_crop)
+
             for i in range(nb_of_filtering_cubes):
 
                 mask_crop = crop_center(self.list_of_patterns[i], scene.shape[1], scene.shape[0])
 
                 filtered_scene = scene * np.tile(mask_crop[..., np.newaxis], (1, 1, scene.shape[2]))
 
-                self.propagate_coded_aperture_grid(X_input_grid=X_coded_aper_coordinates_crop, Y_input_grid=Y_coded_aper_coordinates_crop)
-
-                sd_measurement_cube = interpolate_data_on_grid_positions(filtered_scene,
-                                                                    self.X_coordinates_propagated_coded_aperture,
-                                                                    self.Y_coordinates_propagated_coded_aperture,
-                                                                    self.X_detector_coordinates_grid,
-                                                                    self.Y_detector_coordinates_grid)
+                sd_measurement_cube = interpolation_plan.apply(filtered_scene)
                 self.list_of_filtered_scenes.append(sd_measurement_cube)
 
         self.panchro = np.sum(self.interpolated_scene, axis=2)
@@ -418,7 +1003,261 @@ class CassiSystem():
 
         return self.list_of_measurements
 
+    def batched_image_acquisitions(self, use_psf=False, nb_of_patterns=1, chunck_size=50):
+        """
+        Run the acquisition process for a stack of patterns (the first patterns of list_of_patterns) in one pass over the scene.
+        Each block of the scene is read once and every pattern is applied to it, through the interpolation plan of the propagated grids : the filtering cubes and the filtered scenes are never stored
+
+        Args:
+            use_psf (bool): if True, the PSF is applied to each compressed measurement
+            nb_of_patterns (int): number of patterns to use
+            chunck_size (int): default block size for the dataset and for the detector pixels
+
+        Returns:
+            numpy.ndarray: stack of compressed measurements (shape = N x R x C)
+        """
+
+        dataset = self.interpolate_dataset_along_wavelengths(self.optical_model.system_wavelengths, chunck_size, region_of_interest=self.get_region_of_interest())
+        if dataset is None:
+            return None
+        dataset_labels = self.dataset_labels
+
+        patterns = np.array(self.list_of_patterns[:nb_of_patterns])
+
+        if self.system_config["system architecture"]["system type"] == "DD-CASSI":
+
+            if self.interpolation_plan is None:
+                self.generate_interpolation_plan()
+
+            # the scene is matched to the shape of the filtering cubes, which are not generated
+            filtering_cube_shape = np.broadcast_to(0., self.X_detector_coordinates_grid.shape + (self.optical_model.nb_of_spectral_samples,))
+            scene = match_dataset_to_instrument(dataset, filtering_cube_shape)
+
+            measurements = generate_dd_batched_measurements(scene, patterns, self.interpolation_plan, chunck_size)
+
+        elif self.system_config["system architecture"]["system type"] == "SD-CASSI":
+
+            X_coded_aper_coordinates_crop = crop_center(self.X_coded_aper_coordinates,dataset.shape[1], dataset.shape[0])
+            Y_coded_aper_coordinates_crop = crop_center(self.Y_coded_aper_coordinates,dataset.shape[1], dataset.shape[0])
+
+            scene = match_dataset_to_instrument(dataset, X_coded_aper_coordinates_crop)
+
+            patterns_crop = np.array([crop_center(pattern, scene.shape[1], scene.shape[0]) for pattern in patterns])
+
+            interpolation_plan = self.generate_cropped_interpolation_plan(X_coded_aper_coordinates_crop, Y_coded_aper_coordinates_crop)
+
+            measurements = generate_sd_batched_measurements(scene, patterns_crop, interpolation_plan, chunck_size)
+
+        if dataset_labels is not None:
+            self.scene_labels = match_dataset_labels_to_instrument(dataset_labels, self.X_detector_coordinates_grid)
+
+        self.interpolated_scene = scene
+        self.list_of_filtered_scenes = None
+        self.panchro = np.sum(self.interpolated_scene, axis=2)
+
+        if use_psf and self.optical_model.psf is not None:
+            # the PSF is the same for all wavelengths : it is applied to the compressed measurements
+            measurements = convolve(measurements, self.optical_model.psf[np.newaxis, ...], mode='same')
+            self.panchro = convolve(self.panchro, self.optical_model.psf, mode='same')
+        else:
+            print("No PSF was applied")
+
+        self.measurements = measurements
+        self.list_of_measurements = list(measurements)
+
+        return self.measurements
+
+    def iterate_image_acquisitions(self, patterns=None, use_psf=False, chunck_size=50, drop_filtering_cubes=False, method="forward", nb_of_threads=1):
+        """
+        Run the acquisition process one pattern at a time, as a generator : each shot is yielded as soon as it is simulated, so that it can be saved or processed before the next one.
+        Only the filtering cube of the current shot is kept in memory (DD-CASSI), and the filtered scenes are never stored
+
+        Args:
+            patterns (iterable): coded aperture patterns (numpy.ndarray of shape H x L) to use, can be a generator (default = list_of_patterns)
+            use_psf (bool): if True, the PSF is applied to each compressed measurement
+            chunck_size (int): default block size for the dataset
+            drop_filtering_cubes (bool): if True, the filtering cube of each shot is deleted right after the measurement, and is not yielded
+            method (str): "forward" or "inverse", method used to generate the filtering cubes, cf. generate_filtering_cube
+            nb_of_threads (int): number of threads used for the DD-CASSI measurements
+
+        Yields:
+            tuple: pattern (numpy.ndarray of shape H x L), compressed measurement (numpy.ndarray of shape R x C) and metadata (dict) of the shot. The metadata contains the shot index and the filtering cube of the shot (None for SD-CASSI systems or if drop_filtering_cubes is True)
+        """
+
+        if patterns is None:
+            patterns = self.list_of_patterns
+
+        dataset = self.interpolate_dataset_along_wavelengths(self.optical_model.system_wavelengths, chunck_size, region_of_interest=self.get_region_of_interest())
+        if dataset is None:
+            return
+        dataset_labels = self.dataset_labels
+
+        system_type = self.system_config["system architecture"]["system type"]
+
+        if system_type == "DD-CASSI":
+
+            filtering_cube_shape = np.broadcast_to(0., self.X_detector_coordinates_grid.shape + (self.optical_model.nb_of_spectral_samples,))
+            scene = match_dataset_to_instrument(dataset, filtering_cube_shape)
+
+        elif system_type == "SD-CASSI":
+
+            X_coded_aper_coordinates_crop = crop_center(self.X_coded_aper_coordinates,dataset.shape[1], dataset.shape[0])
+            Y_coded_aper_coordinates_crop = crop_center(self.Y_coded_aper_coordinates,dataset.shape[1], dataset.shape[0])
+
+            scene = match_dataset_to_instrument(dataset, X_coded_aper_coordinates_crop)
 
+            # the cropped grid is the same for every pattern : it is propagated and triangulated only once, and reused by the following calls
+            interpolation_plan = self.generate_cropped_interpolation_plan(X_coded_aper_coordinates_crop, Y_coded_aper_coordinates_crop)
+
+        if dataset_labels is not None:
+            self.scene_labels = match_dataset_labels_to_instrument(dataset_labels, self.X_detector_coordinates_grid)
+
+        self.interpolated_scene = scene
+        self.panchro = np.sum(self.interpolated_scene, axis=2)
+
+        if use_psf and self.optical_model.psf is None:
+            print("No PSF was applied")
+            use_psf = False
+
+        if use_psf:
+            self.panchro = convolve(self.panchro, self.optical_model.psf, mode='same')
+
+        for idx, pattern in enumerate(patterns):
+
+            self.pattern = pattern
+
+            if system_type == "DD-CASSI":
+                filtering_cube = self.generate_filtering_cube(method=method)
+                measurement = generate_dd_compressed_measurement(scene, filtering_cube, chunck_size, nb_of_threads)
+
+            elif system_type == "SD-CASSI":
+                filtering_cube = None
+                pattern_crop = crop_center(pattern, scene.shape[1], scene.shape[0])
+                measurement = interpolation_plan.apply_and_sum(scene * pattern_crop[..., np.newaxis])
+
+            if use_psf:
+                # the PSF is the same for all wavelengths : it is applied to the compressed measurement
+                measurement = convolve(measurement, self.optical_model.psf, mode='same')
+
+            self.measurement = measurement
+
+            if drop_filtering_cubes and filtering_cube is not None:
+                del self.filtering_cube
+                filtering_cube = None
+
+            yield pattern, measurement, {"index": idx, "filtering cube": filtering_cube}
+
+    def checkpointed_image_acquisitions(self, file_path, config_pattern, nb_of_patterns, config_acquisition=None, use_psf=False, chunck_size=50,
+                                        drop_filtering_cubes=False, method="forward", compression="lzf", compression_opts=None):
+        """
+        Run multiple acquisitions with a checkpoint in an HDF5 container : the patterns and the propagated grids are saved before the first shot,
+        and each shot is appended to the container as soon as it is simulated (cf. append_shot_in_hdf5). For SD-CASSI systems, the propagated grids
+        are those of the coded aperture grid cropped to the dataset (cf. get_region_of_interest), and only their interpolation plan is computed again on restart.
+        If the container already exists (interrupted run), the patterns and propagated grids are reloaded from it and the complete shots are skipped.
+        The container must have been written with the same configurations and drop_filtering_cubes flag
+
+        Args:
+            file_path (str): path to the HDF5 container used as checkpoint
+            config_pattern (dict): configuration dictionary related to pattern generation
+            nb_of_patterns (int): number of patterns (shots) to acquire
+            config_acquisition (dict): configuration dictionary related to acquisition parameters, saved in the container
+            use_psf (bool): if True, the PSF is applied to each compressed measurement
+            chunck_size (int): default block size for the dataset
+            drop_filtering_cubes (bool): if True, the filtering cubes are not saved
+            method (str): "forward" or "inverse", method used to generate the filtering cubes, cf. generate_filtering_cube
+            compression (str): "gzip", "lzf" or None
+            compression_opts (int): compression level, for gzip
+
+        Returns:
+            str: path to the HDF5 container
+        """
+
+        configs = {"config_system": self.system_config, "config_pattern": config_pattern, "drop_filtering_cubes": drop_filtering_cubes}
+        if config_acquisition is not None:
+            configs["config_acquisition"] = config_acquisition
+
+        is_sd_cassi = self.system_config["system architecture"]["system type"] == "SD-CASSI"
+        if is_sd_cassi:
+            # the SD-CASSI measurements only propagate the coded aperture grid cropped to the dataset
+            nb_of_rows, nb_of_columns = self.get_region_of_interest()
+            X_coded_aper_coordinates_crop = crop_center(self.X_coded_aper_coordinates, nb_of_columns, nb_of_rows)
+            Y_coded_aper_coordinates_crop = crop_center(self.Y_coded_aper_coordinates, nb_of_columns, nb_of_rows)
+
+        grid_names = ["X_coordinates_propagated_coded_aperture", "Y_coordinates_propagated_coded_aperture"]
+        checkpoint = {}
+
+        if os.path.exists(file_path):
+            checkpoint, stored_configs = load_data_from_hdf5_container(file_path, names=["all_patterns"] + grid_names)
+
+            # the configurations are compared as they are stored, after a YAML round trip
+            for name in ["config_system", "config_pattern", "drop_filtering_cubes"]:
+                if name in stored_configs and stored_configs[name] != yaml.safe_load(yaml.safe_dump(configs[name])):
+                    raise ValueError(f"The checkpoint {file_path} was written with a different {name}")
+
+            if "all_patterns" in checkpoint and checkpoint["all_patterns"].shape[0] != nb_of_patterns:
+                raise ValueError(f"The checkpoint {file_path} was written for {checkpoint['all_patterns'].shape[0]} patterns, not {nb_of_patterns}")
+
+        is_resumed = "all_patterns" in checkpoint and all(name in checkpoint for name in grid_names)
+
+        if is_resumed:
+            nb_of_completed_shots = read_completed_shots(file_path)
+
+            self.list_of_patterns = list(checkpoint["all_patterns"])
+            self.X_coordinates_propagated_coded_aperture = checkpoint[grid_names[0]]
+            self.Y_coordinates_propagated_coded_aperture = checkpoint[grid_names[1]]
+            self.interpolation_plan = None
+            self.forward_operator = None
+
+            if is_sd_cassi:
+                # the plan of the reloaded cropped grids is reused by the acquisitions, which do not propagate the cropped grid again
+                self.generate_interpolation_plan()
+                self.cropped_interpolation_plan = (get_arrays_hash(X_coded_aper_coordinates_crop, Y_coded_aper_coordinates_crop), self.interpolation_plan)
+
+            print(f"Resuming the acquisitions of {file_path} at shot {nb_of_completed_shots}/{nb_of_patterns}")
+        else:
+            nb_of_completed_shots = 0
+
+            self.generate_multiple_patterns(config_pattern, nb_of_patterns)
+            if is_sd_cassi:
+                self.generate_cropped_interpolation_plan(X_coded_aper_coordinates_crop, Y_coded_aper_coordinates_crop)
+            else:
+                self.propagate_coded_aperture_grid()
+
+        with AcquisitionWriter(file_path, compression=compression, compression_opts=compression_opts, mode="a" if is_resumed else "w") as writer:
+
+            if not is_resumed:
+                writer.write_configs(configs)
+                writer.write("all_patterns", np.stack(self.list_of_patterns))
+                writer.write(grid_names[0], self.X_coordinates_propagated_coded_aperture)
+                writer.write(grid_names[1], self.Y_coordinates_propagated_coded_aperture)
+
+            shots = self.iterate_image_acquisitions(patterns=self.list_of_patterns[nb_of_completed_shots:], use_psf=use_psf, chunck_size=chunck_size,
+                                                    drop_filtering_cubes=drop_filtering_cubes, method=method)
+
+            for pattern, measurement, metadata in shots:
+                writer.write_shot({"list_of_patterns": pattern,
+                                   "list_of_compressed_measurements": measurement,
+                                   "list_of_filtering_cubes": metadata["filtering cube"]})
+
+            datasets = {"interpolated_scene": getattr(self, "interpolated_scene", None),
+                        "scene_labels": getattr(self, "scene_labels", None),
+                        "panchro": getattr(self, "panchro", None),
+                        "wavelengths": self.optical_model.system_wavelengths}
+            for name, data in datasets.items():
+                if data is not None:
+                    writer.write(name, data)
+
+        print("Acquisitions saved in " + file_path)
+
+        return file_path
+
+    def close(self):
+        """
+        Shut down the worker processes used for the interpolations, and wait for the acquisition saved in the background. The worker processes are started again on the next interpolation
+        """
+
+        close_worker_pool()
+        self.close_acquisition_writer()
 
     def create_coordinates_grid(self, nb_of_pixels_along_x, nb_of_pixels_along_y, delta_x, delta_y):
         """
@@ -461,20 +1300,57 @@ class CassiSystem():
 
         propagation_type = self.system_config["system architecture"]["propagation type"]
 
-        if propagation_type == "simca":
-            self.X_coordinates_propagated_coded_aperture, self.Y_coordinates_propagated_coded_aperture = self.optical_model.propagation_with_distorsions(X_input_grid, Y_input_grid)
+        cached_grids = None
+        if self.disk_cache is not None:
+            cache_key = get_config_hash({"optics": self.get_optics_hash(), "propagated grids": get_arrays_hash(X_input_grid, Y_input_grid)})
+            cached_grids = self.disk_cache.load(cache_key)
 
-        if propagation_type == "higher-order":
-            self.X_coordinates_propagated_coded_aperture, self.Y_coordinates_propagated_coded_aperture = self.optical_model.propagation_with_no_distorsions(X_input_grid, Y_input_grid)
+        if cached_grids is not None:
+            self.optical_model.calculate_central_dispersion()
+            self.X_coordinates_propagated_coded_aperture = cached_grids["X_coordinates_propagated_coded_aperture"]
+            self.Y_coordinates_propagated_coded_aperture = cached_grids["Y_coordinates_propagated_coded_aperture"]
+
+        else:
+            if propagation_type == "simca":
+                self.X_coordinates_propagated_coded_aperture, self.Y_coordinates_propagated_coded_aperture = self.optical_model.propagation_with_distorsions(X_input_grid, Y_input_grid)
+
+            if propagation_type == "higher-order":
+                self.X_coordinates_propagated_coded_aperture, self.Y_coordinates_propagated_coded_aperture = self.optical_model.propagation_with_no_distorsions(X_input_grid, Y_input_grid)
+
+            self.X_coordinates_propagated_coded_aperture = np.nan_to_num(self.X_coordinates_propagated_coded_aperture)
+            self.Y_coordinates_propagated_coded_aperture = np.nan_to_num(self.Y_coordinates_propagated_coded_aperture)
+
+            if self.disk_cache is not None:
+                self.disk_cache.save(cache_key, {"X_coordinates_propagated_coded_aperture": self.X_coordinates_propagated_coded_aperture,
+                                                 "Y_coordinates_propagated_coded_aperture": self.Y_coordinates_propagated_coded_aperture})
 
         self.optical_model.check_if_sampling_is_sufficiant()
 
-        self.X_coordinates_propagated_coded_aperture = np.nan_to_num(self.X_coordinates_propagated_coded_aperture)
-        self.Y_coordinates_propagated_coded_aperture = np.nan_to_num(self.Y_coordinates_propagated_coded_aperture)
+        # the previous interpolation plan and forward operator are not valid anymore for the new propagated grids
+        self.interpolation_plan = None
+        self.forward_operator = None
 
         return self.X_coordinates_propagated_coded_aperture, self.Y_coordinates_propagated_coded_aperture, self.optical_model.system_wavelengths
 
 
+    def inverse_propagate_detector_grid(self):
+        """
+        Inverse propagation of the detector grid through one CASSI system : for each detector pixel and each wavelength, find the coded aperture position imaged on this pixel
+
+        Returns:
+            tuple: coded aperture x coordinates imaged on the detector grid (3D numpy.ndarray), coded aperture y coordinates imaged on the detector grid (3D numpy.ndarray), 1D array of system wavelengths (numpy.ndarray)
+        """
+
+        propagation_type = self.system_config["system architecture"]["propagation type"]
+
+        if propagation_type == "simca":
+            self.X_coordinates_inverse_propagated_detector, self.Y_coordinates_inverse_propagated_detector = self.optical_model.inverse_propagation_with_distorsions(self.X_detector_coordinates_grid, self.Y_detector_coordinates_grid)
+
+        if propagation_type == "higher-order":
+            self.X_coordinates_inverse_propagated_detector, self.Y_coordinates_inverse_propagated_detector = self.optical_model.inverse_propagation_with_no_distorsions(self.X_detector_coordinates_grid, self.Y_detector_coordinates_grid)
+
+        return self.X_coordinates_inverse_propagated_detector, self.Y_coordinates_inverse_propagated_detector, self.optical_model.system_wavelengths
+
     def apply_psf(self):
         """
         Apply the PSF to the last measurement
@@ -502,31 +1378,62 @@ class CassiSystem():
 
 
 
-    def save_acquisition(self, config_pattern, config_acquisition):
+    def save_acquisition(self, config_pattern, config_acquisition, compression="lzf", compression_opts=None, asynchronous=False):
         """
-        Save the all data related to an acquisition
+        Save the all data related to an acquisition in a single HDF5 container ("acquisition.h5"), with the configuration files as attributes.
+        The arrays are chunked for per-wavelength slice reads, compressed and losslessly downcasted (cf. save_data_in_hdf5_container)
 
         Args:
             config_pattern (dict): configuration dictionary related to pattern generation
             config_acquisition (dict): configuration dictionary related to acquisition parameters
+            compression (str): "gzip", "lzf" or None
+            compression_opts (int): compression level, for gzip
+            asynchronous (bool): if True, the arrays are written in the background by acquisition_writer and the method returns as soon as they are copied. The writer is closed by the next asynchronous save, by close() or at exit
 
+        Returns:
+            str: path to the HDF5 container
         """
 
         self.result_directory = initialize_acquisitions_directory(config_acquisition)
 
-        save_config_file("config_system",self.system_config,self.result_directory)
-        save_config_file("config_pattern",config_pattern,self.result_directory)
-        save_config_file("config_acquisition",config_acquisition,self.result_directory)
-        save_data_in_hdf5("interpolated_scene",self.interpolated_scene, self.result_directory)
-        try:
-            save_data_in_hdf5("scene_labels",self.scene_labels,self.result_directory)
-        except :
-            pass
-        save_data_in_hdf5("filtered_interpolated_scene",self.last_filtered_interpolated_scene, self.result_directory)
-        save_data_in_hdf5("measurement",self.measurement,self.result_directory)
-        save_data_in_hdf5("panchro",self.panchro,self.result_directory)
-        save_data_in_hdf5("filtering_cube",self.filtering_cube,self.result_directory)
-        save_data_in_hdf5("pattern",self.pattern,self.result_directory)
-        save_data_in_hdf5("wavelengths",self.optical_model.system_wavelengths,self.result_directory)
-
-        print("Acquisition saved in " + self.result_directory)
+        datasets = {"interpolated_scene": self.interpolated_scene,
+                    "scene_labels": getattr(self, "scene_labels", None),
+                    "filtered_interpolated_scene": self.last_filtered_interpolated_scene,
+                    "measurement": self.measurement,
+                    "panchro": self.panchro,
+                    "filtering_cube": getattr(self, "filtering_cube", None),
+                    "pattern": self.pattern,
+                    "wavelengths": self.optical_model.system_wavelengths}
+
+        configs = {"config_system": self.system_config,
+                   "config_pattern": config_pattern,
+                   "config_acquisition": config_acquisition}
+
+        file_path = os.path.join(self.result_directory, "acquisition.h5")
+
+        if asynchronous:
+            self.close_acquisition_writer()
+
+            self.acquisition_writer = AcquisitionWriter(file_path, compression=compression, compression_opts=compression_opts)
+            self.acquisition_writer.write_configs(configs)
+            for name, data in datasets.items():
+                if data is not None:
+                    self.acquisition_writer.write(name, data)
+
+            print("Acquisition being saved in " + file_path)
+
+        else:
+            save_data_in_hdf5_container(file_path, datasets, configs, compression=compression, compression_opts=compression_opts)
+
+            print("Acquisition saved in " + file_path)
+
+        return file_path
+
+    def close_acquisition_writer(self):
+        """
+        Wait until the acquisition saved in the background is written, and stop the writer. Errors of the writer are raised here
+        """
+
+        if self.acquisition_writer is not None:
+            acquisition_writer, self.acquisition_writer = self.acquisition_writer, None
+            acquisition_writer.close()
@@ -0,0 +1,146 @@
+import numpy as np
+import scipy.sparse as sp
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from scipy.signal import convolve
+
+
+class CompiledInstrument:
+    """
+    Fixed state of an instrument (forward operator for one pattern, spectral resampling and PSF), compiled once and applied to many scenes.
+
+    The spectral resampling matrix is folded in the sparse forward operator, so that the measurement of a scene is a single sparse
+    matrix-vector product on the scene cropped to the region and the bands seen by the instrument. The scenes must share the wavelengths
+    sampling the instrument was compiled for (cf. CassiSystem.compile_instrument).
+    """
+
+    def __init__(self, forward_operator, scene_shape, measurement_shape, bands=slice(None), psf=None):
+        """
+
+        Args:
+            forward_operator (scipy.sparse.csr_matrix): forward operator, including the spectral resampling (shape = (R*C) x (H*L*W_dts))
+            scene_shape (tuple): number of rows and columns of the region of the scenes seen by the instrument (H x L)
+            measurement_shape (tuple): shape of the measurements (R x C)
+            bands (slice): bands of the scenes used by the spectral resampling
+            psf (numpy.ndarray): PSF applied to the measurements (default = no PSF)
+
+        """
+
+        self.forward_operator = sp.csr_matrix(forward_operator)
+        self.scene_shape = tuple(scene_shape)
+        self.measurement_shape = tuple(measurement_shape)
+        self.bands = bands
+        self.psf = psf
+
+        self.nb_of_bands = self.forward_operator.shape[1] // (self.scene_shape[0] * self.scene_shape[1])
+
+    def prepare_scene(self, scene):
+        """
+        Crop (or pad with zeros) a scene to the region and the bands seen by the instrument
+
+        Args:
+            scene (numpy.ndarray or LazyDataset): scene or tile (shape = R_dts x C_dts x W_dts), only the region seen by the instrument is read from a LazyDataset
+
+        Returns:
+            numpy.ndarray: flattened scene (shape = H*L*W_dts)
+        """
+
+        nb_of_rows, nb_of_columns = self.scene_shape
+
+        region = np.nan_to_num(np.asarray(scene[0:nb_of_rows, 0:nb_of_columns, self.bands], dtype=np.float64))
+
+        if region.shape[2] != self.nb_of_bands:
+            raise ValueError("The scene bands do not match the wavelengths sampling the instrument was compiled for")
+
+        if region.shape[0] < nb_of_rows or region.shape[1] < nb_of_columns:
+            region = np.pad(region, ((0, nb_of_rows - region.shape[0]), (0, nb_of_columns - region.shape[1]), (0, 0)), mode="constant")
+
+        return region.ravel()
+
+    def apply(self, scene):
+        """
+        Compute the compressed measurement of a scene
+
+        Args:
+            scene (numpy.ndarray or LazyDataset): scene or tile (shape = R_dts x C_dts x W_dts)
+
+        Returns:
+            numpy.ndarray: compressed measurement (shape = R x C)
+        """
+
+        return self.apply_to_batch([scene])[0]
+
+    def apply_to_batch(self, scenes):
+        """
+        Compute the compressed measurements of a batch of scenes, with a single sparse matrix product
+
+        Args:
+            scenes (list): scenes or tiles (shape = R_dts x C_dts x W_dts)
+
+        Returns:
+            numpy.ndarray: compressed measurements (shape = N x R x C)
+        """
+
+        batch = np.stack([self.prepare_scene(scene) for scene in scenes], axis=1)
+
+        measurements = np.asarray(self.forward_operator @ batch).T.reshape((len(scenes),) + self.measurement_shape)
+
+        if self.psf is not None:
+            measurements = np.stack([convolve(measurement, self.psf, mode='same') for measurement in measurements])
+
+        return measurements
+
+    def map(self, scenes, batch_size=1, nb_of_threads=1):
+        """
+        Compute the compressed measurements of an iterable of scenes, as a generator : the scenes are read as the measurements are consumed,
+        so that the iterable can be larger than the memory
+
+        Args:
+            scenes (iterable): scenes or tiles (shape = R_dts x C_dts x W_dts), can be a generator
+            batch_size (int): number of scenes measured with one sparse matrix product
+            nb_of_threads (int): number of threads measuring batches in parallel (scipy releases the GIL in the sparse products)
+
+        Yields:
+            numpy.ndarray: compressed measurement of each scene (shape = R x C), in the order of the scenes
+        """
+
+        batches = iterate_batches(scenes, batch_size)
+
+        if nb_of_threads <= 1:
+            for batch in batches:
+                yield from self.apply_to_batch(batch)
+            return
+
+        with ThreadPoolExecutor(max_workers=nb_of_threads) as executor:
+            # a bounded number of batches is in flight, so that the whole iterable is never loaded at once
+            futures = deque()
+            for batch in batches:
+                futures.append(executor.submit(self.apply_to_batch, batch))
+                if len(futures) >= 2 * nb_of_threads:
+                    yield from futures.popleft().result()
+
+            while futures:
+                yield from futures.popleft().result()
+
+
+def iterate_batches(iterable, batch_size):
+    """
+    Split an iterable in lists of consecutive items
+
+    Args:
+        iterable (iterable): items to split, can be a generator
+        batch_size (int): maximum number of items of a batch
+
+    Yields:
+        list: consecutive items
+    """
+
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
@@ -0,0 +1,174 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+class DatasetCache:
+    """
+    Least recently used cache of datasets (loaded and spectrally resampled cubes), capped by the memory used by its arrays.
+
+    The arrays stored in the cache are made read-only, since they are shared by all the users of the cache. When the cache is full,
+    the least recently used entries are evicted until the new entry fits, and an entry larger than the cap is not stored. The number of
+    hits and misses is counted.
+    """
+
+    def __init__(self, max_bytes=2 * 1024 ** 3):
+        """
+
+        Args:
+            max_bytes (int): maximum memory used by the arrays of the cache -- in bytes (default = 2 GiB)
+
+        """
+
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        """
+        Get an entry of the cache, and mark it as the most recently used
+
+        Args:
+            key (tuple): key of the entry
+            default: value returned if the key is not in the cache
+
+        Returns:
+            cached value, or default
+        """
+
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value):
+        """
+        Store an entry in the cache, evicting the least recently used entries if needed. Values larger than the cache are not stored
+
+        Args:
+            key (tuple): key of the entry
+            value: value to store, its numpy arrays are made read-only
+
+        Returns:
+            the stored value
+        """
+
+        nbytes = get_size_in_bytes(value)
+
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+
+            if nbytes > self.max_bytes:
+                return value
+
+            set_read_only(value)
+
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            self.evict()
+
+        return value
+
+    def resize(self, max_bytes):
+        """
+        Change the memory cap of the cache, evicting the least recently used entries if needed
+
+        Args:
+            max_bytes (int): maximum memory used by the arrays of the cache -- in bytes
+
+        """
+
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.evict()
+
+    def evict(self):
+        """
+        Evict the least recently used entries until the memory cap is respected. The lock must be held by the caller
+        """
+
+        while self.nbytes > self.max_bytes and self.entries:
+            _, (_, nbytes) = self.entries.popitem(last=False)
+            self.nbytes -= nbytes
+
+    def clear(self):
+        """
+        Remove all the entries and reset the counters
+        """
+
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def get_statistics(self):
+        """
+        Get the usage statistics of the cache
+
+        Returns:
+            dict: number of hits, misses and entries, memory used and memory cap -- in bytes
+        """
+
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "entries": len(self.entries),
+                    "bytes": self.nbytes,
+                    "max bytes": self.max_bytes}
+
+
+def get_size_in_bytes(value):
+    """
+    Compute the memory used by the numpy arrays of a value. Arrays stored on disk (memory maps, lazy handles) are not counted
+
+    Args:
+        value: numpy array, or tuple, list or dict of values
+
+    Returns:
+        int: memory used -- in bytes
+    """
+
+    if isinstance(value, np.memmap):
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(get_size_in_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(get_size_in_bytes(item) for item in value.values())
+
+    return 0
+
+
+def set_read_only(value):
+    """
+    Make the numpy arrays of a value read-only
+
+    Args:
+        value: numpy array, or tuple, list or dict of values
+
+    """
+
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            set_read_only(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            set_read_only(item)
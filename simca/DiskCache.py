@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+class DiskCache:
+    """
+    Persistent cache of arrays in a directory, shared by all the processes using the same directory.
+
+    Each entry is a sub-directory named after its key (a hash of everything the arrays depend on), holding one .npy file per array,
+    so that the arrays can be memory-mapped when they are loaded. The entries are written in a temporary directory which is then
+    renamed, so that concurrent processes never see a partial entry.
+    """
+
+    def __init__(self, directory):
+        """
+
+        Args:
+            directory (str): directory of the cache, created if needed
+
+        """
+
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def get_entry_path(self, key):
+        """
+        Get the path to the directory of an entry
+
+        Args:
+            key (str): key of the entry
+
+        Returns:
+            str: path to the directory of the entry
+        """
+
+        return os.path.join(self.directory, key)
+
+    def load(self, key, mmap_mode="r"):
+        """
+        Load the arrays of an entry
+
+        Args:
+            key (str): key of the entry
+            mmap_mode (str): memory-map mode of the arrays, cf. numpy.load (None to read them in memory)
+
+        Returns:
+            dict: arrays of the entry by name, or None if the entry is not in the cache
+        """
+
+        entry_path = self.get_entry_path(key)
+
+        if not os.path.isdir(entry_path):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return {file_name[:-len(".npy")]: np.load(os.path.join(entry_path, file_name), mmap_mode=mmap_mode)
+                for file_name in sorted(os.listdir(entry_path)) if file_name.endswith(".npy")}
+
+    def save(self, key, arrays):
+        """
+        Save the arrays of an entry. If another process saved the same entry in the meantime, its arrays are kept
+
+        Args:
+            key (str): key of the entry
+            arrays (dict): arrays to save by name
+
+        """
+
+        temporary_path = tempfile.mkdtemp(dir=self.directory, prefix="." + key + "-")
+
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(temporary_path, name + ".npy"), np.asarray(array))
+
+            os.rename(temporary_path, self.get_entry_path(key))
+
+        except OSError:
+            # the entry was saved by another process
+            if not os.path.isdir(self.get_entry_path(key)):
+                raise
+
+        finally:
+            if os.path.isdir(temporary_path):
+                shutil.rmtree(temporary_path)
+
+    def clear(self):
+        """
+        Remove all the entries of the cache
+        """
+
+        for entry_name in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory, entry_name), ignore_errors=True)
@@ -0,0 +1,232 @@
+import numpy as np
+
+
+class LazyDataset:
+    """
+    Lazy handle on a hyperspectral cube stored on disk (h5py dataset or numpy memory map), so that only the region and the bands
+    used by the instrument are read.
+
+    Indexing works like for a numpy array (slices or integers along the spatial axes, any numpy index along the bands axis) and returns
+    a numpy array. The region is read tile by tile, converted to the data type of the handle, and the pixels with a NaN in any band of
+    the cube are set to 0, as when the dataset is loaded eagerly. The NaN mask of a tile is computed from all the bands of the pixels of
+    the tile only, and kept for the following reads of the same tile.
+    """
+
+    def __init__(self, source, dtype=np.float32, tile_size=256):
+        """
+
+        Args:
+            source (h5py.Dataset or numpy.memmap): cube stored on disk (shape = R_dts x C_dts x W_dts)
+            dtype (numpy.dtype): data type of the arrays read from the handle
+            tile_size (int): size of the tiles read from the disk, along each spatial axis
+
+        """
+
+        self.source = source
+        self.dtype = np.dtype(dtype)
+        self.tile_size = tile_size
+        # NaN masks of the tiles already read, by rows and columns of the tile
+        self.nan_masks = {}
+
+    @property
+    def shape(self):
+        return tuple(self.source.shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def get_nan_mask(self, rows, columns, tile=None):
+        """
+        Get the mask of the pixels of a tile with a NaN in any band, all the bands of the tile are read on first use
+
+        Args:
+            rows (range): rows of the tile
+            columns (range): columns of the tile
+            tile (numpy.ndarray): all the bands of the tile, if they are already read (default = read from the disk)
+
+        Returns:
+            numpy.ndarray: NaN mask of the tile (shape = len(rows) x len(columns))
+        """
+
+        key = (rows.start, rows.stop, rows.step, columns.start, columns.stop, columns.step)
+
+        if key not in self.nan_masks:
+            if np.issubdtype(self.dtype, np.floating):
+                if tile is None:
+                    tile = np.asarray(self.source[range_to_slice(rows), range_to_slice(columns)], dtype=self.dtype)
+                self.nan_masks[key] = np.isnan(tile.sum(axis=-1))
+            else:
+                self.nan_masks[key] = np.zeros((len(rows), len(columns)), dtype=bool)
+
+        return self.nan_masks[key]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype, copy=False)
+
+    def __getitem__(self, key):
+        """
+        Read a region of the cube
+
+        Args:
+            key (tuple): numpy-like index
+
+        Returns:
+            numpy.ndarray: region of the cube, with NaN pixels set to 0
+        """
+
+        rows, columns, squeezed_axes, bands_key = parse_spatial_key(key, self.shape)
+
+        # shape of the bands read, computed without reading the data
+        bands_shape = np.broadcast_to(0, self.shape[2:])[bands_key].shape
+        region = np.empty((len(rows), len(columns)) + bands_shape, dtype=self.dtype)
+        reads_all_bands = len(bands_key) == 1 and isinstance(bands_key[0], slice) and bands_key[0] == slice(None)
+
+        for i in range(0, len(rows), self.tile_size):
+            for j in range(0, len(columns), self.tile_size):
+                tile_rows = rows[i:i + self.tile_size]
+                tile_columns = columns[j:j + self.tile_size]
+
+                tile = np.asarray(self.source[(range_to_slice(tile_rows), range_to_slice(tile_columns)) + bands_key], dtype=self.dtype)
+
+                # No NaN accepted : the pixels with a NaN in any band are set to 0, even in the bands not read
+                if np.issubdtype(self.dtype, np.floating):
+                    # the mask is computed from the tile itself when all its bands are read
+                    tile[self.get_nan_mask(tile_rows, tile_columns, tile if reads_all_bands else None)] = 0
+
+                region[i:i + len(tile_rows), j:j + len(tile_columns)] = tile
+
+        if squeezed_axes:
+            region = region[tuple(0 if axis in squeezed_axes else slice(None) for axis in range(2))]
+
+        return region
+
+
+class LazyLabels:
+    """
+    Lazy view on the labels of a LazyDataset, so that the labels of the pixels with a NaN in any band are reset to 0 as when the
+    dataset is loaded eagerly, with the NaN masks of the tiles read from the dataset only.
+
+    Indexing works like for a numpy array (integers or slices) and returns a numpy array.
+    """
+
+    def __init__(self, labels, dataset):
+        """
+
+        Args:
+            labels (numpy.ndarray): labels of the dataset (shape = R_dts x C_dts)
+            dataset (LazyDataset): dataset giving the NaN masks
+
+        """
+
+        self.labels = labels
+        self.dataset = dataset
+
+    @property
+    def shape(self):
+        return tuple(self.labels.shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return self.labels.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        labels = self[...]
+        return labels if dtype is None else labels.astype(dtype, copy=False)
+
+    def __getitem__(self, key):
+        """
+        Read a region of the labels
+
+        Args:
+            key (tuple): numpy-like index
+
+        Returns:
+            numpy.ndarray: region of the labels, with the labels of the NaN pixels set to 0
+        """
+
+        rows, columns, squeezed_axes, _ = parse_spatial_key(key, self.shape)
+
+        region = np.array(self.labels[range_to_slice(rows), range_to_slice(columns)])
+
+        tile_size = self.dataset.tile_size
+        for i in range(0, len(rows), tile_size):
+            for j in range(0, len(columns), tile_size):
+                tile_rows = rows[i:i + tile_size]
+                tile_columns = columns[j:j + tile_size]
+                region[i:i + len(tile_rows), j:j + len(tile_columns)][self.dataset.get_nan_mask(tile_rows, tile_columns)] = 0
+
+        if squeezed_axes:
+            region = region[tuple(0 if axis in squeezed_axes else slice(None) for axis in range(2))]
+
+        return region
+
+
+def parse_spatial_key(key, shape):
+    """
+    Split a numpy-like index in the rows and columns it selects and the index along the other axes
+
+    Args:
+        key (tuple): numpy-like index, with integers or slices along the spatial axes
+        shape (tuple): shape of the indexed array
+
+    Returns:
+        tuple: rows (range), columns (range), spatial axes indexed by an integer (list) and index along the other axes (tuple)
+    """
+
+    if not isinstance(key, tuple):
+        key = (key,)
+
+    ndim = len(shape)
+    if any(k is Ellipsis for k in key):
+        idx = next(i for i, k in enumerate(key) if k is Ellipsis)
+        key = key[:idx] + (slice(None),) * (ndim - len(key) + 1) + key[idx + 1:]
+    key = key + (slice(None),) * (ndim - len(key))
+
+    spatial_ranges = []
+    squeezed_axes = []
+    for axis, k in enumerate(key[:2]):
+        size = shape[axis]
+        if isinstance(k, (int, np.integer)):
+            if not -size <= k < size:
+                raise IndexError(f"index {k} is out of bounds for axis {axis} with size {size}")
+            spatial_ranges.append(range(k % size, k % size + 1))
+            squeezed_axes.append(axis)
+        elif isinstance(k, slice):
+            spatial_ranges.append(range(*k.indices(size)))
+        else:
+            raise IndexError("Only integers and slices are supported along the spatial axes of a LazyDataset")
+
+    rows, columns = spatial_ranges
+
+    return rows, columns, squeezed_axes, key[2:]
+
+
+def range_to_slice(indices):
+    """
+    Convert a range of indices to the equivalent slice
+
+    Args:
+        indices (range): range of indices
+
+    Returns:
+        slice: slice selecting the same indices
+    """
+
+    # a negative stop would be counted from the end of the axis
+    return slice(indices.start, indices.stop if indices.stop >= 0 else None, indices.step)
@@ -1,10 +1,13 @@
 from simca.functions_general_purpose import *
+from simca.functions_raytracing import *
 
 class OpticalModel:
     """
     Class that contains the optical model caracteristics and propagation models
     """
     def __init__(self, system_config):
+        # no PSF is applied until one is generated (cf. generate_psf)
+        self.psf = None
         self.set_optical_config(system_config)
 
     def update_config(self, new_config):
@@ -37,6 +40,13 @@ class OpticalModel:
         self.delta_alpha_c = math.radians(config["system architecture"]["dispersive element"]["delta alpha c"])
         self.delta_beta_c = math.radians(config["system architecture"]["dispersive element"]["delta beta c"])
 
+        # the fused ray tracing kernels are opt-in : they do not round like the numpy propagation
+        self.ray_tracing_backend = get_ray_tracing_backend(config)
+        if self.ray_tracing_backend not in ["numpy", "numba"]:
+            raise ValueError(f"Unknown ray tracing backend : {self.ray_tracing_backend}")
+        if self.ray_tracing_backend == "numba" and numba is None:
+            raise ValueError("The numba ray tracing backend requires numba to be installed")
+
         self.nb_of_det_pixels_X = config["detector"]["number of pixels along X"]
         self.nb_of_det_pixels_Y = config["detector"]["number of pixels along Y"]
         self.nb_of_coded_apert_pixels_X = config["coded aperture"]["number of pixels along X"]
@@ -46,13 +56,14 @@ class OpticalModel:
                              config["spectral range"]["wavelength max"],
                              config["spectral range"]["number of spectral samples"])
 
-    def propagation_with_distorsions(self, X_input_grid, Y_input_grid):
+    def propagation_with_distorsions(self, X_input_grid, Y_input_grid, max_nb_of_rays=2**22):
         """
         Propagate the coded aperture coded_aperture through one CASSI system
 
         Args:
             X_input_grid (numpy.ndarray): x coordinates grid
             Y_input_grid (numpy.ndarray): y coordinates grid
+            max_nb_of_rays (int): maximum number of rays (pixels x wavelengths) propagated at once, to cap the memory usage
 
         Returns:
             tuple: X coordinates of the propagated coded aperture grids, Y coordinates of the propagated coded aperture grids
@@ -60,23 +71,41 @@ class OpticalModel:
 
         self.calculate_central_dispersion()
 
-        X_coordinates_propagated_coded_aperture = np.zeros((X_input_grid.shape[0],X_input_grid.shape[1],
+        X_coordinates_propagated_coded_aperture = np.zeros((X_input_grid.shape[0] * X_input_grid.shape[1],
                                                             self.nb_of_spectral_samples))
-        Y_coordinates_propagated_coded_aperture = np.zeros((X_input_grid.shape[0],X_input_grid.shape[1],
+        Y_coordinates_propagated_coded_aperture = np.zeros((X_input_grid.shape[0] * X_input_grid.shape[1],
                                                             self.nb_of_spectral_samples))
 
-        X_input_grid_flatten = X_input_grid.flatten()
-        Y_input_grid_flatten = Y_input_grid.flatten()
+        if self.ray_tracing_backend == "numba":
+            lba_array = np.linspace(self.system_wavelengths[0], self.system_wavelengths[-1], self.nb_of_spectral_samples)
+
+            X_coordinates_propagated_coded_aperture, Y_coordinates_propagated_coded_aperture = self.propagate_through_arm_fused(X_input_grid.flatten(),
+                                                                                                                              Y_input_grid.flatten(),
+                                                                                                                              n=self.sellmeier(lba_array),
+                                                                                                                              lba=lba_array)
+
+            return (X_coordinates_propagated_coded_aperture.reshape(X_input_grid.shape[0], X_input_grid.shape[1], -1),
+                    Y_coordinates_propagated_coded_aperture.reshape(X_input_grid.shape[0], X_input_grid.shape[1], -1))
 
-        for idx,lba in enumerate(np.linspace(self.system_wavelengths[0], self.system_wavelengths[-1],self.nb_of_spectral_samples)):
+        # pixels along the first axis and wavelengths along the second axis, broadcasted together during the propagation
+        X_input_grid_flatten = X_input_grid.reshape(-1, 1)
+        Y_input_grid_flatten = Y_input_grid.reshape(-1, 1)
+        lba_array = np.linspace(self.system_wavelengths[0], self.system_wavelengths[-1], self.nb_of_spectral_samples).reshape(1, -1)
+        n_array = self.sellmeier(lba_array)
 
-            n_array_flatten = np.full(X_input_grid_flatten.shape, self.sellmeier(lba))
-            lba_array_flatten = np.full(X_input_grid_flatten.shape, lba)
+        chunk_size = max(1, max_nb_of_rays // self.nb_of_spectral_samples)
 
-            X_propagated_coded_aperture, Y_propagated_coded_aperture = self.propagate_through_arm(X_input_grid_flatten,Y_input_grid_flatten,n=n_array_flatten,lba=lba_array_flatten)
+        for i in range(0, X_input_grid_flatten.shape[0], chunk_size):
 
-            X_coordinates_propagated_coded_aperture[:,:,idx] = X_propagated_coded_aperture.reshape(X_input_grid.shape)
-            Y_coordinates_propagated_coded_aperture[:,:,idx] = Y_propagated_coded_aperture.reshape(Y_input_grid.shape)
+            X_propagated_coded_aperture, Y_propagated_coded_aperture = self.propagate_through_arm(X_input_grid_flatten[i:i + chunk_size],
+                                                                                                  Y_input_grid_flatten[i:i + chunk_size],
+                                                                                                  n=n_array, lba=lba_array)
+
+            X_coordinates_propagated_coded_aperture[i:i + chunk_size] = X_propagated_coded_aperture
+            Y_coordinates_propagated_coded_aperture[i:i + chunk_size] = Y_propagated_coded_aperture
+
+        X_coordinates_propagated_coded_aperture = X_coordinates_propagated_coded_aperture.reshape(X_input_grid.shape[0], X_input_grid.shape[1], -1)
+        Y_coordinates_propagated_coded_aperture = Y_coordinates_propagated_coded_aperture.reshape(X_input_grid.shape[0], X_input_grid.shape[1], -1)
 
         return X_coordinates_propagated_coded_aperture, Y_coordinates_propagated_coded_aperture
 
@@ -109,6 +138,96 @@ class OpticalModel:
 
         return X_coordinates_propagated_coded_aperture, Y_coordinates_propagated_coded_aperture
 
+    def inverse_propagation_with_distorsions(self, X_detector_grid, Y_detector_grid, nb_of_iterations=20, tolerance=1e-6, max_nb_of_rays=2**20):
+        """
+        Inverse of propagation_with_distorsions : find the coded aperture positions that are imaged on the detector grid, for each wavelength.
+        The system arm is inverted with a vectorized Newton iteration (jacobian estimated with finite differences), starting from the inverse of the model without distorsions
+
+        Args:
+            X_detector_grid (numpy.ndarray): X coordinates of the detector grid (shape = R x C)
+            Y_detector_grid (numpy.ndarray): Y coordinates of the detector grid (shape = R x C)
+            nb_of_iterations (int): maximum number of Newton iterations
+            tolerance (float): maximum distance between the propagated positions and the detector grid to stop the iterations -- in um
+            max_nb_of_rays (int): maximum number of rays (pixels x wavelengths) traced at once, to cap the memory usage
+
+        Returns:
+            tuple: X coordinates, Y coordinates of the coded aperture positions imaged on the detector grid (shape = R x C x W). Rays that cannot go through the system are NaN
+        """
+
+        self.calculate_central_dispersion()
+
+        X_detector_grid_flatten = X_detector_grid.reshape(-1, 1)
+        Y_detector_grid_flatten = Y_detector_grid.reshape(-1, 1)
+        lba_array = np.linspace(self.system_wavelengths[0], self.system_wavelengths[-1], self.nb_of_spectral_samples).reshape(1, -1)
+        n_array = self.sellmeier(lba_array)
+
+        X_coordinates_coded_aperture = np.zeros((X_detector_grid_flatten.shape[0], self.nb_of_spectral_samples))
+        Y_coordinates_coded_aperture = np.zeros((X_detector_grid_flatten.shape[0], self.nb_of_spectral_samples))
+
+        # finite differences step of the jacobian -- in um
+        step = 1e-3
+
+        chunk_size = max(1, max_nb_of_rays // self.nb_of_spectral_samples)
+
+        for i in range(0, X_detector_grid_flatten.shape[0], chunk_size):
+
+            X_target = X_detector_grid_flatten[i:i + chunk_size]
+            Y_target = Y_detector_grid_flatten[i:i + chunk_size]
+
+            # initial guess : inverse of the propagation model without distorsions
+            X = self.X0_propagated.reshape(1, -1) - X_target
+            Y = self.Y0_propagated.reshape(1, -1) - Y_target
+
+            for _ in range(nb_of_iterations):
+
+                X_propagated, Y_propagated = self.propagate_through_arm(X, Y, n=n_array, lba=lba_array)
+                X_residual = X_propagated - X_target
+                Y_residual = Y_propagated - Y_target
+
+                residual = np.maximum(np.abs(X_residual), np.abs(Y_residual))
+                if np.max(residual, initial=0, where=np.isfinite(residual)) < tolerance:
+                    break
+
+                X_propagated_dx, Y_propagated_dx = self.propagate_through_arm(X + step, Y, n=n_array, lba=lba_array)
+                X_propagated_dy, Y_propagated_dy = self.propagate_through_arm(X, Y + step, n=n_array, lba=lba_array)
+
+                dX_dx = (X_propagated_dx - X_propagated) / step
+                dY_dx = (Y_propagated_dx - Y_propagated) / step
+                dX_dy = (X_propagated_dy - X_propagated) / step
+                dY_dy = (Y_propagated_dy - Y_propagated) / step
+
+                determinant = dX_dx * dY_dy - dX_dy * dY_dx
+
+                X = X - (dY_dy * X_residual - dX_dy * Y_residual) / determinant
+                Y = Y - (dX_dx * Y_residual - dY_dx * X_residual) / determinant
+
+            X_coordinates_coded_aperture[i:i + chunk_size] = X
+            Y_coordinates_coded_aperture[i:i + chunk_size] = Y
+
+        X_coordinates_coded_aperture = X_coordinates_coded_aperture.reshape(X_detector_grid.shape[0], X_detector_grid.shape[1], -1)
+        Y_coordinates_coded_aperture = Y_coordinates_coded_aperture.reshape(X_detector_grid.shape[0], X_detector_grid.shape[1], -1)
+
+        return X_coordinates_coded_aperture, Y_coordinates_coded_aperture
+
+    def inverse_propagation_with_no_distorsions(self, X_detector_grid, Y_detector_grid):
+        """
+        Inverse of propagation_with_no_distorsions : find the coded aperture positions that are imaged on the detector grid, for each wavelength
+
+        Args:
+            X_detector_grid (numpy.ndarray): X coordinates of the detector grid (shape = R x C)
+            Y_detector_grid (numpy.ndarray): Y coordinates of the detector grid (shape = R x C)
+
+        Returns:
+            tuple: X coordinates, Y coordinates of the coded aperture positions imaged on the detector grid (shape = R x C x W)
+        """
+
+        self.calculate_central_dispersion()
+
+        X_coordinates_coded_aperture = self.X0_propagated[np.newaxis, np.newaxis, :] - X_detector_grid[..., np.newaxis]
+        Y_coordinates_coded_aperture = self.Y0_propagated[np.newaxis, np.newaxis, :] - Y_detector_grid[..., np.newaxis]
+
+        return X_coordinates_coded_aperture, Y_coordinates_coded_aperture
+
     def set_wavelengths(self, wavelength_min, wavelength_max, nb_of_spectral_samples):
         """
         Set the wavelengths range of the optical system
@@ -156,13 +275,15 @@ class OpticalModel:
         Propagate the light through one system arm : (lens + dispersive element + lens)
 
         Args:
-            X_vec_in (numpy.ndarray) : X coordinates of the coded aperture pixels (1D array)
-            Y_vec_in (numpy.ndarray) : Y coordinates of the coded aperture pixels (1D array)
+            X_vec_in (numpy.ndarray) : X coordinates of the coded aperture pixels
+            Y_vec_in (numpy.ndarray) : Y coordinates of the coded aperture pixels
             n (numpy.ndarray) : refractive indexes of the system (at the corresponding wavelength)
             lba (numpy.ndarray) : wavelengths
 
+        All the inputs are broadcasted together (e.g. pixels of shape N x 1 with wavelengths of shape 1 x W)
+
         Returns:
-            tuple: flatten arrays corresponding to the propagated X and Y coordinates
+            tuple: arrays corresponding to the propagated X and Y coordinates, with the broadcasted shape of the inputs
         """
 
         dispersive_element_type = self.dispersive_element_type
@@ -184,11 +305,11 @@ class OpticalModel:
             k = self.model_Lens_pos_to_angle(X_vec_in, Y_vec_in, F)
             # Rotation in relation to P1 around the Y axis
 
-            k_1 = rotation_y(angle_with_P1) @ k[:, 0, :]
+            k_1 = rotate(rotation_y(angle_with_P1), k)
             # Rotation in relation to P1 around the X axis
-            k_2 = rotation_x(delta_beta_c) @ k_1
+            k_2 = rotate(rotation_x(delta_beta_c), k_1)
             # Rotation of P1 in relation to frame_in along the new Y axis
-            k_3 = rotation_y(A / 2) @ k_2
+            k_3 = rotate(rotation_y(A / 2), k_2)
 
             norm_k = np.sqrt(k_3[0] ** 2 + k_3[1] ** 2 + k_3[2] ** 2)
             k_3 /= norm_k
@@ -196,12 +317,12 @@ class OpticalModel:
             k_out_p = self.model_Prism_angle_to_angle(k_3, n, A)
             k_out_p = k_out_p * norm_k
 
-            k_3_bis = np.dot(rotation_y(A / 2), k_out_p)
+            k_3_bis = rotate(rotation_y(A / 2), k_out_p)
 
             # Rotation in relation to P2 around the X axis
-            k_2_bis = np.dot(rotation_x(-delta_beta_c), k_3_bis)
+            k_2_bis = rotate(rotation_x(-delta_beta_c), k_3_bis)
             # Rotation in relation to P2 around the Y axis
-            k_1_bis = np.dot(rotation_y(angle_with_P2), k_2_bis)
+            k_1_bis = rotate(rotation_y(angle_with_P2), k_2_bis)
 
             X_vec_out, Y_vec_out = self.model_Lens_angle_to_position(k_1_bis, F)
 
@@ -214,23 +335,23 @@ class OpticalModel:
             k = self.model_Lens_pos_to_angle(X_vec_in, Y_vec_in, F)
             # Rotation in relation to P1 around the Y axis
 
-            k_1 = rotation_y(angle_with_P1) @ k[:, 0, :]
+            k_1 = rotate(rotation_y(angle_with_P1), k)
             # Rotation in relation to P1 around the X axis
-            k_2 = rotation_x(delta_beta_c) @ k_1
+            k_2 = rotate(rotation_x(delta_beta_c), k_1)
 
-            k_3 = rotation_y(0) @ k_2
+            k_3 = rotate(rotation_y(0), k_2)
             norm_k = np.sqrt(k_3[0] ** 2 + k_3[1] ** 2 + k_3[2] ** 2)
             k_3 /= norm_k
 
             k_out_p = self.model_Grating_angle_to_angle(k_3, lba, m, G)
             k_out_p = k_out_p * norm_k
 
-            k_3_bis = np.dot(rotation_y(0), k_out_p)
+            k_3_bis = rotate(rotation_y(0), k_out_p)
 
             # Rotation in relation to P2 around the X axis
-            k_2_bis = np.dot(rotation_x(-delta_beta_c), k_3_bis)
+            k_2_bis = rotate(rotation_x(-delta_beta_c), k_3_bis)
             # Rotation in relation to P2 around the Y axis
-            k_1_bis = np.dot(rotation_y(angle_with_P2), k_2_bis)
+            k_1_bis = rotate(rotation_y(angle_with_P2), k_2_bis)
 
             X_vec_out, Y_vec_out = self.model_Lens_angle_to_position(k_1_bis, F)
 
@@ -239,6 +360,58 @@ class OpticalModel:
 
         return X_vec_out, Y_vec_out
 
+    def propagate_through_arm_fused(self, X_vec_in, Y_vec_in, n, lba):
+
+        """
+        Propagate the light through one system arm : (lens + dispersive element + lens), with the fused ray tracing kernels.
+        The rotation matrices are composed once and each ray is traced without temporary arrays.
+        The results agree with propagate_through_arm within 1e-6 um (rounding differences only)
+
+        Args:
+            X_vec_in (numpy.ndarray) : X coordinates of the coded aperture pixels (shape = N)
+            Y_vec_in (numpy.ndarray) : Y coordinates of the coded aperture pixels (shape = N)
+            n (numpy.ndarray) : refractive indexes of the system at each wavelength (shape = W)
+            lba (numpy.ndarray) : wavelengths (shape = W)
+
+        Returns:
+            tuple: propagated X and Y coordinates (shape = N x W)
+        """
+
+        X_vec_in = np.ascontiguousarray(X_vec_in, dtype=np.float64)
+        Y_vec_in = np.ascontiguousarray(Y_vec_in, dtype=np.float64)
+        n = np.ascontiguousarray(n, dtype=np.float64)
+        lba = np.ascontiguousarray(lba, dtype=np.float64)
+
+        X_vec_out = np.empty((X_vec_in.shape[0], lba.shape[0]))
+        Y_vec_out = np.empty((X_vec_in.shape[0], lba.shape[0]))
+
+        if self.dispersive_element_type == "prism":
+
+            angle_with_P1 = self.alpha_c - self.A / 2 + self.delta_alpha_c
+            angle_with_P2 = self.alpha_c_transmis - self.A / 2 - self.delta_alpha_c
+
+            rotation_in = rotation_y(self.A / 2) @ rotation_x(self.delta_beta_c) @ rotation_y(angle_with_P1)
+            rotation_out = rotation_y(angle_with_P2) @ rotation_x(-self.delta_beta_c) @ rotation_y(self.A / 2)
+
+            propagate_rays_through_prism_arm(X_vec_in, Y_vec_in, n, rotation_in, rotation_y(-self.A), rotation_out,
+                                             float(self.F), X_vec_out, Y_vec_out)
+
+        elif self.dispersive_element_type == "grating":
+
+            angle_with_P1 = self.alpha_c - self.delta_alpha_c
+            angle_with_P2 = self.alpha_c_transmis + self.delta_alpha_c
+
+            rotation_in = rotation_y(0) @ rotation_x(self.delta_beta_c) @ rotation_y(angle_with_P1)
+            rotation_out = rotation_y(angle_with_P2) @ rotation_x(-self.delta_beta_c) @ rotation_y(0)
+
+            propagate_rays_through_grating_arm(X_vec_in, Y_vec_in, lba, rotation_in, rotation_out,
+                                               float(self.F), float(self.m), float(self.G), X_vec_out, Y_vec_out)
+
+        else:
+            raise Exception("dispersive_element_type should be prism or grating")
+
+        return X_vec_out, Y_vec_out
+
     def model_Grating_angle_to_angle(self,k_in, lba, m, G):
         """
         Model of the grating
@@ -261,9 +434,9 @@ class OpticalModel:
         beta_out = beta_in
 
 
-        k_out = [np.sin(alpha_out) * np.cos(beta_out),
-                 np.sin(beta_out)*np.cos(alpha_out),
-                 np.cos(alpha_out) * np.cos(beta_out)]
+        k_out = np.stack(np.broadcast_arrays(np.sin(alpha_out) * np.cos(beta_out),
+                                             np.sin(beta_out)*np.cos(alpha_out),
+                                             np.cos(alpha_out) * np.cos(beta_out)))
 
         return k_out
 
@@ -321,11 +494,11 @@ class OpticalModel:
 
         """
 
-        kp = np.array([k0[0], k0[1], np.sqrt(n ** 2 - k0[0] ** 2 - k0[1] ** 2)])
+        kp = np.stack(np.broadcast_arrays(k0[0], k0[1], np.sqrt(n ** 2 - k0[0] ** 2 - k0[1] ** 2)))
 
-        kp_r = np.matmul(rotation_y(-A), kp)
+        kp_r = rotate(rotation_y(-A), kp)
 
-        kout = [kp_r[0], kp_r[1], np.sqrt(1 - kp_r[0] ** 2 - kp_r[1] ** 2)]
+        kout = np.stack([kp_r[0], kp_r[1], np.sqrt(1 - kp_r[0] ** 2 - kp_r[1] ** 2)])
 
         return kout
 
@@ -347,9 +520,9 @@ class OpticalModel:
         alpha = -1*np.arctan(x_obj / F)
         beta  = -1*np.arctan(y_obj / F)
 
-        k_out = np.array([[np.sin(alpha) * np.cos(beta)],
-                       [np.sin(beta)*np.cos(alpha)],
-                       [np.cos(alpha) * np.cos(beta)]])
+        k_out = np.stack(np.broadcast_arrays(np.sin(alpha) * np.cos(beta),
+                                             np.sin(beta)*np.cos(alpha),
+                                             np.cos(alpha) * np.cos(beta)))
 
         return k_out
 
@@ -1 +1,3 @@
-from .CassiSystem import *
\ No newline at end of file
+__version__ = "1.0"
+
+from .CassiSystem import *
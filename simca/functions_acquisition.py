@@ -1,8 +1,144 @@
 import numpy as np
-from scipy.interpolate import griddata
+from scipy.interpolate import griddata, RegularGridInterpolator
+from scipy.spatial import Delaunay
+import scipy.sparse as sp
 from tqdm import tqdm
 import multiprocessing as mp
-from multiprocessing import Pool
+from multiprocessing import Pool, shared_memory, resource_tracker
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+from simca.functions_general_purpose import linear_interpolation_weights, linear_interpolation_matrix
+
+# worker pool shared by all the interpolation calls, started on first use
+_worker_pool = None
+_worker_pool_size = None
+
+
+def get_worker_pool(nb_of_workers=None):
+    """
+    Get the persistent worker pool used for the interpolations. The pool is started on first use and reused by the following calls, it is restarted only if another number of workers is requested
+
+    Args:
+        nb_of_workers (int): number of worker processes (default = size of the running pool, or number of CPUs if no pool is running)
+
+    Returns:
+        multiprocessing.pool.Pool: worker pool
+    """
+    global _worker_pool, _worker_pool_size
+
+    if nb_of_workers is None:
+        nb_of_workers = _worker_pool_size if _worker_pool is not None else mp.cpu_count()
+
+    if _worker_pool is not None and _worker_pool_size != nb_of_workers:
+        close_worker_pool()
+
+    if _worker_pool is None:
+        # the workers must share the resource tracker of the main process to attach to its shared memory blocks
+        resource_tracker.ensure_running()
+        _worker_pool = Pool(nb_of_workers)
+        _worker_pool_size = nb_of_workers
+
+    return _worker_pool
+
+
+@atexit.register
+def close_worker_pool():
+    """
+    Shut down the persistent worker pool, if it is running. It is called automatically at exit
+    """
+    global _worker_pool, _worker_pool_size
+
+    if _worker_pool is not None:
+        _worker_pool.close()
+        _worker_pool.join()
+
+    _worker_pool = None
+    _worker_pool_size = None
+
+
+def forget_worker_pool():
+    """
+    Forget the worker pool inherited from the parent process, without shutting it down. It must be called in the processes forked
+    while the pool was running, since they cannot use it : they start their own pool on first use
+    """
+    global _worker_pool, _worker_pool_size
+
+    _worker_pool = None
+    _worker_pool_size = None
+
+
+def create_shared_array(array=None, shape=None, dtype=np.float64):
+    """
+    Create a numpy array in a shared memory block, so that the workers can access it without any copy
+
+    Args:
+        array (numpy.ndarray): array to copy in the shared memory block (optional)
+        shape (tuple): shape of the array, if no array is given
+        dtype (numpy.dtype): data type of the array, if no array is given
+
+    Returns:
+        tuple: shared memory block (multiprocessing.shared_memory.SharedMemory) and the descriptor (name, shape, dtype) of the shared array, to send to the workers
+    """
+
+    if array is not None:
+        shape, dtype = array.shape, array.dtype
+
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+
+    if array is not None:
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf)[...] = array
+    else:
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf)[...] = 0
+
+    return shm, (shm.name, shape, dtype.str)
+
+
+def read_shared_array(shm, descriptor):
+    """
+    Copy a shared array in a regular numpy array
+
+    Args:
+        shm (multiprocessing.shared_memory.SharedMemory): shared memory block of the array
+        descriptor (tuple): descriptor (name, shape, dtype) of the shared array
+
+    Returns:
+        numpy.ndarray: copy of the shared array
+    """
+    name, shape, dtype = descriptor
+
+    return np.array(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def attach_shared_arrays(descriptors):
+    """
+    Attach to shared memory blocks created by create_shared_array
+
+    Args:
+        descriptors (list): descriptors (name, shape, dtype) of the shared arrays
+
+    Returns:
+        tuple: list of the shared memory blocks and list of the corresponding arrays. The arrays must be deleted before closing the blocks
+    """
+
+    shared_memories = [shared_memory.SharedMemory(name=name) for name, shape, dtype in descriptors]
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=shm.buf) for shm, (name, shape, dtype) in zip(shared_memories, descriptors)]
+
+    return shared_memories, arrays
+
+
+def release_shared_memories(shared_memories):
+    """
+    Close and free shared memory blocks created by create_shared_array
+
+    Args:
+        shared_memories (list): shared memory blocks to release
+    """
+
+    for shm in shared_memories:
+        shm.close()
+        shm.unlink()
+
 
 
 def generate_sd_measurement_cube(filtered_scene,X_input, Y_input, X_target, Y_target,grid_type,interp_method):
@@ -61,44 +197,345 @@ def generate_dd_measurement(scene, filtering_cube,chunk_size):
 
     return filtered_scene
 
+def generate_dd_compressed_measurement(scene, filtering_cube, chunk_size, nb_of_threads=1):
+    """
+    Generate DD-CASSI type system compressed measurement from a scene and a filtering cube, without the filtered scene.
+    The Hadamard product and the sum along the wavelengths are fused tile by tile, so only one R x C image and one tile buffer per thread are allocated
+
+    Args:
+        scene (numpy.ndarray): observed scene (shape = R  x C x W)
+        filtering_cube (numpy.ndarray):   filtering cube of the instrument for a given pattern (shape = R x C x W)
+        chunk_size (int) : size of the spatial chunks in which the Hadamard product is performed
+        nb_of_threads (int) : number of threads computing the rows of chunks in parallel
+
+    Returns:
+        numpy.ndarray: compressed measurement (shape = R x C)
+    """
+
+    measurement = np.empty(filtering_cube.shape[:2], dtype=np.result_type(scene, filtering_cube))
+
+    def process_rows_of_chunks(i):
+        # one buffer per row of chunks, reused for all the chunks of the row
+        buffer = np.empty((min(chunk_size, filtering_cube.shape[0] - i), chunk_size, filtering_cube.shape[2]), dtype=measurement.dtype)
+
+        for j in range(0, filtering_cube.shape[1], chunk_size):
+            filtered_chunk = buffer[:, :min(chunk_size, filtering_cube.shape[1] - j), :]
+            np.multiply(filtering_cube[i:i + chunk_size, j:j + chunk_size, :], scene[i:i + chunk_size, j:j + chunk_size, :], out=filtered_chunk)
+            np.nan_to_num(filtered_chunk, copy=False)
+            np.sum(filtered_chunk, axis=2, out=measurement[i:i + chunk_size, j:j + chunk_size])
+
+    rows_of_chunks = range(0, filtering_cube.shape[0], chunk_size)
+
+    with tqdm(total=len(rows_of_chunks)) as pbar:
+        if nb_of_threads > 1:
+            # numpy releases the GIL in the products and the sums
+            with ThreadPoolExecutor(max_workers=nb_of_threads) as executor:
+                for _ in executor.map(process_rows_of_chunks, rows_of_chunks):
+                    pbar.update()
+        else:
+            for i in rows_of_chunks:
+                process_rows_of_chunks(i)
+                pbar.update()
+
+    return measurement
+
+def generate_dd_batched_measurements(scene, patterns, interpolation_plan, chunk_size):
+    """
+    Generate the DD-CASSI compressed measurements of a scene for a stack of patterns, in one pass over the scene.
+    For each block of detector pixels and each wavelength, the filtering cube values of all the patterns are gathered with the interpolation plan and applied to the scene values while they are in cache. Neither the filtering cubes nor the filtered scenes are stored
+
+    Args:
+        scene (numpy.ndarray): observed scene (shape = R x C x W)
+        patterns (numpy.ndarray): stack of coded aperture patterns (shape = N x H x L)
+        interpolation_plan (InterpolationPlan): interpolation plan from the propagated coded aperture grids (H x L x W) to the detector grid (R x C)
+        chunk_size (int): the detector pixels are processed in blocks of chunk_size x chunk_size pixels
+
+    Returns:
+        numpy.ndarray: stack of compressed measurements (shape = N x R x C)
+    """
+
+    patterns_flatten = np.nan_to_num(np.asarray(patterns, dtype=np.float64)).reshape(patterns.shape[0], -1)
+    scene_flatten = np.asarray(scene).reshape(-1, scene.shape[2])
+
+    nb_of_target_points = scene_flatten.shape[0]
+    block_size = chunk_size * chunk_size
+
+    measurements = np.zeros((patterns.shape[0], nb_of_target_points))
+
+    for start in tqdm(range(0, nb_of_target_points, block_size)):
+        block = slice(start, start + block_size)
+        scene_block = scene_flatten[block]
+
+        for i in range(interpolation_plan.nb_of_grids):
+            # filtering cube values of all the patterns (shape = block x N)
+            filtering_values = weighted_sum_of_vertices(patterns_flatten.T, interpolation_plan.vertices[i, block],
+                                                        interpolation_plan.weights[i, block, :, np.newaxis])
+            measurements[:, block] += np.nan_to_num(filtering_values.T * scene_block[:, i])
+
+    return measurements.reshape(patterns.shape[0], scene.shape[0], scene.shape[1])
+
+def generate_sd_batched_measurements(scene, patterns, interpolation_plan, chunk_size):
+    """
+    Generate the SD-CASSI compressed measurements of a scene for a stack of patterns, in one pass over the scene.
+    For each block of detector pixels and each wavelength, the scene values at the plan vertices are gathered once and combined with the values of all the patterns. Neither the filtered scenes nor the measurement cubes are stored
+
+    Args:
+        scene (numpy.ndarray): observed scene, sampled on the propagated coded aperture grids (shape = H x L x W)
+        patterns (numpy.ndarray): stack of coded aperture patterns, cropped to the scene (shape = N x H x L)
+        interpolation_plan (InterpolationPlan): interpolation plan from the propagated coded aperture grids (H x L x W) to the detector grid (R x C)
+        chunk_size (int): the detector pixels are processed in blocks of chunk_size x chunk_size pixels
+
+    Returns:
+        numpy.ndarray: stack of compressed measurements (shape = N x R x C)
+    """
+
+    patterns_flatten = np.asarray(patterns, dtype=np.float64).reshape(patterns.shape[0], -1)
+    scene_flatten = np.asarray(scene, dtype=np.float64).reshape(-1, scene.shape[2])
+
+    nb_of_target_points = interpolation_plan.target_shape[0] * interpolation_plan.target_shape[1]
+    block_size = chunk_size * chunk_size
+
+    measurements = np.zeros((patterns.shape[0], nb_of_target_points))
+
+    for start in tqdm(range(0, nb_of_target_points, block_size)):
+        block = slice(start, start + block_size)
+
+        for i in range(interpolation_plan.nb_of_grids):
+            vertices = interpolation_plan.vertices[i, block]
+            weighted_scene = interpolation_plan.weights[i, block] * scene_flatten[vertices, i]
+
+            # measurement cube values of all the patterns (shape = N x block)
+            interpolated_values = weighted_scene[:, 0] * patterns_flatten[:, vertices[:, 0]]
+            for k in range(1, vertices.shape[1]):
+                interpolated_values += weighted_scene[:, k] * patterns_flatten[:, vertices[:, k]]
 
+            measurements[:, block] += np.nan_to_num(interpolated_values)
 
+    return measurements.reshape(patterns.shape[0], interpolation_plan.target_shape[0], interpolation_plan.target_shape[1])
+
+
+
+def generate_shifted_filtering_cubes(patterns, X_init, Y_init, X_target, Y_target):
+    """
+    Generate filtering cubes when the propagated grids are regular (no distortions) : each slice of a cube is a shifted and resampled copy of the pattern.
+    Each slice is computed with two separable linear interpolations (sparse matrix products along the rows and the columns) instead of a 2D interpolation
+
+    Args:
+        patterns (numpy.ndarray): coded aperture pattern (shape = H x L) or stack of patterns (shape = N x H x L)
+        X_init (numpy.ndarray): X coordinates of the regular propagated grids (shape = H x L x W)
+        Y_init (numpy.ndarray): Y coordinates of the regular propagated grids (shape = H x L x W)
+        X_target (numpy.ndarray): X coordinates of the regular target grid (shape = R x C)
+        Y_target (numpy.ndarray): Y coordinates of the regular target grid (shape = R x C)
+
+    Returns:
+        numpy.ndarray: filtering cube (shape = R x C x W) or stack of filtering cubes (shape = N x R x C x W)
+    """
+
+    patterns = np.nan_to_num(np.asarray(patterns, dtype=np.float64))
+    is_single_pattern = patterns.ndim == 2
+    if is_single_pattern:
+        patterns = patterns[np.newaxis, ...]
+
+    nb_of_patterns, nb_of_rows, nb_of_columns = patterns.shape
+    nb_of_grids = X_init.shape[2]
+    nb_of_target_rows, nb_of_target_columns = X_target.shape
+
+    # slices are computed contiguously (shape = W x R x N x C) and reordered once at the end
+    shifted_patterns = np.empty((nb_of_grids, nb_of_target_rows, nb_of_patterns, nb_of_target_columns))
+
+    # columns of all the patterns side by side (shape = L x (N*H))
+    stacked_patterns = patterns.transpose(2, 0, 1).reshape(nb_of_columns, nb_of_patterns * nb_of_rows)
+
+    for i in range(nb_of_grids):
+        columns_interpolation = linear_interpolation_matrix(X_init[0, :, i], X_target[0, :])
+        rows_interpolation = linear_interpolation_matrix(Y_init[:, 0, i], Y_target[:, 0])
+
+        shifted_columns = (columns_interpolation @ stacked_patterns).reshape(nb_of_target_columns, nb_of_patterns, nb_of_rows)
+        shifted_columns = np.ascontiguousarray(shifted_columns.transpose(2, 1, 0)).reshape(nb_of_rows, nb_of_patterns * nb_of_target_columns)
+
+        shifted_patterns[i] = (rows_interpolation @ shifted_columns).reshape(nb_of_target_rows, nb_of_patterns, nb_of_target_columns)
+
+    filtering_cubes = np.ascontiguousarray(shifted_patterns.transpose(2, 1, 3, 0))
+
+    return filtering_cubes[0] if is_single_pattern else filtering_cubes
+
+def generate_inverse_filtering_cubes(patterns, X_pattern, Y_pattern, X_inverse, Y_inverse):
+    """
+    Generate filtering cubes from the inverse propagation of the detector grid : each voxel of a cube is read in the pattern, at the coded aperture position imaged on the detector pixel at this wavelength.
+    The pattern is sampled on a regular grid, so the lookup is a bilinear gather of the 4 neighbouring pattern pixels. Positions outside of the pattern receive no light
+
+    Args:
+        patterns (numpy.ndarray): coded aperture pattern (shape = H x L) or stack of patterns (shape = N x H x L)
+        X_pattern (numpy.ndarray): X coordinates of the regular coded aperture grid (shape = H x L)
+        Y_pattern (numpy.ndarray): Y coordinates of the regular coded aperture grid (shape = H x L)
+        X_inverse (numpy.ndarray): X coordinates of the coded aperture positions imaged on the detector grid (shape = R x C x W)
+        Y_inverse (numpy.ndarray): Y coordinates of the coded aperture positions imaged on the detector grid (shape = R x C x W)
+
+    Returns:
+        numpy.ndarray: filtering cube (shape = R x C x W) or stack of filtering cubes (shape = N x R x C x W)
+    """
+
+    patterns = np.nan_to_num(np.asarray(patterns, dtype=np.float64))
+    is_single_pattern = patterns.ndim == 2
+    if is_single_pattern:
+        patterns = patterns[np.newaxis, ...]
+
+    patterns_flatten = patterns.reshape(patterns.shape[0], -1)
+    nb_of_target_rows, nb_of_target_columns, nb_of_grids = X_inverse.shape
+
+    # slices are computed contiguously (shape = W x N x (R*C)) and reordered once at the end
+    filtering_cubes = np.empty((nb_of_grids, patterns.shape[0], nb_of_target_rows * nb_of_target_columns))
+
+    for i in range(nb_of_grids):
+        vertices, weights = regular_grid_weights(X_pattern, Y_pattern, X_inverse[:, :, i], Y_inverse[:, :, i])
+
+        for j in range(patterns.shape[0]):
+            filtering_cubes[i, j] = weighted_sum_of_vertices(patterns_flatten[j], vertices, weights)
+
+    filtering_cubes = np.ascontiguousarray(filtering_cubes.transpose(1, 2, 0)).reshape(patterns.shape[0], nb_of_target_rows, nb_of_target_columns, nb_of_grids)
+
+    return filtering_cubes[0] if is_single_pattern else filtering_cubes
+
+def generate_dd_forward_operator(filtering_cube):
+    """
+    Generate the sparse forward operator of a DD-CASSI system : measurement = H @ scene.ravel()
+
+    Args:
+        filtering_cube (numpy.ndarray): filtering cube of the instrument for a given pattern (shape = R x C x W)
+
+    Returns:
+        scipy.sparse.csr_matrix: forward operator (shape = (R*C) x (R*C*W))
+    """
+
+    nb_of_pixels = filtering_cube.shape[0] * filtering_cube.shape[1]
+    nb_of_wavelengths = filtering_cube.shape[2]
+
+    # each detector pixel sees the W voxels of the scene at the same spatial position
+    forward_operator = sp.csr_matrix((np.nan_to_num(filtering_cube).ravel(),
+                                      np.arange(nb_of_pixels * nb_of_wavelengths),
+                                      np.arange(0, (nb_of_pixels + 1) * nb_of_wavelengths, nb_of_wavelengths)),
+                                     shape=(nb_of_pixels, nb_of_pixels * nb_of_wavelengths))
+    forward_operator.eliminate_zeros()
+
+    return forward_operator
+
+def generate_sd_forward_operator(pattern, interpolation_plan):
+    """
+    Generate the sparse forward operator of a SD-CASSI system : measurement = H @ scene.ravel()
+    The scene is filtered by the pattern, propagated and interpolated on the detector grid, then summed along the wavelengths
+
+    Args:
+        pattern (numpy.ndarray): coded aperture pattern, cropped to the scene size (shape = H x L)
+        interpolation_plan (InterpolationPlan): interpolation plan from the propagated scene grids to the detector grid
+
+    Returns:
+        scipy.sparse.csr_matrix: forward operator (shape = (R*C) x (H*L*W))
+    """
+
+    nb_of_pixels = interpolation_plan.target_shape[0] * interpolation_plan.target_shape[1]
+    nb_of_scene_pixels = interpolation_plan.init_shape[0] * interpolation_plan.init_shape[1]
+    nb_of_wavelengths = interpolation_plan.nb_of_grids
+    nb_of_vertices = interpolation_plan.vertices.shape[2]
+
+    pattern_flatten = np.asarray(pattern, dtype=np.float64).ravel()
+
+    rows = np.tile(np.repeat(np.arange(nb_of_pixels), nb_of_vertices), nb_of_wavelengths)
+    columns = (interpolation_plan.vertices * nb_of_wavelengths + np.arange(nb_of_wavelengths)[:, np.newaxis, np.newaxis]).ravel()
+    values = (interpolation_plan.weights * pattern_flatten[interpolation_plan.vertices]).ravel()
+
+    forward_operator = sp.csr_matrix((values, (rows, columns)),
+                                     shape=(nb_of_pixels, nb_of_scene_pixels * nb_of_wavelengths))
+    forward_operator.eliminate_zeros()
+
+    return forward_operator
+
+def generate_dd_adjoint_measurement(measurement, filtering_cube):
+    """
+    Back-project a DD-CASSI measurement in the scene space, with the adjoint of the DD-CASSI forward model
+
+    Args:
+        measurement (numpy.ndarray): compressed measurement (shape = R x C)
+        filtering_cube (numpy.ndarray): filtering cube of the instrument for a given pattern (shape = R x C x W)
+
+    Returns:
+        numpy.ndarray: back-projected scene (shape = R x C x W)
+    """
+
+    return np.nan_to_num(filtering_cube) * np.nan_to_num(measurement)[..., np.newaxis]
+
+def generate_sd_adjoint_measurement(measurement, pattern, interpolation_plan):
+    """
+    Back-project a SD-CASSI measurement in the scene space, with the adjoint of the SD-CASSI forward model
+
+    Args:
+        measurement (numpy.ndarray): compressed measurement (shape = R x C)
+        pattern (numpy.ndarray): coded aperture pattern, cropped to the scene size (shape = H x L)
+        interpolation_plan (InterpolationPlan): interpolation plan from the propagated scene grids to the detector grid
+
+    Returns:
+        numpy.ndarray: back-projected scene (shape = H x L x W)
+    """
+
+    return interpolation_plan.apply_adjoint(measurement) * np.asarray(pattern, dtype=np.float64)[..., np.newaxis]
+
+def dot_product_test(forward, adjoint, input_shape, output_shape, nb_of_tests=10, seed=None):
+    """
+    Check that two operators are adjoint of each other : <H x, y> = <x, H^T y> for random x and y
+
+    Args:
+        forward (callable): forward operator, mapping an array of shape input_shape to an array of shape output_shape
+        adjoint (callable): adjoint operator, mapping an array of shape output_shape to an array of shape input_shape
+        input_shape (tuple): shape of the forward operator input
+        output_shape (tuple): shape of the forward operator output
+        nb_of_tests (int): number of random (x, y) pairs to test
+        seed (int): seed of the random generator
+
+    Returns:
+        float: maximum relative error between <H x, y> and <x, H^T y> over all the tests
+    """
+
+    rng = np.random.default_rng(seed)
+    max_relative_error = 0
+
+    for i in range(nb_of_tests):
+        x = rng.standard_normal(input_shape)
+        y = rng.standard_normal(output_shape)
+
+        forward_product = np.vdot(forward(x), y)
+        adjoint_product = np.vdot(x, adjoint(y))
+
+        relative_error = np.abs(forward_product - adjoint_product) / max(np.abs(forward_product), np.abs(adjoint_product), np.finfo(float).tiny)
+        max_relative_error = max(max_relative_error, relative_error)
+
+    return max_relative_error
 
 def match_dataset_to_instrument(dataset, filtering_cube):
     """
     Match the size of the dataset to the size of the filtering cube. Either by padding or by cropping
 
     Args:
-        dataset (numpy.ndarray): dataset
+        dataset (numpy.ndarray or LazyDataset): dataset, only the region matching the filtering cube is read from a LazyDataset
         filtering_cube (numpy.ndarray):  filtering cube of the instrument
 
     Returns:
         numpy.ndarray: observed scene (shape = R  x C x W)
     """
 
+    nb_of_rows, nb_of_columns = filtering_cube.shape[0], filtering_cube.shape[1]
+    nb_of_bands = dataset.shape[2]
 
-
-    if filtering_cube.shape[0] != dataset.shape[0] or filtering_cube.shape[1] != dataset.shape[1]:
-        if dataset.shape[0] < filtering_cube.shape[0]:
-            dataset = np.pad(dataset, ((0, filtering_cube.shape[0] - dataset.shape[0]), (0, 0), (0, 0)), mode="constant")
-        if dataset.shape[1] < filtering_cube.shape[1]:
-            dataset = np.pad(dataset, ((0, 0), (0, filtering_cube.shape[1] - dataset.shape[1]), (0, 0)), mode="constant")
-        scene = dataset[0:filtering_cube.shape[0], 0:filtering_cube.shape[1], :]
+    if nb_of_rows != dataset.shape[0] or nb_of_columns != dataset.shape[1]:
         print("Dataset Spatial Cropping : Filtering cube and scene must have the same nubmer of lines and columns")
-        
-    else:
-    	scene = dataset
 
     if len(filtering_cube.shape) == 3 and filtering_cube.shape[2] != dataset.shape[2]:
-            scene = dataset[:, :, 0:filtering_cube.shape[2]]
-            print("Dataset Spectral Cropping : Filtering cube and scene must have the same number of wavelengths")	
-    else:
-        scene = dataset
-        
-    try:
-    	scene
-    except:
-    	print("Please load a scene first")
+        nb_of_bands = filtering_cube.shape[2]
+        print("Dataset Spectral Cropping : Filtering cube and scene must have the same number of wavelengths")
+
+    # the dataset is cropped before being padded, so that only the region seen by the instrument is read
+    scene = np.asarray(dataset[0:nb_of_rows, 0:nb_of_columns, 0:nb_of_bands])
+
+    if scene.shape[0] < nb_of_rows or scene.shape[1] < nb_of_columns:
+        scene = np.pad(scene, ((0, nb_of_rows - scene.shape[0]), (0, nb_of_columns - scene.shape[1]), (0, 0)), mode="constant")
 
     return scene
 
@@ -107,22 +544,25 @@ def match_dataset_labels_to_instrument(dataset_labels, filtering_cube):
     Match the size of the dataset labels to the size of the filtering cube. Either by padding or by cropping
 
     Args:
-        dataset_labels (numpy.ndarray): dataset labels (shape = R_dts  x C_dts)
+        dataset_labels (numpy.ndarray or LazyLabels): dataset labels (shape = R_dts  x C_dts), only the region matching the filtering cube is read from a LazyLabels
         filtering_cube (numpy.ndarray): filtering cube of the instrument
 
     Returns:
         numpy.ndarray: scene labels (shape = R  x C)
     """
 
-    if filtering_cube.shape[0] != dataset_labels.shape[0] or filtering_cube.shape[1] != dataset_labels.shape[1]:
-        if dataset_labels.shape[0] < filtering_cube.shape[0]:
-            dataset_labels = np.pad(dataset_labels, ((0, filtering_cube.shape[0] - dataset_labels.shape[0])), mode="constant")
-        if dataset_labels.shape[1] < filtering_cube.shape[1]:
-            dataset_labels = np.pad(dataset_labels, ((0, 0), (0, filtering_cube.shape[1] - dataset_labels.shape[1])), mode="constant")
-        dataset_labels = dataset_labels[0:filtering_cube.shape[0], 0:filtering_cube.shape[1]]
+    nb_of_rows, nb_of_columns = filtering_cube.shape[0], filtering_cube.shape[1]
+
+    if nb_of_rows != dataset_labels.shape[0] or nb_of_columns != dataset_labels.shape[1]:
         print("Filtering cube and scene must have the same lines and columns")
 
-    return dataset_labels
+    # the labels are cropped before being padded, so that only the region seen by the instrument is read
+    scene_labels = np.asarray(dataset_labels[0:nb_of_rows, 0:nb_of_columns])
+
+    if scene_labels.shape[0] < nb_of_rows or scene_labels.shape[1] < nb_of_columns:
+        scene_labels = np.pad(scene_labels, ((0, nb_of_rows - scene_labels.shape[0]), (0, nb_of_columns - scene_labels.shape[1])), mode="constant")
+
+    return scene_labels
 
 def crop_center(array, nb_of_pixels_along_x, nb_of_pixels_along_y):
     """
@@ -156,7 +596,7 @@ def crop_center(array, nb_of_pixels_along_x, nb_of_pixels_along_y):
 
 
 
-def interpolate_data_on_grid_positions(data, X_init, Y_init, X_target, Y_target, grid_type="unstructured", interp_method="linear"):
+def interpolate_data_on_grid_positions(data, X_init, Y_init, X_target, Y_target, grid_type="auto", interp_method="linear", nb_of_workers=None):
     """
     Interpolate data on a single 2D grid defined by X_target and Y_target
 
@@ -166,39 +606,99 @@ def interpolate_data_on_grid_positions(data, X_init, Y_init, X_target, Y_target,
         Y_init (numpy.ndarray): Y coordinates of the initial grid (3D)
         X_target (numpy.ndarray): X coordinates of the target grid (2D)
         Y_target (numpy.ndarray): Y coordinates of the target grid (2D)
-        grid_type (str): type of the target grid (default = "unstructured", other option = "regular")
+        grid_type (str): type of the initial grids, "unstructured", "regular" or "auto" to use the regular grid method when all the initial grids are regular (default = "auto")
         interp_method (str): interpolation method (default = "linear")
+        nb_of_workers (int): number of worker processes of the persistent pool, 1 to interpolate in the calling process (default = size of the running pool)
 
     Returns:
         numpy.ndarray: 3D data interpolated on the target grid
     """
 
-    interpolated_data = np.zeros((X_target.shape[0],X_target.shape[1],X_init.shape[2]))
     nb_of_grids = X_init.shape[2]
 
-    if grid_type == "unstructured":
-        worker = worker_unstructured
-    elif grid_type == "regular":
-        worker = worker_regulargrid
+    if grid_type == "auto":
+        grid_type = "regular" if is_regular_grid(X_init, Y_init) else "unstructured"
 
+    # the 2D data is shared once, instead of being repeated for each grid
     if data.ndim == 2:
         data = data[:, :, np.newaxis]
-        data = np.repeat(data, nb_of_grids, axis=2)
 
-    with Pool(mp.cpu_count()) as p:
+    if grid_type == "regular":
+        # index lookups are cheap enough to be done in the main process
+        interpolated_data = np.zeros((X_target.shape[0], X_target.shape[1], nb_of_grids))
+        for i in range(nb_of_grids):
+            interpolated_data[:, :, i] = worker_regulargrid((X_init[:, :, i], Y_init[:, :, i],
+                                                             data[:, :, i if data.shape[2] > 1 else 0],
+                                                             X_target, Y_target, interp_method))
+        return np.nan_to_num(interpolated_data)
+
+    worker = worker_unstructured
+
+    if nb_of_workers == 1:
+        # a single worker interpolates in the calling process, without shared memory nor pool
+        interpolated_data = np.zeros((X_target.shape[0], X_target.shape[1], nb_of_grids))
+        for i in tqdm(range(nb_of_grids), desc='Interpolate 3D data on grid positions'):
+            interpolated_data[:, :, i] = worker((X_init[:, :, i], Y_init[:, :, i],
+                                                 data[:, :, i if data.shape[2] > 1 else 0],
+                                                 X_target, Y_target, interp_method))
+        return np.nan_to_num(interpolated_data)
+
+    shared_memories = []
+    try:
+        descriptors = []
+        for array in [X_init, Y_init, data, X_target, Y_target]:
+            shm, descriptor = create_shared_array(array)
+            shared_memories.append(shm)
+            descriptors.append(descriptor)
+
+        # the workers write their results directly in the shared output cube
+        shm, descriptor = create_shared_array(shape=(X_target.shape[0], X_target.shape[1], nb_of_grids))
+        shared_memories.append(shm)
+        descriptors.append(descriptor)
+
+        p = get_worker_pool(nb_of_workers)
+
+        # the workers only receive the names of the shared arrays and the index of the grid to interpolate
+        tasks = [(worker, descriptors, i, interp_method) for i in range(nb_of_grids)]
 
-        tasks = [(X_init[:, :, i], Y_init[:, :, i], data[:, :, i], X_target, Y_target, interp_method) for i in
-                 range(nb_of_grids)]
+        for _ in tqdm(p.imap_unordered(worker_shared_memory, tasks), total=nb_of_grids,
+                      desc='Interpolate 3D data on grid positions'):
+            pass
 
-        for index, zi in tqdm(enumerate(p.imap(worker, tasks)), total=nb_of_grids,
-                              desc='Interpolate 3D data on grid positions'):
-            interpolated_data[:, :, index] = zi
+        interpolated_data = np.nan_to_num(read_shared_array(shm, descriptor))
 
-    interpolated_data = np.nan_to_num(interpolated_data)
+    finally:
+        release_shared_memories(shared_memories)
 
     return interpolated_data
 
 
+def worker_shared_memory(args):
+    """
+    Process to interpolate one grid of data stored in shared memory, the result is written in the shared output cube
+
+    Args:
+        args (tuple): containing the following elements: worker, descriptors of the shared arrays (X_init, Y_init, data, X_target, Y_target, output), index of the grid, interp_method
+
+    Returns:
+        int: index of the interpolated grid
+    """
+    worker, descriptors, index, interp_method = args
+
+    shared_memories, arrays = attach_shared_arrays(descriptors)
+    X_init, Y_init, data, X_target, Y_target, interpolated_data = arrays
+
+    interpolated_data[:, :, index] = worker((X_init[:, :, index], Y_init[:, :, index],
+                                              data[:, :, index if data.shape[2] > 1 else 0],
+                                              X_target, Y_target, interp_method))
+
+    del arrays, X_init, Y_init, data, X_target, Y_target, interpolated_data
+    for shm in shared_memories:
+        shm.close()
+
+    return index
+
+
 def worker_unstructured(args):
     """
     Process to parallellize the unstructured griddata interpolation between the propagated grid (mask and the detector grid
@@ -220,27 +720,338 @@ def worker_unstructured(args):
 
 def worker_regulargrid(args):
     """
-    Process to parallellize the structured griddata interpolation between the propagated grid (mask and the detector grid
-    Note : For now it is identical to the unstructured method but it could be faster ...
+    Process to interpolate data defined on a regular (rectilinear) grid on the target grid, with separable index lookups instead of a triangulation
 
     Args:
-        args (tuple): containing the following elements: X_init_2D, Y_init_2D, data_2D, X_target_2D, Y_target_2D
+        args (tuple): containing the following elements: X_init_2D, Y_init_2D, data_2D, X_target_2D, Y_target_2D, interp_method
 
     Returns:
-        numpy.ndarray: 2D array of the data interpolated on the target grid
+        numpy.ndarray: 2D array of the data interpolated on the target grid (NaN outside of the initial grid)
     """
     X_init_2D, Y_init_2D, data_2D, X_target_2D, Y_target_2D, interp_method = args
 
-    interpolated_data = griddata((X_init_2D.flatten(),
-                                  Y_init_2D.flatten()),
-                                 data_2D.flatten(),
-                                 (X_target_2D, Y_target_2D),
-                                 method=interp_method)
-    return interpolated_data
+    if interp_method == "linear":
+        vertices, weights = regular_grid_weights(X_init_2D, Y_init_2D, X_target_2D, Y_target_2D)
+        interpolated_data = weighted_sum_of_vertices(np.asarray(data_2D, dtype=np.float64).ravel(), vertices, weights)
+        interpolated_data[np.all(weights == 0, axis=1)] = np.nan
+        return interpolated_data.reshape(X_target_2D.shape)
+
+    x_axis, y_axis, data_2D = X_init_2D[0, :], Y_init_2D[:, 0], np.asarray(data_2D, dtype=np.float64)
+    if x_axis.shape[0] > 1 and x_axis[-1] < x_axis[0]:
+        x_axis, data_2D = x_axis[::-1], data_2D[:, ::-1]
+    if y_axis.shape[0] > 1 and y_axis[-1] < y_axis[0]:
+        y_axis, data_2D = y_axis[::-1], data_2D[::-1, :]
+
+    interpolator = RegularGridInterpolator((y_axis, x_axis), data_2D, method=interp_method, bounds_error=False, fill_value=np.nan)
+
+    return interpolator((Y_target_2D, X_target_2D))
+
+def is_regular_grid(X_init, Y_init):
+    """
+    Check if grids are regular (rectilinear) : X coordinates only depend on the column, Y coordinates only depend on the row, and both axes are strictly monotonic
+
+    Args:
+        X_init (numpy.ndarray): X coordinates of the grids (2D or 3D)
+        Y_init (numpy.ndarray): Y coordinates of the grids (2D or 3D)
+
+    Returns:
+        bool: True if all the grids are regular
+    """
+
+    if X_init.ndim == 2:
+        X_init, Y_init = X_init[:, :, np.newaxis], Y_init[:, :, np.newaxis]
+
+    if not (np.all(X_init == X_init[0:1, :, :]) and np.all(Y_init == Y_init[:, 0:1, :])):
+        return False
+
+    for axis in [np.diff(X_init[0, :, :], axis=0), np.diff(Y_init[:, 0, :], axis=0)]:
+        if not (np.all(axis > 0) or np.all(axis < 0)):
+            return False
+
+    return True
+
+def regular_grid_weights(X_init_2D, Y_init_2D, X_target_2D, Y_target_2D):
+    """
+    Compute the bilinear interpolation weights between a regular grid and a target grid
+
+    Args:
+        X_init_2D (numpy.ndarray): X coordinates of the regular grid (shape = H x L)
+        Y_init_2D (numpy.ndarray): Y coordinates of the regular grid (shape = H x L)
+        X_target_2D (numpy.ndarray): X coordinates of the target grid (shape = R x C)
+        Y_target_2D (numpy.ndarray): Y coordinates of the target grid (shape = R x C)
+
+    Returns:
+        tuple: vertices indices (numpy.ndarray of shape N x 4) and bilinear weights (numpy.ndarray of shape N x 4). Target points outside of the regular grid get null weights
+    """
+
+    x_left, x_right, x_weights = linear_interpolation_weights(X_init_2D[0, :], X_target_2D.ravel())
+    y_left, y_right, y_weights = linear_interpolation_weights(Y_init_2D[:, 0], Y_target_2D.ravel())
+
+    nb_of_columns = X_init_2D.shape[1]
+
+    vertices = np.column_stack((y_left * nb_of_columns + x_left,
+                                y_left * nb_of_columns + x_right,
+                                y_right * nb_of_columns + x_left,
+                                y_right * nb_of_columns + x_right))
+    weights = np.column_stack(((1 - y_weights) * (1 - x_weights),
+                               (1 - y_weights) * x_weights,
+                               y_weights * (1 - x_weights),
+                               y_weights * x_weights))
+
+    is_outside = np.isnan(weights).any(axis=1)
+    vertices[is_outside] = 0
+    weights[is_outside] = 0
 
+    return vertices, weights
 
 
+class InterpolationPlan:
+    """
+    Interpolation weights between a stack of propagated grids and a single target grid.
+
+    The Delaunay triangulation of each propagated grid is computed once, and the simplex vertices and barycentric weights
+    of every target point are stored. The plan can then be applied to any number of patterns or scenes with a gather and
+    a weighted sum, which gives the same result as the "linear" griddata interpolation.
+    When all the propagated grids are regular, the triangulation is skipped and bilinear weights on the 4 neighbouring
+    vertices are stored instead.
+    """
+
+    def __init__(self, X_init, Y_init, X_target, Y_target, nb_of_workers=None):
+        """
+
+        Args:
+            X_init (numpy.ndarray): X coordinates of the initial grids (shape = H x L x W)
+            Y_init (numpy.ndarray): Y coordinates of the initial grids (shape = H x L x W)
+            X_target (numpy.ndarray): X coordinates of the target grid (shape = R x C)
+            Y_target (numpy.ndarray): Y coordinates of the target grid (shape = R x C)
+            nb_of_workers (int): number of worker processes of the persistent pool, 1 to compute the plan in the calling process (default = size of the running pool)
+
+        """
+
+        self.init_shape = X_init.shape[:2]
+        self.target_shape = X_target.shape
+        self.nb_of_grids = X_init.shape[2]
+
+        nb_of_target_points = X_target.shape[0] * X_target.shape[1]
+
+        if is_regular_grid(X_init, Y_init):
+            self.vertices = np.zeros((self.nb_of_grids, nb_of_target_points, 4), dtype=np.int64)
+            self.weights = np.zeros((self.nb_of_grids, nb_of_target_points, 4))
+            for i in range(self.nb_of_grids):
+                self.vertices[i], self.weights[i] = regular_grid_weights(X_init[:, :, i], Y_init[:, :, i], X_target, Y_target)
+            return
+
+        if nb_of_workers == 1:
+            # a single worker computes the plan in the calling process, without shared memory nor pool
+            self.vertices = np.zeros((self.nb_of_grids, nb_of_target_points, 3), dtype=np.int64)
+            self.weights = np.zeros((self.nb_of_grids, nb_of_target_points, 3))
+            for i in tqdm(range(self.nb_of_grids), desc='Compute interpolation plan'):
+                self.vertices[i], self.weights[i] = worker_barycentric_weights((X_init[:, :, i], Y_init[:, :, i], X_target, Y_target))
+            return
+
+        shared_memories = []
+        try:
+            descriptors = []
+            for array in [X_init, Y_init, X_target, Y_target]:
+                shm, descriptor = create_shared_array(array)
+                shared_memories.append(shm)
+                descriptors.append(descriptor)
+
+            # the workers write their results directly in the shared vertices and weights arrays
+            for dtype in [np.int64, np.float64]:
+                shm, descriptor = create_shared_array(shape=(self.nb_of_grids, nb_of_target_points, 3), dtype=dtype)
+                shared_memories.append(shm)
+                descriptors.append(descriptor)
+
+            p = get_worker_pool(nb_of_workers)
+
+            tasks = [(descriptors, i) for i in range(self.nb_of_grids)]
+
+            for _ in tqdm(p.imap_unordered(worker_shared_barycentric_weights, tasks), total=self.nb_of_grids,
+                          desc='Compute interpolation plan'):
+                pass
+
+            self.vertices = read_shared_array(shared_memories[-2], descriptors[-2])
+            self.weights = read_shared_array(shared_memories[-1], descriptors[-1])
+
+        finally:
+            release_shared_memories(shared_memories)
+
+    @classmethod
+    def from_arrays(cls, vertices, weights, init_shape, target_shape):
+        """
+        Create an interpolation plan from precomputed vertices and weights, e.g. loaded from a cache
+
+        Args:
+            vertices (numpy.ndarray): indices of the vertices of each target point, for each grid (shape = W x N x K)
+            weights (numpy.ndarray): weights of the vertices of each target point, for each grid (shape = W x N x K)
+            init_shape (tuple): shape of the initial grids (H x L)
+            target_shape (tuple): shape of the target grid (R x C)
+
+        Returns:
+            InterpolationPlan: interpolation plan
+        """
+
+        interpolation_plan = cls.__new__(cls)
+        interpolation_plan.init_shape = tuple(int(size) for size in init_shape)
+        interpolation_plan.target_shape = tuple(int(size) for size in target_shape)
+        interpolation_plan.nb_of_grids = vertices.shape[0]
+        interpolation_plan.vertices = vertices
+        interpolation_plan.weights = weights
+
+        return interpolation_plan
+
+    def apply(self, data):
+        """
+        Interpolate data defined on the initial grids onto the target grid
+
+        Args:
+            data (numpy.ndarray): data to interpolate, either 2D (shape = H x L, same data for each grid) or 3D (shape = H x L x W)
+
+        Returns:
+            numpy.ndarray: 3D data interpolated on the target grid (shape = R x C x W)
+        """
+
+        if data.shape[:2] != self.init_shape:
+            raise ValueError("The data must have the same spatial shape as the initial grids of the interpolation plan")
+
+        data_flatten = np.asarray(data, dtype=np.float64).reshape(self.init_shape[0] * self.init_shape[1], -1)
+
+        interpolated_data = np.zeros((self.target_shape[0] * self.target_shape[1], self.nb_of_grids))
+
+        for i in range(self.nb_of_grids):
+            values = data_flatten[:, 0 if data.ndim == 2 else i]
+            interpolated_data[:, i] = weighted_sum_of_vertices(values, self.vertices[i], self.weights[i])
+
+        interpolated_data = np.nan_to_num(interpolated_data)
+
+        return interpolated_data.reshape(self.target_shape[0], self.target_shape[1], self.nb_of_grids)
+
+    def apply_and_sum(self, data):
+        """
+        Interpolate data defined on the initial grids onto the target grid and sum the interpolated slices, without keeping them
+
+        Args:
+            data (numpy.ndarray): data to interpolate, either 2D (shape = H x L, same data for each grid) or 3D (shape = H x L x W)
+
+        Returns:
+            numpy.ndarray: sum of the interpolated slices on the target grid (shape = R x C)
+        """
+
+        if data.shape[:2] != self.init_shape:
+            raise ValueError("The data must have the same spatial shape as the initial grids of the interpolation plan")
+
+        data_flatten = np.asarray(data, dtype=np.float64).reshape(self.init_shape[0] * self.init_shape[1], -1)
+
+        summed_data = np.zeros(self.target_shape[0] * self.target_shape[1])
+
+        for i in range(self.nb_of_grids):
+            values = data_flatten[:, 0 if data.ndim == 2 else i]
+            summed_data += np.nan_to_num(weighted_sum_of_vertices(values, self.vertices[i], self.weights[i]))
+
+        return summed_data.reshape(self.target_shape)
+
+    def apply_adjoint(self, data):
+        """
+        Back-project data defined on the target grid onto the initial grids, with the transposed interpolation weights
+
+        Args:
+            data (numpy.ndarray): data on the target grid (shape = R x C)
+
+        Returns:
+            numpy.ndarray: back-projected data on the initial grids (shape = H x L x W)
+        """
+
+        if data.shape != self.target_shape:
+            raise ValueError("The data must have the same shape as the target grid of the interpolation plan")
+
+        data_flatten = np.nan_to_num(np.asarray(data, dtype=np.float64)).ravel()
+        nb_of_init_points = self.init_shape[0] * self.init_shape[1]
+
+        back_projected_data = np.zeros((nb_of_init_points, self.nb_of_grids))
+
+        for i in range(self.nb_of_grids):
+            back_projected_data[:, i] = np.bincount(self.vertices[i].ravel(),
+                                                    weights=(self.weights[i] * data_flatten[:, np.newaxis]).ravel(),
+                                                    minlength=nb_of_init_points)
+
+        return back_projected_data.reshape(self.init_shape[0], self.init_shape[1], self.nb_of_grids)
+
+
+def weighted_sum_of_vertices(values, vertices, weights):
+    """
+    Gather the values at the simplices vertices and sum them with the corresponding weights
+
+    Args:
+        values (numpy.ndarray): values on the initial grid (1D)
+        vertices (numpy.ndarray): indices of the vertices for each target point (shape = N x K)
+        weights (numpy.ndarray): weights of the vertices for each target point (shape = N x K)
+
+    Returns:
+        numpy.ndarray: interpolated values on the target points (1D)
+    """
+
+    # accumulate in the same order as griddata to get identical results
+    result = weights[:, 0] * values[vertices[:, 0]]
+    for k in range(1, vertices.shape[1]):
+        result += weights[:, k] * values[vertices[:, k]]
+
+    return result
+
+
+def worker_barycentric_weights(args):
+    """
+    Process to parallellize the computation of the barycentric weights between a propagated grid and the detector grid
+
+    Args:
+        args (tuple): containing the following elements: X_init_2D, Y_init_2D, X_target_2D, Y_target_2D
+
+    Returns:
+        tuple: vertices indices (numpy.ndarray of shape N x 3) and barycentric weights (numpy.ndarray of shape N x 3). Target points outside of the convex hull of the initial grid get null weights
+    """
+    X_init_2D, Y_init_2D, X_target_2D, Y_target_2D = args
+
+    points = np.column_stack((X_init_2D.flatten(), Y_init_2D.flatten()))
+    target_points = np.column_stack((X_target_2D.flatten(), Y_target_2D.flatten()))
+
+    triangulation = Delaunay(points)
+    simplices = triangulation.find_simplex(target_points)
+    is_inside = simplices >= 0
+
+    transform = triangulation.transform[simplices]
+    delta = target_points - transform[:, 2, :]
+
+    c_0 = transform[:, 0, 0] * delta[:, 0] + transform[:, 0, 1] * delta[:, 1]
+    c_1 = transform[:, 1, 0] * delta[:, 0] + transform[:, 1, 1] * delta[:, 1]
+
+    weights = np.column_stack((c_0, c_1, 1 - c_0 - c_1))
+    vertices = triangulation.simplices[simplices].astype(np.int64)
+
+    weights[~is_inside] = 0
+    vertices[~is_inside] = 0
+
+    return vertices, weights
+
+
+def worker_shared_barycentric_weights(args):
+    """
+    Process to compute the barycentric weights of one grid stored in shared memory, the results are written in the shared vertices and weights arrays
+
+    Args:
+        args (tuple): containing the following elements: descriptors of the shared arrays (X_init, Y_init, X_target, Y_target, vertices, weights), index of the grid
+
+    Returns:
+        int: index of the processed grid
+    """
+    descriptors, index = args
 
+    shared_memories, arrays = attach_shared_arrays(descriptors)
+    X_init, Y_init, X_target, Y_target, vertices, weights = arrays
 
+    vertices[index], weights[index] = worker_barycentric_weights((X_init[:, :, index], Y_init[:, :, index], X_target, Y_target))
 
+    del arrays, X_init, Y_init, X_target, Y_target, vertices, weights
+    for shm in shared_memories:
+        shm.close()
 
+    return index
@@ -1,9 +1,13 @@
 import yaml
 import math
 import os
+import json
+import hashlib
 import numpy as np
 from datetime import datetime
 import h5py
+import scipy.sparse as sp
+from scipy.special import erf
 
 
 def load_yaml_config(file_path):
@@ -64,6 +68,432 @@ def save_config_file(config_file_name,config_file,result_directory):
     with open(result_directory + f"/{config_file_name}.yml", 'w') as file:
         yaml.safe_dump(config_file, file)
 
+def get_config_hash(config, sections=None, extra=None):
+    """
+    Compute a canonical hash of a configuration dictionary, independent of the order of its keys
+
+    Args:
+        config (dict): configuration dictionary
+        sections (list): names of the sections of the configuration to hash (default = the whole configuration)
+        extra: any other JSON-serializable value to include in the hash (library version, ...)
+
+    Returns:
+        str: hexadecimal SHA-256 hash
+    """
+
+    if sections is not None:
+        config = {section: config.get(section) for section in sections}
+
+    canonical_dump = json.dumps({"config": config, "extra": extra}, sort_keys=True, default=str)
+
+    return hashlib.sha256(canonical_dump.encode("utf-8")).hexdigest()
+
+def get_changed_config_keys(old_config, new_config, path=()):
+    """
+    List the keys whose values differ between two configuration dictionaries. Nested dictionaries are compared key by key
+
+    Args:
+        old_config (dict): previous configuration
+        new_config (dict): new configuration
+        path (tuple): path of the compared dictionaries in the whole configuration
+
+    Returns:
+        list: paths of the changed keys (tuples of keys, e.g. ("detector", "number of pixels along X"))
+    """
+
+    changed_keys = []
+
+    for key in list(old_config) + [key for key in new_config if key not in old_config]:
+        if key not in old_config or key not in new_config:
+            changed_keys.append(path + (key,))
+        elif isinstance(old_config[key], dict) and isinstance(new_config[key], dict):
+            changed_keys += get_changed_config_keys(old_config[key], new_config[key], path + (key,))
+        elif old_config[key] != new_config[key]:
+            changed_keys.append(path + (key,))
+
+    return changed_keys
+
+def get_arrays_hash(*arrays):
+    """
+    Compute a hash of the content of numpy arrays (shapes, data types and values)
+
+    Args:
+        *arrays (numpy.ndarray): arrays to hash
+
+    Returns:
+        str: hexadecimal SHA-256 hash
+    """
+
+    sha = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        sha.update(str((array.shape, array.dtype.str)).encode("utf-8"))
+        sha.update(array.view(np.uint8).ravel() if array.size else b"")
+
+    return sha.hexdigest()
+
+def downcast_losslessly(data):
+    """
+    Downcast an array to a smaller data type when no information is lost : binary arrays to bool, float64 arrays to float32 when all the values are exactly representable
+
+    Args:
+        data (numpy.ndarray): array to downcast
+
+    Returns:
+        numpy.ndarray: downcasted array, or the input array if it cannot be downcasted losslessly
+    """
+
+    data = np.asarray(data)
+
+    if data.size == 0 or data.dtype.kind not in "iuf":
+        return data
+
+    if np.all((data == 0) | (data == 1)):
+        return data.astype(bool)
+
+    if data.dtype == np.float64:
+        data_float32 = data.astype(np.float32)
+        if np.array_equal(data_float32, data, equal_nan=True):
+            return data_float32
+
+    return data
+
+def get_chunk_shape(shape):
+    """
+    Choose the HDF5 chunk shape of a dataset so that one wavelength slice (last axis) of one shot (leading axes) is read with a few chunks
+
+    Args:
+        shape (tuple): shape of the dataset, the two spatial axes are the last two axes of 2D arrays and the two axes before the wavelengths axis of arrays with 3 dimensions or more
+
+    Returns:
+        tuple or bool: chunk shape, or True to let h5py choose it for 1D arrays
+    """
+
+    if len(shape) < 2:
+        return True
+
+    if len(shape) == 2:
+        return (min(shape[0], 256), min(shape[1], 256))
+
+    return (1,) * (len(shape) - 3) + (min(shape[-3], 128), min(shape[-2], 128), 1)
+
+def write_dataset_in_hdf5(h5_file, name, data, compression="lzf", compression_opts=None, shuffle=True):
+    """
+    Write an array in an open HDF5 file, chunked for per-wavelength slice reads, compressed and losslessly downcasted. The original data type is stored in the "dtype" attribute of the dataset
+
+    Args:
+        h5_file (h5py.File or h5py.Group): open HDF5 file
+        name (str): name of the dataset
+        data (numpy.ndarray): data to save
+        compression (str): "gzip", "lzf" or None
+        compression_opts (int): compression level, for gzip
+        shuffle (bool): if True, the shuffle filter is applied before the compression
+
+    Returns:
+        h5py.Dataset: written dataset
+    """
+
+    data = np.asarray(data)
+    stored_data = downcast_losslessly(data)
+
+    if stored_data.ndim == 0 or stored_data.size == 0 or compression is None:
+        dataset = h5_file.create_dataset(name, data=stored_data)
+    else:
+        dataset = h5_file.create_dataset(name, data=stored_data, chunks=get_chunk_shape(stored_data.shape),
+                                         compression=compression, compression_opts=compression_opts, shuffle=shuffle)
+
+    dataset.attrs["dtype"] = data.dtype.str
+
+    return dataset
+
+def save_data_in_hdf5_container(file_path, datasets, configs=None, compression="lzf", compression_opts=None, shuffle=True):
+    """
+    Save several datasets and configuration files in a single HDF5 container
+
+    Args:
+        file_path (str): path to the HDF5 file
+        datasets (dict): arrays to save, by dataset name. None values are skipped
+        configs (dict): configuration dictionaries, by name, stored as YAML attributes of the file
+        compression (str): "gzip", "lzf" or None
+        compression_opts (int): compression level, for gzip
+        shuffle (bool): if True, the shuffle filter is applied before the compression
+
+    """
+
+    with h5py.File(file_path, 'w') as f:
+        for name, config in (configs or {}).items():
+            f.attrs[name] = yaml.safe_dump(config)
+
+        for name, data in datasets.items():
+            if data is not None:
+                write_dataset_in_hdf5(f, name, data, compression, compression_opts, shuffle)
+
+def append_shot_in_hdf5(h5_file, shot_datasets, compression="lzf", compression_opts=None, shuffle=True):
+    """
+    Append the arrays of one shot to resizable datasets of an open HDF5 file (one row per shot along the first axis), then flush the file.
+    The datasets are created on the first shot. The number of complete shots is stored in the "completed shots" attribute of the file, so that a file left by an interrupted run stays readable up to its last complete shot
+
+    Args:
+        h5_file (h5py.File): open HDF5 file
+        shot_datasets (dict): arrays of the shot, by dataset name. None values are skipped
+        compression (str): "gzip", "lzf" or None
+        compression_opts (int): compression level, for gzip
+        shuffle (bool): if True, the shuffle filter is applied before the compression
+
+    Returns:
+        int: number of complete shots in the file
+    """
+
+    nb_of_shots = int(h5_file.attrs.get("completed shots", 0))
+
+    for name, data in shot_datasets.items():
+        if data is None:
+            continue
+
+        data = np.asarray(data)
+
+        if name not in h5_file:
+            if data.ndim >= 2:
+                chunks = (1,) + get_chunk_shape(data.shape)
+            else:
+                chunks = (1,) + data.shape
+            dataset = h5_file.create_dataset(name, shape=(0,) + data.shape, maxshape=(None,) + data.shape, dtype=data.dtype, chunks=chunks,
+                                             compression=compression, compression_opts=compression_opts, shuffle=shuffle and compression is not None)
+            dataset.attrs["dtype"] = data.dtype.str
+            dataset.attrs["per shot"] = True
+
+        dataset = h5_file[name]
+        # rows left by an interrupted shot are overwritten
+        dataset.resize(nb_of_shots + 1, axis=0)
+        dataset[nb_of_shots] = data
+
+    h5_file.attrs["completed shots"] = nb_of_shots + 1
+    h5_file.flush()
+
+    return nb_of_shots + 1
+
+def load_data_from_hdf5_container(file_path, names=None):
+    """
+    Load the datasets and configuration files of an HDF5 container written by save_data_in_hdf5_container or append_shot_in_hdf5, with their original data types.
+    The per-shot datasets are truncated to the complete shots
+
+    Args:
+        file_path (str): path to the HDF5 file
+        names (list): names of the datasets to load, the missing ones are skipped (default = all the datasets)
+
+    Returns:
+        tuple: datasets (dict of numpy.ndarray) and configuration dictionaries (dict of dict)
+    """
+
+    with h5py.File(file_path, 'r') as f:
+        configs = {name: yaml.safe_load(value) for name, value in f.attrs.items() if isinstance(value, str)}
+        nb_of_shots = int(f.attrs.get("completed shots", 0))
+
+        datasets = {}
+        for name, dataset in f.items():
+            if not isinstance(dataset, h5py.Dataset) or (names is not None and name not in names):
+                continue
+            data = dataset[:nb_of_shots] if dataset.attrs.get("per shot", False) else dataset[()]
+            datasets[name] = data.astype(dataset.attrs.get("dtype", dataset.dtype), copy=False)
+
+    return datasets, configs
+
+def read_completed_shots(file_path):
+    """
+    Read the number of complete shots of an HDF5 container written by append_shot_in_hdf5
+
+    Args:
+        file_path (str): path to the HDF5 file
+
+    Returns:
+        int: number of complete shots, 0 if no shot was appended
+    """
+
+    with h5py.File(file_path, 'r') as f:
+        return int(f.attrs.get("completed shots", 0))
+
+def linear_interpolation_weights(sampling, new_sampling):
+    """
+    Compute the 1D linear interpolation weights between a monotonic sampling and a new sampling
+
+    Args:
+        sampling (numpy.ndarray): strictly monotonic sampling of the data (1D)
+        new_sampling (numpy.ndarray): positions where the data is interpolated (any shape)
+
+    Returns:
+        tuple: indices of the left neighbours (numpy.ndarray), indices of the right neighbours (numpy.ndarray) and weights of the right neighbours (numpy.ndarray), with the shape of new_sampling. Positions outside of the sampling range get NaN weights
+    """
+
+    sampling = np.asarray(sampling, dtype=np.float64)
+    new_sampling = np.asarray(new_sampling, dtype=np.float64)
+
+    if sampling.shape[0] == 1:
+        indices = np.zeros(new_sampling.shape, dtype=np.int64)
+        right_weights = np.where(new_sampling == sampling[0], 0., np.nan)
+        return indices, indices, right_weights
+
+    # work on an increasing sampling
+    is_decreasing = sampling[-1] < sampling[0]
+    if is_decreasing:
+        sampling = sampling[::-1]
+
+    left_indices = np.clip(np.searchsorted(sampling, new_sampling, side="right") - 1, 0, sampling.shape[0] - 2)
+    right_indices = left_indices + 1
+
+    steps = sampling[right_indices] - sampling[left_indices]
+    right_weights = (new_sampling - sampling[left_indices]) / steps
+
+    # positions on the edges are kept despite rounding errors
+    tolerance = 1e-10
+    right_weights[(right_weights < -tolerance) | (right_weights > 1 + tolerance)] = np.nan
+    right_weights = np.clip(right_weights, 0, 1)
+
+    if is_decreasing:
+        left_indices, right_indices = sampling.shape[0] - 1 - left_indices, sampling.shape[0] - 1 - right_indices
+
+    return left_indices, right_indices, right_weights
+
+def linear_interpolation_matrix(sampling, new_sampling):
+    """
+    Compute the sparse matrix of the 1D linear interpolation between a monotonic sampling and a new sampling
+
+    Args:
+        sampling (numpy.ndarray): strictly monotonic sampling of the data (shape = N)
+        new_sampling (numpy.ndarray): positions where the data is interpolated (shape = M)
+
+    Returns:
+        scipy.sparse.csr_matrix: interpolation matrix (shape = M x N), rows of positions outside of the sampling range are null
+    """
+
+    left_indices, right_indices, right_weights = linear_interpolation_weights(sampling, new_sampling)
+
+    is_inside = ~np.isnan(right_weights)
+    rows = np.arange(new_sampling.shape[0])[is_inside]
+
+    interpolation_matrix = sp.csr_matrix((np.concatenate((1 - right_weights[is_inside], right_weights[is_inside])),
+                                          (np.concatenate((rows, rows)),
+                                           np.concatenate((left_indices[is_inside], right_indices[is_inside])))),
+                                         shape=(new_sampling.shape[0], sampling.shape[0]))
+
+    return interpolation_matrix
+
+def cubic_interpolation_matrix(sampling, new_sampling):
+    """
+    Compute the sparse matrix of the 1D local cubic interpolation between a monotonic sampling and a new sampling : each position is interpolated by the Lagrange polynomial of its 4 nearest samples (2 on each side, shifted inside the sampling on the edges)
+
+    Args:
+        sampling (numpy.ndarray): strictly monotonic sampling of the data (shape = N, N >= 4)
+        new_sampling (numpy.ndarray): positions where the data is interpolated (shape = M)
+
+    Returns:
+        scipy.sparse.csr_matrix: interpolation matrix (shape = M x N), rows of positions outside of the sampling range are null
+    """
+
+    sampling = np.asarray(sampling, dtype=np.float64)
+    new_sampling = np.asarray(new_sampling, dtype=np.float64)
+
+    if sampling.shape[0] < 4:
+        raise ValueError("The cubic interpolation needs at least 4 samples")
+
+    left_indices, right_indices, right_weights = linear_interpolation_weights(sampling, new_sampling)
+    is_inside = ~np.isnan(right_weights)
+
+    # first sample of the 4 samples window, in the order of the sampling
+    first_indices = np.clip(np.minimum(left_indices, right_indices) - 1, 0, sampling.shape[0] - 4)
+    window_indices = first_indices[:, np.newaxis] + np.arange(4)
+    window_samples = sampling[window_indices]
+
+    # Lagrange basis polynomials of the window, evaluated at the new positions
+    weights = np.ones((new_sampling.shape[0], 4))
+    for k in range(4):
+        for m in range(4):
+            if m != k:
+                weights[:, k] *= (new_sampling - window_samples[:, m]) / (window_samples[:, k] - window_samples[:, m])
+
+    rows = np.repeat(np.arange(new_sampling.shape[0]), 4).reshape(-1, 4)
+
+    interpolation_matrix = sp.csr_matrix((weights[is_inside].ravel(), (rows[is_inside].ravel(), window_indices[is_inside].ravel())),
+                                         shape=(new_sampling.shape[0], sampling.shape[0]))
+
+    return interpolation_matrix
+
+def band_integration_matrix(sampling, new_sampling, kind="box", bandwidth=None):
+    """
+    Compute the sparse matrix integrating the data over the spectral response function (SRF) of each new band. The data is taken as constant over the cell of each sample (bounded by the middles between samples) and the weights of each row sum to 1
+
+    Args:
+        sampling (numpy.ndarray): strictly monotonic sampling of the data (shape = N)
+        new_sampling (numpy.ndarray): centers of the new bands (shape = M)
+        kind (str): "box" for a rectangular SRF of width bandwidth, "gaussian" for a gaussian SRF of full width at half maximum bandwidth
+        bandwidth (float or numpy.ndarray): width of the SRF of each new band (default = spacing of the new sampling)
+
+    Returns:
+        scipy.sparse.csr_matrix: integration matrix (shape = M x N), rows of bands outside of the sampling range are null
+    """
+
+    sampling = np.asarray(sampling, dtype=np.float64)
+    new_sampling = np.asarray(new_sampling, dtype=np.float64)
+
+    # work on an increasing sampling
+    order = np.argsort(sampling)
+    sorted_sampling = sampling[order]
+
+    if bandwidth is None:
+        bandwidth = np.abs(np.gradient(new_sampling)) if new_sampling.shape[0] > 1 else np.abs(np.diff(sorted_sampling)).mean()
+    bandwidth = np.broadcast_to(np.asarray(bandwidth, dtype=np.float64), new_sampling.shape)[:, np.newaxis]
+
+    if sorted_sampling.shape[0] > 1:
+        middles = (sorted_sampling[1:] + sorted_sampling[:-1]) / 2
+        edges = np.concatenate(([2 * sorted_sampling[0] - middles[0]], middles, [2 * sorted_sampling[-1] - middles[-1]]))
+    else:
+        edges = sorted_sampling[0] + np.array([-0.5, 0.5]) * bandwidth.max()
+
+    lower_edges = edges[np.newaxis, :-1] - new_sampling[:, np.newaxis]
+    upper_edges = edges[np.newaxis, 1:] - new_sampling[:, np.newaxis]
+
+    if kind == "box":
+        weights = np.clip(np.minimum(upper_edges, bandwidth / 2) - np.maximum(lower_edges, -bandwidth / 2), 0, None)
+    elif kind == "gaussian":
+        sigma = bandwidth / (2 * np.sqrt(2 * np.log(2)))
+        weights = (erf(upper_edges / (np.sqrt(2) * sigma)) - erf(lower_edges / (np.sqrt(2) * sigma))) / 2
+        # the SRF is truncated at 4 sigma to keep the matrix sparse
+        weights[(upper_edges < -4 * sigma) | (lower_edges > 4 * sigma)] = 0
+    else:
+        raise ValueError(f"Unknown band integration kind : {kind}")
+
+    is_inside = (new_sampling >= sorted_sampling[0]) & (new_sampling <= sorted_sampling[-1])
+    weights[~is_inside] = 0
+
+    sums = weights.sum(axis=1, keepdims=True)
+    weights = np.divide(weights, sums, out=np.zeros_like(weights), where=sums > 0)
+
+    integration_matrix = sp.csr_matrix(weights)
+
+    return integration_matrix[:, np.argsort(order)]
+
+def spectral_resampling_matrix(sampling, new_sampling, kind="linear", bandwidth=None):
+    """
+    Compute the sparse matrix resampling spectra from a sampling to a new sampling, so that the resampling of many spectra is a single matrix product
+
+    Args:
+        sampling (numpy.ndarray): strictly monotonic wavelengths sampling of the data (shape = W_old)
+        new_sampling (numpy.ndarray): new wavelengths sampling (shape = W_new)
+        kind (str): "linear" or "cubic" interpolation, or "box" or "gaussian" band integration (cf. band_integration_matrix)
+        bandwidth (float or numpy.ndarray): width of the spectral response functions, for the band integration kinds
+
+    Returns:
+        scipy.sparse.csr_matrix: resampling matrix (shape = W_new x W_old)
+    """
+
+    if kind == "linear":
+        return linear_interpolation_matrix(sampling, np.asarray(new_sampling))
+    elif kind == "cubic":
+        return cubic_interpolation_matrix(sampling, new_sampling)
+    elif kind in ["box", "gaussian"]:
+        return band_integration_matrix(sampling, new_sampling, kind, bandwidth)
+    else:
+        raise ValueError(f"Unknown spectral resampling kind : {kind}")
+
 def rotation_z(theta):
     """
     Rotate 3D matrix around the Z axis
@@ -118,4 +548,18 @@ def rotation_x(theta):
                   (0, math.cos(theta), -math.sin(theta)),
                   (0, math.sin(theta), math.cos(theta))))
 
-    return r
\ No newline at end of file
+    return r
+
+def rotate(r, k):
+    """
+    Apply a 3D rotation matrix to wave vectors of any shape
+
+    Args:
+        r (numpy.ndarray): 3D rotation matrix (shape = 3 x 3)
+        k (numpy.ndarray): wave vectors, with the 3 components along the first axis (shape = 3 x ...)
+
+    Returns:
+        numpy.ndarray: rotated wave vectors (same shape as k)
+    """
+
+    return np.tensordot(r, k, axes=1)
@@ -2,12 +2,13 @@ import numpy as np
 from scipy import fftpack
 from scipy import ndimage
 import h5py
-def generate_blue_noise_type_1_pattern(shape):
+def generate_blue_noise_type_1_pattern(shape, rng=None):
     """
     Generate blue noise (high frequency pseudo-random) type pattern
 
     Args:
         shape (tuple of int): shape of the pattern
+        rng (numpy.random.Generator): random generator (default = a new unseeded generator)
 
     Returns:
         numpy.ndarray: binary blue noise type pattern
@@ -15,7 +16,8 @@ def generate_blue_noise_type_1_pattern(shape):
     """
 
     N = shape[0] * shape[1]
-    rng = np.random.default_rng()
+    if rng is None:
+        rng = np.random.default_rng()
     noise = rng.standard_normal(N)
     noise = np.reshape(noise, shape)
 
@@ -35,7 +37,7 @@ def generate_blue_noise_type_1_pattern(shape):
 
     return binary_pattern
 
-def generate_orthogonal_pattern(size, W, N):
+def generate_orthogonal_pattern(size, W, N, rng=None):
     """
     Generate an orthogonal pattern according to https://hal.laas.fr/hal-02993037
 
@@ -43,11 +45,15 @@ def generate_orthogonal_pattern(size, W, N):
         size (list of int): size of the pattern
         W (int): number of wavelengths in the scene
         N (int): number of acquisitions
+        rng (numpy.random.Generator): random generator (default = the global numpy random generator)
 
     Returns:
         numpy.ndarray: orthogonal pattern :  shape =  size[0] x (size[1]+W-1) x N):
     """
 
+    if rng is None:
+        rng = np.random
+
     C, R = size[0], size[1] # Number of columns, number of rows
 
     K = C + W - 1 # Number of columns in H
@@ -58,7 +64,7 @@ def generate_orthogonal_pattern(size, W, N):
         for n in range(N):
             if available_pos:
                 if (len(available_pos)>=M):
-                    ind = np.random.choice(len(available_pos), M, replace=False) # Indices of the N positions among the available ones
+                    ind = rng.choice(len(available_pos), M, replace=False) # Indices of the N positions among the available ones
                     pos = np.array(available_pos)[ind] # N mirrors to open
                 else:
                     ind = list(range(len(available_pos)))
@@ -71,7 +77,7 @@ def generate_orthogonal_pattern(size, W, N):
 
     return pattern
 
-def generate_ln_orthogonal_pattern(size, W, N):
+def generate_ln_orthogonal_pattern(size, W, N, rng=None):
     """
     Generate a Length-N orthogonal pattern according to https://hal.laas.fr/hal-02993037
 
@@ -79,11 +85,14 @@ def generate_ln_orthogonal_pattern(size, W, N):
         size (tuple): size of the pattern
         W (int): number of wavelengths in the scene
         N (int): number of acquisitions
+        rng (numpy.random.Generator): random generator (default = the global numpy random generator)
 
     Returns:
         numpy.ndarray : length-N orthogonal pattern of shape = size[0] x (size[1]+W-1) x N):
     """
 
+    randint = np.random.randint if rng is None else rng.integers
+
     C, R = size[1], size[0] # Number of columns, number of rows
 
     K = C + W - 1 # Number of columns in H
@@ -93,12 +102,12 @@ def generate_ln_orthogonal_pattern(size, W, N):
         for m in range(M):
             available = list(range(m*N, m*N+N)) # Positions of possible mirrors to open
             for n in range(N):
-                ind = np.random.randint(len(available)) # Randomly choose a mirror among the possible ones
+                ind = randint(len(available)) # Randomly choose a mirror among the possible ones
                 H_model[line, available[ind], n] = 1 # Open the mirror
                 available.pop(ind) # Remove the mirror from the list of possible ones
         available = list(range(M*N, W)) # List of positions where we can't apply the Length-N method (if W%N != 0)
         for n in range(W-(M*N)):
-            ind = np.random.randint(len(available)) # Randomly open those mirrors among the remaining positions
+            ind = randint(len(available)) # Randomly open those mirrors among the remaining positions
             H_model[line, available[ind], n] = 1
             available.pop(ind)
     pattern = np.tile(H_model, [1, int(np.ceil(K/W)), 1])[:, :K, :]
@@ -110,19 +119,23 @@ def generate_ln_orthogonal_pattern(size, W, N):
 
     return list_of_patterns
 
-def generate_random_pattern(shape, ROM):
+def generate_random_pattern(shape, ROM, rng=None):
     """
     Generate a random pattern with a given rate of open/close mirrors
 
     Args:
         shape (tuple of int): shape of the pattern
         ROM (float): ratio of open mirrors
+        rng (numpy.random.Generator): random generator (default = the global numpy random generator)
 
     Returns:
         numpy.ndarray: random pattern
     """
 
-    pattern = np.random.choice([0, 1], size=shape, p=[1 - ROM, ROM])
+    if rng is None:
+        rng = np.random
+
+    pattern = rng.choice([0, 1], size=shape, p=[1 - ROM, ROM])
 
     return pattern
 
@@ -181,7 +194,7 @@ def FindTightestCluster(BinaryPattern,StandardDeviation):
     return np.argmax(np.where(BinaryPattern,FilteredArray,-1.0))
 
 # Source of blue noise codes: https://momentsingraphics.de/BlueNoise.html
-def GetVoidAndClusterBlueNoise(OutputShape,StandardDeviation=1.5,InitialSeedFraction=0.1):
+def GetVoidAndClusterBlueNoise(OutputShape,StandardDeviation=1.5,InitialSeedFraction=0.1,rng=None):
     """Generates a blue noise dither array of the given shape using the method
        proposed by Ulichney [1993] in "The void-and-cluster method for dither array
        generation" published in Proc. SPIE 1913.
@@ -201,6 +214,8 @@ def GetVoidAndClusterBlueNoise(OutputShape,StandardDeviation=1.5,InitialSeedFrac
              defines the fraction of such points. It has to be positive but less
              than 0.5. Very small values lead to ordered patterns, beyond that there
              is little change.
+      \param rng The numpy.random.Generator of the initial pattern (default is the
+             global numpy random generator).
       \return An integer array of shape OutputShape containing each integer from 0
               to np.prod(OutputShape)-1 exactly once."""
     nRank=np.prod(OutputShape)
@@ -208,7 +223,9 @@ def GetVoidAndClusterBlueNoise(OutputShape,StandardDeviation=1.5,InitialSeedFrac
     nInitialOne=max(1,min(int((nRank-1)/2),int(nRank*InitialSeedFraction)))
     # Start from white noise (this is the only randomized step)
     InitialBinaryPattern=np.zeros(OutputShape,dtype=bool)
-    InitialBinaryPattern.flat=np.random.permutation(np.arange(nRank))<nInitialOne
+    if rng is None:
+        rng=np.random
+    InitialBinaryPattern.flat=rng.permutation(np.arange(nRank))<nInitialOne
     # Swap ones from tightest clusters to largest voids iteratively until convergence
     while(True):
         iTightestCluster=FindTightestCluster(InitialBinaryPattern,StandardDeviation)
@@ -241,7 +258,7 @@ def GetVoidAndClusterBlueNoise(OutputShape,StandardDeviation=1.5,InitialSeedFrac
         DitherArray.flat[iTightestCluster]=Rank
     return DitherArray
 
-def generate_blue_noise_type_2_pattern(shape, std=1.5, initial_seed_fraction=0.1):
+def generate_blue_noise_type_2_pattern(shape, std=1.5, initial_seed_fraction=0.1, rng=None):
     """
     Generate blue noise pattern according to the void-and-cluster method proposed by Ulichney [1993] in "The void-and-cluster method for dither array generation" published in Proc. SPIE 1913.
 
@@ -250,10 +267,11 @@ def generate_blue_noise_type_2_pattern(shape, std=1.5, initial_seed_fraction=0.1
         std (float): standard deviation in pixels used for the Gaussian filter
         initial_seed_fraction (float): Initial fraction of marked pixels in the grid. Has to be less than 0.5.
                                          Very small values lead to ordered patterns
+        rng (numpy.random.Generator): random generator (default = the global numpy random generator)
     Returns:
         numpy.ndarray: float blue noise pattern
     """
-    texture=GetVoidAndClusterBlueNoise(shape,std, initial_seed_fraction)
+    texture=GetVoidAndClusterBlueNoise(shape,std, initial_seed_fraction, rng)
     pattern = (texture/np.max(texture)) # Float value between 0 and 1
 
     return pattern
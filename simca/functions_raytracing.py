@@ -0,0 +1,136 @@
+import math
+import numpy as np
+
+# numba is optional : the fused ray tracing kernels are compiled when it is installed, and used if the "numba" backend is selected
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def get_ray_tracing_backend(system_config):
+    """
+    Get the ray tracing backend selected in the system configuration
+
+    Args:
+        system_config (dict): system configuration
+
+    Returns:
+        str: "numpy" (default), or "numba" for the fused ray tracing kernels
+    """
+
+    return system_config["system architecture"].get("ray tracing backend", "numpy")
+
+def propagate_rays_through_prism_arm(X_vec_in, Y_vec_in, n, rotation_in, rotation_prism, rotation_out, F, X_vec_out, Y_vec_out):
+    """
+    Fused ray tracing through one system arm with a prism (lens + prism + lens), one ray at a time.
+    Equivalent to OpticalModel.propagate_through_arm, with the rotation matrices composed beforehand
+
+    Args:
+        X_vec_in (numpy.ndarray): X coordinates of the coded aperture pixels (shape = N)
+        Y_vec_in (numpy.ndarray): Y coordinates of the coded aperture pixels (shape = N)
+        n (numpy.ndarray): refractive indexes of the prism at each wavelength (shape = W)
+        rotation_in (numpy.ndarray): composed rotation from the lens frame to the prism entrance frame (shape = 3 x 3)
+        rotation_prism (numpy.ndarray): rotation between the prism faces (shape = 3 x 3)
+        rotation_out (numpy.ndarray): composed rotation from the prism exit frame to the lens frame (shape = 3 x 3)
+        F (float): focal length of the lenses -- in um
+        X_vec_out (numpy.ndarray): output array of the propagated X coordinates (shape = N x W)
+        Y_vec_out (numpy.ndarray): output array of the propagated Y coordinates (shape = N x W)
+    """
+
+    for i in range(X_vec_in.shape[0]):
+
+        alpha = -1 * math.atan(X_vec_in[i] / F)
+        beta = -1 * math.atan(Y_vec_in[i] / F)
+
+        k_x = math.sin(alpha) * math.cos(beta)
+        k_y = math.sin(beta) * math.cos(alpha)
+        k_z = math.cos(alpha) * math.cos(beta)
+
+        k_3_x = rotation_in[0, 0] * k_x + rotation_in[0, 1] * k_y + rotation_in[0, 2] * k_z
+        k_3_y = rotation_in[1, 0] * k_x + rotation_in[1, 1] * k_y + rotation_in[1, 2] * k_z
+        k_3_z = rotation_in[2, 0] * k_x + rotation_in[2, 1] * k_y + rotation_in[2, 2] * k_z
+
+        norm_k = math.sqrt(k_3_x ** 2 + k_3_y ** 2 + k_3_z ** 2)
+        k_3_x /= norm_k
+        k_3_y /= norm_k
+
+        for j in range(n.shape[0]):
+
+            kp_z = math.sqrt(n[j] ** 2 - k_3_x ** 2 - k_3_y ** 2)
+
+            kp_r_x = rotation_prism[0, 0] * k_3_x + rotation_prism[0, 1] * k_3_y + rotation_prism[0, 2] * kp_z
+            kp_r_y = rotation_prism[1, 0] * k_3_x + rotation_prism[1, 1] * k_3_y + rotation_prism[1, 2] * kp_z
+            kp_r_z = math.sqrt(1 - kp_r_x ** 2 - kp_r_y ** 2)
+
+            k_out_x = kp_r_x * norm_k
+            k_out_y = kp_r_y * norm_k
+            k_out_z = kp_r_z * norm_k
+
+            k_1_bis_x = rotation_out[0, 0] * k_out_x + rotation_out[0, 1] * k_out_y + rotation_out[0, 2] * k_out_z
+            k_1_bis_y = rotation_out[1, 0] * k_out_x + rotation_out[1, 1] * k_out_y + rotation_out[1, 2] * k_out_z
+            k_1_bis_z = rotation_out[2, 0] * k_out_x + rotation_out[2, 1] * k_out_y + rotation_out[2, 2] * k_out_z
+
+            X_vec_out[i, j] = F * math.tan(math.atan(k_1_bis_x / k_1_bis_z))
+            Y_vec_out[i, j] = F * math.tan(math.atan(k_1_bis_y / k_1_bis_z))
+
+
+def propagate_rays_through_grating_arm(X_vec_in, Y_vec_in, lba, rotation_in, rotation_out, F, m, G, X_vec_out, Y_vec_out):
+    """
+    Fused ray tracing through one system arm with a grating (lens + grating + lens), one ray at a time.
+    Equivalent to OpticalModel.propagate_through_arm, with the rotation matrices composed beforehand
+
+    Args:
+        X_vec_in (numpy.ndarray): X coordinates of the coded aperture pixels (shape = N)
+        Y_vec_in (numpy.ndarray): Y coordinates of the coded aperture pixels (shape = N)
+        lba (numpy.ndarray): wavelengths -- in nm (shape = W)
+        rotation_in (numpy.ndarray): composed rotation from the lens frame to the grating frame (shape = 3 x 3)
+        rotation_out (numpy.ndarray): composed rotation from the grating frame to the lens frame (shape = 3 x 3)
+        F (float): focal length of the lenses -- in um
+        m (float): diffraction order of the grating -- no units
+        G (float): lines density of the grating -- in lines/mm
+        X_vec_out (numpy.ndarray): output array of the propagated X coordinates (shape = N x W)
+        Y_vec_out (numpy.ndarray): output array of the propagated Y coordinates (shape = N x W)
+    """
+
+    for i in range(X_vec_in.shape[0]):
+
+        alpha = -1 * math.atan(X_vec_in[i] / F)
+        beta = -1 * math.atan(Y_vec_in[i] / F)
+
+        k_x = math.sin(alpha) * math.cos(beta)
+        k_y = math.sin(beta) * math.cos(alpha)
+        k_z = math.cos(alpha) * math.cos(beta)
+
+        k_3_x = rotation_in[0, 0] * k_x + rotation_in[0, 1] * k_y + rotation_in[0, 2] * k_z
+        k_3_y = rotation_in[1, 0] * k_x + rotation_in[1, 1] * k_y + rotation_in[1, 2] * k_z
+        k_3_z = rotation_in[2, 0] * k_x + rotation_in[2, 1] * k_y + rotation_in[2, 2] * k_z
+
+        norm_k = math.sqrt(k_3_x ** 2 + k_3_y ** 2 + k_3_z ** 2)
+        k_3_x /= norm_k
+        k_3_y /= norm_k
+
+        alpha_in = math.atan(k_3_x) * math.sqrt(1 + math.tan(k_3_x) ** 2 + math.tan(k_3_y) ** 2)
+        beta_in = math.atan(k_3_y) * math.sqrt(1 + math.tan(k_3_x) ** 2 + math.tan(k_3_y) ** 2)
+
+        for j in range(lba.shape[0]):
+
+            alpha_out = -1 * math.asin(m * lba[j] * 10 ** -9 * G * 10 ** 3 - math.sin(alpha_in))
+            beta_out = beta_in
+
+            k_out_x = math.sin(alpha_out) * math.cos(beta_out) * norm_k
+            k_out_y = math.sin(beta_out) * math.cos(alpha_out) * norm_k
+            k_out_z = math.cos(alpha_out) * math.cos(beta_out) * norm_k
+
+            k_1_bis_x = rotation_out[0, 0] * k_out_x + rotation_out[0, 1] * k_out_y + rotation_out[0, 2] * k_out_z
+            k_1_bis_y = rotation_out[1, 0] * k_out_x + rotation_out[1, 1] * k_out_y + rotation_out[1, 2] * k_out_z
+            k_1_bis_z = rotation_out[2, 0] * k_out_x + rotation_out[2, 1] * k_out_y + rotation_out[2, 2] * k_out_z
+
+            X_vec_out[i, j] = F * math.tan(math.atan(k_1_bis_x / k_1_bis_z))
+            Y_vec_out[i, j] = F * math.tan(math.atan(k_1_bis_y / k_1_bis_z))
+
+
+if numba is not None:
+    # compiled serially : numba threads would not survive the fork of the acquisition worker pool
+    propagate_rays_through_prism_arm = numba.njit(cache=True)(propagate_rays_through_prism_arm)
+    propagate_rays_through_grating_arm = numba.njit(cache=True)(propagate_rays_through_grating_arm)
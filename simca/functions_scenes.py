@@ -2,23 +2,60 @@ import numpy as np
 import seaborn as sns
 import h5py
 from sklearn.decomposition import PCA
+from simca.LazyDataset import LazyDataset, LazyLabels
+from simca.DatasetCache import DatasetCache
+from simca.functions_general_purpose import spectral_resampling_matrix
 
-def get_dataset(dataset_name, folder="./datasets/"):
+_dataset_cache = None
+
+
+def get_dataset_cache(max_bytes=None):
+    """
+    Get the dataset cache shared by all the CassiSystem instances of the process (cf. CassiSystem.load_dataset). The cache is created on first use,
+    with a memory cap of 2 GiB : larger datasets are not cached unless the cap is raised, e.g. get_dataset_cache(max_bytes=16 * 1024 ** 3)
+
+    Args:
+        max_bytes (int): if given, new memory cap of the cache -- in bytes
+
+    Returns:
+        DatasetCache: dataset cache
+    """
+    global _dataset_cache
+
+    if _dataset_cache is None:
+        _dataset_cache = DatasetCache() if max_bytes is None else DatasetCache(max_bytes)
+    elif max_bytes is not None:
+        _dataset_cache.resize(max_bytes)
+
+    return _dataset_cache
+
+def get_dataset_path(dataset_name, folder="./datasets/"):
+    """Gets the path to the HDF5 file of the dataset specified by name.
+    Args:
+        dataset_name (str): the name of the dataset
+        folder (str): folder where the datasets are stored, defaults to "./datasets/"
+    Returns:
+        str: path to the HDF5 file
+    """
+
+    return folder + dataset_name + "/" + dataset_name + ".h5"
+
+def get_dataset(dataset_name, folder="./datasets/", lazy=False):
     """Gets the dataset specified by name and return the related components.
     Args:
         dataset_name (str): the name of the dataset
         folder (str): folder where the datasets are stored, defaults to "./datasets/"
+        lazy (bool): if True, the scene is not read but returned as a LazyDataset handle, memory-mapped when it is stored contiguously.
+            The pixels with a NaN in any band are then set to 0 when the scene is read, and the labels are returned as a LazyLabels view resetting the labels of these pixels, as when the scene is loaded eagerly
     Returns:
-        numpy.ndarray: 3D hyperspectral image (WxHxB)
-        numpy.ndarray: 2D array of labels (integers)
+        numpy.ndarray or LazyDataset: 3D hyperspectral image (WxHxB)
+        numpy.ndarray or LazyLabels: 2D array of labels (integers)
         list: list of class names
         ignored_labels: list of int classes to ignore
     """
 
-    folder = folder + dataset_name + "/"
-    h5_file = h5py.File(folder + dataset_name + ".h5", "r")
-
-    scene = np.array(h5_file["scene"],dtype=np.float32)
+    file_path = get_dataset_path(dataset_name, folder)
+    h5_file = h5py.File(file_path, "r")
 
     # For matlab generated h5
     wavelengths_vec = np.array(h5_file["wavelengths"])[0]
@@ -26,9 +63,21 @@ def get_dataset(dataset_name, folder="./datasets/"):
     if wavelengths_vec.shape[0] == 1:
         wavelengths_vec = np.array(h5_file["wavelengths"])
 
-    # No NaN accepted
-    nan_mask = np.isnan(scene.sum(axis=-1))
-    scene[nan_mask] = 0
+    if lazy:
+        source = h5_file["scene"]
+        offset = source.id.get_offset()
+        # a contiguous and uncompressed scene is read through a memory map, which is faster than h5py for small regions
+        if source.chunks is None and source.compression is None and offset is not None:
+            source = np.memmap(file_path, dtype=source.dtype, mode="r", offset=offset, shape=source.shape)
+        scene = LazyDataset(source)
+        nan_mask = None
+
+    else:
+        scene = np.array(h5_file["scene"],dtype=np.float32)
+
+        # No NaN accepted
+        nan_mask = np.isnan(scene.sum(axis=-1))
+        scene[nan_mask] = 0
 
     try:
         labels = np.array(h5_file["labels"], dtype=np.int8)
@@ -40,7 +89,11 @@ def get_dataset(dataset_name, folder="./datasets/"):
             ignored_labels = list(h5_file['ignored_labels'][...])
 
 
-        labels[nan_mask] = 0
+        if nan_mask is not None:
+            labels[nan_mask] = 0
+        else:
+            # the NaN masks are computed tile by tile, when the labels are read
+            labels = LazyLabels(labels, scene)
 
 
     except:
@@ -64,8 +117,6 @@ def palette_init(label_values):
             palette[k + 1] = tuple(np.asarray(255 * np.array(color), dtype="uint8"))
     return palette
 
-from scipy.interpolate import interpn
-
 def explore_spectrums(img, complete_gt, class_names,
                       ignored_labels=None):
     """Plot sampled spectrums with mean + std for each class.
@@ -114,28 +165,73 @@ def explore_spectrums(img, complete_gt, class_names,
 
 
 
-def interpolate_data_along_wavelength(data, current_sampling, new_sampling, chunk_size=50):
+def interpolate_data_along_wavelength(data, current_sampling, new_sampling, chunk_size=50, kind="linear", bandwidth=None):
     """Interpolate the input 3D data along a new sampling in the third axis.
 
     Args:
-        data (numpy.ndarray): 3D data to interpolate
+        data (numpy.ndarray or LazyDataset): 3D data to interpolate
         current_sampling (numpy.ndarray): current sampling for the 3rd axis
         new_sampling (numpy.ndarray): new sampling for the 3rd axis
-        chunk_size (int): size of the chunks to use for the interpolation
+        chunk_size (int): number of rows resampled at once
+        kind (str): "linear", "cubic", "box" or "gaussian", cf. spectral_resampling_matrix
+        bandwidth (float or numpy.ndarray): width of the spectral response functions, for the "box" and "gaussian" kinds
+    """
+
+    current_sampling = np.asarray(current_sampling)
+    new_sampling = np.asarray(new_sampling)
+
+    if np.min(new_sampling) < np.min(current_sampling) or np.max(new_sampling) > np.max(current_sampling):
+        raise ValueError("The new sampling must be inside the current sampling range")
+
+    # the spatial axes are not interpolated : the spectra are resampled by a single sparse matrix
+    resampling_matrix = spectral_resampling_matrix(current_sampling, new_sampling, kind, bandwidth)
+
+    return resample_data_along_wavelength(data, resampling_matrix, chunk_size)
+
+def get_resampling_bands(current_sampling, new_sampling, kind="linear"):
+    """Get the bands of the current sampling used to resample data on a new sampling.
+
+    Args:
+        current_sampling (numpy.ndarray): current sampling for the 3rd axis, increasing
+        new_sampling (numpy.ndarray): new sampling for the 3rd axis, increasing
+        kind (str): "linear", "cubic", "box" or "gaussian", cf. spectral_resampling_matrix
+
+    Returns:
+        slice: bands of the current sampling used by the resampling kernel
     """
 
-    # Generate the coordinates for the original grid
-    x = np.arange(data.shape[0])
-    y = np.arange(data.shape[1])
-    z = current_sampling
+    if kind not in ["linear", "cubic"]:
+        # the spectral response functions can reach any band
+        return slice(None)
+
+    # only the bands surrounding the new wavelengths are used by the interpolation kernel
+    nb_of_neighbours = 1 if kind == "linear" else 2
+    nb_of_bands = len(current_sampling)
+    first_band = max(np.searchsorted(current_sampling, new_sampling[0], side="right") - nb_of_neighbours, 0)
+    last_band = min(np.searchsorted(current_sampling, new_sampling[-1], side="left") + nb_of_neighbours, nb_of_bands)
+    last_band = min(max(last_band, first_band + 2 * nb_of_neighbours), nb_of_bands)
+    first_band = max(min(first_band, last_band - 2 * nb_of_neighbours), 0)
+
+    return slice(first_band, last_band)
+
+def resample_data_along_wavelength(data, resampling_matrix, chunk_size=50):
+    """Apply a spectral resampling matrix to each pixel of the input 3D data.
+
+    Args:
+        data (numpy.ndarray or LazyDataset): 3D data to resample (shape = R x C x W_old)
+        resampling_matrix (scipy.sparse.csr_matrix): resampling matrix (shape = W_new x W_old), cf. spectral_resampling_matrix
+        chunk_size (int): number of rows resampled at once
+
+    Returns:
+        numpy.ndarray: resampled data (shape = R x C x W_new)
+    """
 
-    # Initialize an empty array for the result
-    interpolated_data = np.empty((data.shape[0], data.shape[1], len(new_sampling)))
+    resampled_data = np.empty((data.shape[0], data.shape[1], resampling_matrix.shape[0]))
 
-    # Perform the interpolation in chunks
+    # each block of rows is resampled by one product on its (pixels x bands) view
     for i in range(0, data.shape[0], chunk_size):
-        for j in range(0, data.shape[1], chunk_size):
-            new_coordinates = np.meshgrid(x[i:i+chunk_size], y[j:j+chunk_size], new_sampling, indexing='ij')
-            interpolated_data[i:i+chunk_size, j:j+chunk_size, :] = interpn((x[i:i+chunk_size], y[j:j+chunk_size], z), data[i:i+chunk_size, j:j+chunk_size, :], tuple(new_coordinates))
+        block = np.asarray(data[i:i+chunk_size])
+        spectra = block.reshape(-1, block.shape[2])
+        resampled_data[i:i+chunk_size] = (resampling_matrix @ spectra.T).T.reshape(block.shape[0], block.shape[1], -1)
 
-    return interpolated_data
\ No newline at end of file
+    return resampled_data
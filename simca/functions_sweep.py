@@ -0,0 +1,172 @@
+import copy
+import itertools
+import os
+import h5py
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+from simca.CassiSystem import CassiSystem, get_optics_config_hash
+from simca.AcquisitionWriter import AcquisitionWriter
+from simca.functions_acquisition import forget_worker_pool
+
+# CassiSystem of the last optics simulated by the worker process, reused by the following tasks with the same optics
+_sweep_system = None
+
+
+def expand_parameter_grid(parameter_grid):
+    """
+    Expand a grid of parameters in the list of all their combinations
+
+    Args:
+        parameter_grid (dict): values of each parameter, by path of the parameter (tuple of the configuration name and keys, e.g. ("config_pattern", "pattern", "ROM"))
+
+    Returns:
+        list: overrides of each combination (list of dict of values by path of the parameter)
+    """
+
+    paths = list(parameter_grid)
+
+    return [dict(zip(paths, values)) for values in itertools.product(*(parameter_grid[path] for path in paths))]
+
+def apply_overrides(configs, overrides):
+    """
+    Apply parameter overrides to copies of configuration dictionaries
+
+    Args:
+        configs (dict): configuration dictionaries, by name ("config_system", "config_pattern")
+        overrides (dict): values by path of the parameter (tuple of the configuration name and keys, e.g. ("config_system", "detector", "number of pixels along X"))
+
+    Returns:
+        dict: overridden configuration dictionaries, by name
+    """
+
+    configs = copy.deepcopy(configs)
+
+    for path, value in overrides.items():
+        config = configs[path[0]]
+        for key in path[1:-1]:
+            config = config.setdefault(key, {})
+        config[path[-1]] = value
+
+    return configs
+
+def read_completed_runs(file_path):
+    """
+    Read the indices of the runs of a sweep already saved in an HDF5 container (cf. run_sweep)
+
+    Args:
+        file_path (str): path to the HDF5 container
+
+    Returns:
+        set: indices of the complete runs
+    """
+
+    if not os.path.exists(file_path):
+        return set()
+
+    with h5py.File(file_path, 'r') as f:
+        if "runs" not in f:
+            return set()
+        # the configurations of a run are written after its arrays
+        return {int(name) for name, group in f["runs"].items() if "config_pattern" in group.attrs}
+
+def run_sweep(file_path, config_system, config_pattern, list_of_overrides, dataset_name, datasets_directory, nb_of_workers=None, runs_per_task=16,
+              use_psf=False, chunck_size=50, cache_directory=None, lazy=False, use_dataset_cache=False):
+    """
+    Run one acquisition for each set of parameter overrides, in parallel, and save the results in a single HDF5 container.
+
+    The runs are grouped by optics (cf. CassiSystem.get_optics_hash) and split in tasks of runs with the same optics : each worker process
+    reuses its dataset, propagated grids and interpolation plans (including the cropped grid of SD-CASSI systems) for all the runs of its tasks with the same optics, and the spectral resampling of
+    the dataset can be reused through the dataset cache of each worker. The results are written as soon as a task completes, in the group "runs/<index>" of the
+    container, with the configurations of the run as attributes. The runs already saved in the container are skipped, so that an interrupted sweep can be resumed
+
+    Args:
+        file_path (str): path to the HDF5 container
+        config_system (dict): base system configuration
+        config_pattern (dict): base pattern configuration
+        list_of_overrides (list): parameter overrides of each run (cf. apply_overrides and expand_parameter_grid)
+        dataset_name (str): name of the dataset
+        datasets_directory (str): directory of the datasets
+        nb_of_workers (int): number of worker processes (default = number of CPUs)
+        runs_per_task (int): maximum number of runs simulated by a task
+        use_psf (bool): if True, the PSF is applied to the measurements
+        chunck_size (int): default block size for the dataset
+        cache_directory (str): directory of the persistent cache of the propagated grids and interpolation plans, shared by the workers (default = no cache)
+        lazy (bool): if True, the dataset is loaded lazily by the workers (cf. get_dataset)
+        use_dataset_cache (bool): if True, each worker keeps the dataset and its spectral resamplings in its dataset cache (cf. CassiSystem.load_dataset)
+
+    Returns:
+        str: path to the HDF5 container
+    """
+
+    completed_runs = read_completed_runs(file_path)
+
+    groups = {}
+    for run_index, overrides in enumerate(list_of_overrides):
+        if run_index in completed_runs:
+            continue
+        configs = apply_overrides({"config_system": config_system, "config_pattern": config_pattern}, overrides)
+        optics_hash = get_optics_config_hash(configs["config_system"])
+        groups.setdefault(optics_hash, []).append((run_index, configs))
+
+    # the tasks of a group are consecutive, so that the workers are likely to reuse their system
+    tasks = []
+    for runs in groups.values():
+        for i in range(0, len(runs), runs_per_task):
+            tasks.append((runs[i:i + runs_per_task], dataset_name, datasets_directory, use_psf, chunck_size, cache_directory, lazy, use_dataset_cache))
+
+    if completed_runs:
+        print(f"Resuming the sweep of {file_path} : {len(completed_runs)} runs already saved")
+
+    with AcquisitionWriter(file_path, mode="a") as writer, ProcessPoolExecutor(nb_of_workers, initializer=forget_worker_pool) as executor:
+
+        futures = [executor.submit(worker_sweep_task, task) for task in tasks]
+
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Sweep"):
+            for run_index, configs, results in future.result():
+                group = f"runs/{run_index:06d}"
+                for name, data in results.items():
+                    writer.write(f"{group}/{name}", data)
+                writer.write_configs(configs, group=group)
+
+    print("Sweep saved in " + file_path)
+
+    return file_path
+
+def worker_sweep_task(task):
+    """
+    Process simulating the runs of a sweep task, all with the same optics
+
+    Args:
+        task (tuple): runs (list of run index and configuration dictionaries), dataset name, datasets directory, use_psf, chunck_size, cache directory, lazy loading flag and dataset cache flag
+
+    Returns:
+        list: run index, configuration dictionaries and results (dict of numpy.ndarray) of each run
+    """
+    global _sweep_system
+
+    runs, dataset_name, datasets_directory, use_psf, chunck_size, cache_directory, lazy, use_dataset_cache = task
+
+    results = []
+
+    for run_index, configs in runs:
+
+        if _sweep_system is None or _sweep_system.get_optics_hash() != get_optics_config_hash(configs["config_system"]):
+            # a single worker computes the interpolations in this process, without a nested pool
+            _sweep_system = CassiSystem(system_config=configs["config_system"], nb_of_workers=1, cache_directory=cache_directory)
+            _sweep_system.propagate_coded_aperture_grid()
+            # the dataset is the same for all the runs of the sweep
+            _sweep_system.load_dataset(dataset_name, datasets_directory, lazy=lazy, use_cache=use_dataset_cache)
+        else:
+            # the propagated grids and interpolation plans of the system are kept, since the optics are the same
+            _sweep_system.update_config(system_config=configs["config_system"])
+
+        pattern = _sweep_system.generate_2D_pattern(configs["config_pattern"])
+
+        if _sweep_system.system_config["system architecture"]["system type"] == "DD-CASSI":
+            _sweep_system.generate_filtering_cube()
+
+        measurement = _sweep_system.image_acquisition(use_psf=use_psf, chunck_size=chunck_size, keep_filtered_scene=False)
+
+        results.append((run_index, configs, {"pattern": pattern, "measurement": measurement}))
+
+    return results
@@ -0,0 +1,389 @@
+import unittest
+import numpy as np
+import glob
+from unittest import mock
+from simca.functions_general_purpose import load_yaml_config, spectral_resampling_matrix
+from simca.functions_acquisition import interpolate_data_on_grid_positions, InterpolationPlan, generate_dd_measurement, dot_product_test, \
+    get_worker_pool, close_worker_pool, is_regular_grid, generate_dd_compressed_measurement
+from simca.functions_scenes import interpolate_data_along_wavelength
+from simca.CassiSystem import CassiSystem
+
+
+class TestAcquisition(unittest.TestCase):
+
+    def setUp(self):
+        self.config_system = load_yaml_config('./simca/tests/test_configs/cassi_system.yml')
+        self.config_pattern = load_yaml_config('./simca/tests/test_configs/filtering_simple_random.yml')
+
+    def test_interpolation_plan_matches_griddata(self):
+
+        config_files = glob.glob('./simca/tests/test_configs/cassi_system*.yml')
+
+        for config_file in config_files:
+            config_system = load_yaml_config(config_file)
+
+            cassi_system = CassiSystem(system_config=config_system)
+            pattern = cassi_system.generate_2D_pattern(self.config_pattern)
+            cassi_system.propagate_coded_aperture_grid()
+
+            plan = InterpolationPlan(cassi_system.X_coordinates_propagated_coded_aperture,
+                                     cassi_system.Y_coordinates_propagated_coded_aperture,
+                                     cassi_system.X_detector_coordinates_grid,
+                                     cassi_system.Y_detector_coordinates_grid)
+
+            scene = np.random.rand(*cassi_system.X_coordinates_propagated_coded_aperture.shape)
+
+            for data in [pattern, scene]:
+                reference = interpolate_data_on_grid_positions(data,
+                                                               cassi_system.X_coordinates_propagated_coded_aperture,
+                                                               cassi_system.Y_coordinates_propagated_coded_aperture,
+                                                               cassi_system.X_detector_coordinates_grid,
+                                                               cassi_system.Y_detector_coordinates_grid)
+
+                np.testing.assert_allclose(plan.apply(data), reference, rtol=1e-12, atol=1e-12)
+
+    def test_single_worker_interpolations(self):
+
+        cassi_system = CassiSystem(system_config=self.config_system)
+        pattern = cassi_system.generate_2D_pattern(self.config_pattern)
+        cassi_system.propagate_coded_aperture_grid()
+
+        grids = (cassi_system.X_coordinates_propagated_coded_aperture, cassi_system.Y_coordinates_propagated_coded_aperture,
+                 cassi_system.X_detector_coordinates_grid, cassi_system.Y_detector_coordinates_grid)
+        self.assertFalse(is_regular_grid(*grids[:2]))
+
+        plan = InterpolationPlan(*grids)
+        reference = interpolate_data_on_grid_positions(pattern, *grids, grid_type="unstructured")
+
+        # a single worker must not start a pool
+        with mock.patch("simca.functions_acquisition.get_worker_pool", side_effect=AssertionError("a pool was started")):
+            single_worker_plan = InterpolationPlan(*grids, nb_of_workers=1)
+            interpolated_data = interpolate_data_on_grid_positions(pattern, *grids, grid_type="unstructured", nb_of_workers=1)
+
+        np.testing.assert_array_equal(single_worker_plan.vertices, plan.vertices)
+        np.testing.assert_array_equal(single_worker_plan.weights, plan.weights)
+        np.testing.assert_array_equal(interpolated_data, reference)
+
+    def test_forward_operator(self):
+
+        for system_type in ["DD-CASSI", "SD-CASSI"]:
+            self.config_system["system architecture"]["system type"] = system_type
+
+            cassi_system = CassiSystem(system_config=self.config_system)
+            pattern = cassi_system.generate_2D_pattern(self.config_pattern)
+            cassi_system.propagate_coded_aperture_grid()
+            filtering_cube = cassi_system.generate_filtering_cube()
+
+            if system_type == "DD-CASSI":
+                scene = np.random.rand(*filtering_cube.shape)
+                reference = np.sum(generate_dd_measurement(scene, filtering_cube, 50), axis=2)
+            else:
+                scene = np.random.rand(*cassi_system.X_coordinates_propagated_coded_aperture.shape)
+                reference = np.sum(cassi_system.interpolation_plan.apply(scene * pattern[..., np.newaxis]), axis=2)
+
+            forward_operator = cassi_system.generate_forward_operator()
+
+            self.assertEqual(forward_operator.shape, (reference.size, scene.size))
+            np.testing.assert_allclose(cassi_system.apply_forward_operator(scene), reference, rtol=1e-10, atol=1e-10)
+
+    def test_adjoint_operator(self):
+
+        for system_type in ["DD-CASSI", "SD-CASSI"]:
+            for propagation_type in ["simca", "higher-order"]:
+                self.config_system["system architecture"]["system type"] = system_type
+                self.config_system["system architecture"]["propagation type"] = propagation_type
+
+                cassi_system = CassiSystem(system_config=self.config_system)
+                cassi_system.generate_2D_pattern(self.config_pattern)
+                cassi_system.propagate_coded_aperture_grid()
+                cassi_system.generate_filtering_cube()
+
+                forward_operator = cassi_system.generate_forward_operator()
+                input_shape = cassi_system.apply_adjoint_operator(np.zeros(cassi_system.X_detector_coordinates_grid.shape)).shape
+                output_shape = cassi_system.X_detector_coordinates_grid.shape
+
+                relative_error = dot_product_test(cassi_system.apply_forward_operator, cassi_system.apply_adjoint_operator,
+                                                  input_shape, output_shape, seed=0)
+                self.assertLess(relative_error, 1e-10)
+
+                measurement = np.random.rand(*output_shape)
+                np.testing.assert_allclose(cassi_system.apply_adjoint_operator(measurement).ravel(),
+                                           forward_operator.T @ measurement.ravel(), rtol=1e-10, atol=1e-12)
+
+    def test_persistent_worker_pool(self):
+
+        pool = get_worker_pool(2)
+        self.assertIs(get_worker_pool(), pool)
+        self.assertIs(get_worker_pool(2), pool)
+
+        resized_pool = get_worker_pool(3)
+        self.assertIsNot(resized_pool, pool)
+        self.assertIs(get_worker_pool(), resized_pool)
+
+        close_worker_pool()
+        self.assertIsNot(get_worker_pool(3), resized_pool)
+        close_worker_pool()
+
+    def test_regular_grid_interpolation(self):
+
+        for propagation_type in ["simca", "higher-order"]:
+            self.config_system["system architecture"]["propagation type"] = propagation_type
+
+            cassi_system = CassiSystem(system_config=self.config_system)
+            cassi_system.propagate_coded_aperture_grid()
+
+            X_init = cassi_system.X_coordinates_propagated_coded_aperture
+            Y_init = cassi_system.Y_coordinates_propagated_coded_aperture
+
+            self.assertEqual(is_regular_grid(X_init, Y_init), propagation_type == "higher-order")
+
+        # both interpolations are exact for affine data
+        data = 0.3 * cassi_system.X_coded_aper_coordinates - 0.1 * cassi_system.Y_coded_aper_coordinates + 5
+
+        interpolated_data = [interpolate_data_on_grid_positions(data, X_init, Y_init,
+                                                                cassi_system.X_detector_coordinates_grid,
+                                                                cassi_system.Y_detector_coordinates_grid,
+                                                                grid_type=grid_type) for grid_type in ["regular", "unstructured"]]
+
+        np.testing.assert_allclose(interpolated_data[0], interpolated_data[1], rtol=1e-9, atol=1e-9)
+        np.testing.assert_array_equal(interpolated_data[0] != 0, interpolated_data[1] != 0)
+
+        plan = InterpolationPlan(X_init, Y_init, cassi_system.X_detector_coordinates_grid, cassi_system.Y_detector_coordinates_grid)
+        self.assertEqual(plan.vertices.shape[2], 4)
+        np.testing.assert_allclose(plan.apply(data), interpolated_data[0], rtol=1e-12, atol=1e-12)
+
+    def test_shifted_filtering_cubes(self):
+
+        self.config_system["system architecture"]["propagation type"] = "higher-order"
+        config_pattern = load_yaml_config('./simca/tests/test_configs/filtering_multiple_LN_random.yml')
+
+        cassi_system = CassiSystem(system_config=self.config_system)
+        list_of_patterns = cassi_system.generate_multiple_patterns(config_pattern, number_of_patterns=3)
+        cassi_system.propagate_coded_aperture_grid()
+
+        self.assertTrue(cassi_system.propagated_grids_are_regular())
+
+        list_of_filtering_cubes = cassi_system.generate_multiple_filtering_cubes(number_of_patterns=3)
+        plan = cassi_system.generate_interpolation_plan()
+
+        for pattern, filtering_cube in zip(list_of_patterns, list_of_filtering_cubes):
+            np.testing.assert_allclose(filtering_cube, plan.apply(pattern), rtol=1e-12, atol=1e-12)
+
+        cassi_system.pattern = list_of_patterns[0]
+        np.testing.assert_allclose(cassi_system.generate_filtering_cube(), list_of_filtering_cubes[0], rtol=1e-12, atol=1e-12)
+
+    def test_inverse_filtering_cube(self):
+
+        for propagation_type in ["simca", "higher-order"]:
+            self.config_system["system architecture"]["propagation type"] = propagation_type
+
+            cassi_system = CassiSystem(system_config=self.config_system)
+            cassi_system.propagate_coded_aperture_grid()
+
+            # a linear pattern is interpolated exactly by both methods, apart from the distortions inside a pixel
+            cassi_system.pattern = (cassi_system.X_coded_aper_coordinates + 2 * cassi_system.Y_coded_aper_coordinates) / 1e4
+            forward_filtering_cube = cassi_system.generate_filtering_cube().copy()
+            inverse_filtering_cube = cassi_system.generate_filtering_cube(method="inverse")
+
+            self.assertEqual(inverse_filtering_cube.shape, forward_filtering_cube.shape)
+            np.testing.assert_allclose(inverse_filtering_cube, forward_filtering_cube, rtol=0, atol=1e-3)
+
+        # without distortions, the lookup in the pattern is the same as the shift of the pattern
+        cassi_system.generate_2D_pattern(self.config_pattern)
+        np.testing.assert_allclose(cassi_system.generate_filtering_cube(method="inverse"), cassi_system.generate_filtering_cube(), rtol=0, atol=1e-12)
+
+    def test_compressed_measurement(self):
+
+        scene = np.random.rand(21, 23, 11)
+        scene[3, 4, 5] = np.nan
+        filtering_cube = np.random.rand(21, 23, 11)
+
+        reference = np.sum(generate_dd_measurement(scene, filtering_cube, 4), axis=2)
+
+        for nb_of_threads in [1, 3]:
+            measurement = generate_dd_compressed_measurement(scene, filtering_cube, 4, nb_of_threads)
+            np.testing.assert_array_equal(measurement, reference)
+
+        for system_type in ["DD-CASSI", "SD-CASSI"]:
+            self.config_system["system architecture"]["system type"] = system_type
+
+            cassi_system = CassiSystem(system_config=self.config_system)
+            cassi_system.generate_2D_pattern(self.config_pattern)
+            cassi_system.propagate_coded_aperture_grid()
+            cassi_system.generate_filtering_cube()
+
+            cassi_system.dataset = np.random.rand(15, 17, 30)
+            cassi_system.dataset_wavelengths = np.linspace(400, 650, 30)
+            cassi_system.dataset_labels = None
+
+            reference = cassi_system.image_acquisition(chunck_size=4).copy()
+            measurement = cassi_system.image_acquisition(chunck_size=4, keep_filtered_scene=False, nb_of_threads=2)
+
+            self.assertIsNone(cassi_system.last_filtered_interpolated_scene)
+            np.testing.assert_allclose(measurement, reference, rtol=1e-12, atol=1e-12)
+
+            # the PSF is applied once to the compressed measurement, as to each slice of the filtered scene
+            cassi_system.optical_model.generate_psf("Gaussian", 500)
+            reference = cassi_system.image_acquisition(chunck_size=4, use_psf=True).copy()
+            measurement = cassi_system.image_acquisition(chunck_size=4, use_psf=True, keep_filtered_scene=False).copy()
+            np.testing.assert_allclose(measurement, reference, rtol=1e-10, atol=1e-10)
+
+            cassi_system.apply_psf()
+            np.testing.assert_array_equal(cassi_system.measurement, measurement)
+
+    def test_batched_acquisitions(self):
+
+        config_pattern = load_yaml_config('./simca/tests/test_configs/filtering_multiple_LN_random.yml')
+
+        for system_type in ["DD-CASSI", "SD-CASSI"]:
+            for propagation_type in ["simca", "higher-order"]:
+                self.config_system["system architecture"]["system type"] = system_type
+                self.config_system["system architecture"]["propagation type"] = propagation_type
+
+                cassi_system = CassiSystem(system_config=self.config_system)
+                cassi_system.generate_multiple_patterns(config_pattern, 3)
+                cassi_system.propagate_coded_aperture_grid()
+                cassi_system.generate_multiple_filtering_cubes(3)
+
+                cassi_system.dataset = np.random.rand(15, 17, 30)
+                cassi_system.dataset_wavelengths = np.linspace(400, 650, 30)
+                cassi_system.dataset_labels = None
+
+                reference = np.array(cassi_system.multiple_image_acquisitions(nb_of_filtering_cubes=3, chunck_size=4))
+
+                cassi_system.propagate_coded_aperture_grid()
+                measurements = cassi_system.multiple_image_acquisitions(nb_of_filtering_cubes=3, chunck_size=4, batched=True)
+
+                self.assertEqual(measurements.shape, reference.shape)
+                np.testing.assert_allclose(measurements, reference, rtol=1e-12, atol=1e-12)
+
+                # no PSF is applied until one is generated
+                cassi_system.propagate_coded_aperture_grid()
+                measurements = cassi_system.batched_image_acquisitions(use_psf=True, nb_of_patterns=3, chunck_size=4)
+                np.testing.assert_allclose(measurements, reference, rtol=1e-12, atol=1e-12)
+
+    def test_iterate_image_acquisitions(self):
+
+        config_pattern = load_yaml_config('./simca/tests/test_configs/filtering_multiple_LN_random.yml')
+
+        for system_type in ["DD-CASSI", "SD-CASSI"]:
+            self.config_system["system architecture"]["system type"] = system_type
+
+            cassi_system = CassiSystem(system_config=self.config_system)
+            cassi_system.generate_multiple_patterns(config_pattern, 3)
+            cassi_system.propagate_coded_aperture_grid()
+            cassi_system.generate_multiple_filtering_cubes(3)
+
+            cassi_system.dataset = np.random.rand(15, 17, 30)
+            cassi_system.dataset_wavelengths = np.linspace(400, 650, 30)
+            cassi_system.dataset_labels = None
+
+            reference = cassi_system.multiple_image_acquisitions(nb_of_filtering_cubes=3, chunck_size=4)
+
+            cassi_system.propagate_coded_aperture_grid()
+            # no PSF is applied until one is generated
+            shots = cassi_system.iterate_image_acquisitions(use_psf=True, chunck_size=4, drop_filtering_cubes=True)
+
+            for idx, (pattern, measurement, metadata) in enumerate(shots):
+                self.assertEqual(metadata["index"], idx)
+                self.assertIsNone(metadata["filtering cube"])
+                np.testing.assert_array_equal(pattern, cassi_system.list_of_patterns[idx])
+                np.testing.assert_allclose(measurement, reference[idx], rtol=1e-12, atol=1e-12)
+
+            self.assertEqual(idx, 2)
+
+
+    def test_region_of_interest_interpolation(self):
+
+        for system_type in ["DD-CASSI", "SD-CASSI"]:
+            self.config_system["system architecture"]["system type"] = system_type
+
+            cassi_system = CassiSystem(system_config=self.config_system)
+            cassi_system.generate_2D_pattern(self.config_pattern)
+            cassi_system.propagate_coded_aperture_grid()
+            cassi_system.generate_filtering_cube()
+
+            # dataset larger than the instrument, spatially and spectrally
+            cassi_system.dataset = np.random.rand(60, 70, 40)
+            cassi_system.dataset_wavelengths = np.linspace(350, 750, 40)
+            cassi_system.dataset_labels = None
+
+            expected_region = (21, 23) if system_type == "DD-CASSI" else (22, 31)
+            self.assertEqual(cassi_system.get_region_of_interest(), expected_region)
+
+            full_interpolation = interpolate_data_along_wavelength(cassi_system.dataset, cassi_system.dataset_wavelengths,
+                                                                   cassi_system.optical_model.system_wavelengths, 50)
+            cropped_interpolation = cassi_system.interpolate_dataset_along_wavelengths(cassi_system.optical_model.system_wavelengths, 50,
+                                                                                       region_of_interest=expected_region)
+
+            np.testing.assert_allclose(cropped_interpolation, full_interpolation[:expected_region[0], :expected_region[1]], rtol=1e-12, atol=1e-12)
+
+            cassi_system.image_acquisition(chunck_size=50)
+            self.assertEqual(cassi_system.interpolated_scene.shape[:2], expected_region)
+
+    def test_spectral_resampling(self):
+
+        wavelengths = np.sort(np.random.uniform(400, 700, 40))
+        new_wavelengths = np.linspace(450, 650, 11)
+        data = np.random.rand(7, 9, 40)
+
+        # linear resampling matches a per-pixel linear interpolation
+        reference = np.apply_along_axis(lambda spectrum: np.interp(new_wavelengths, wavelengths, spectrum), 2, data)
+        np.testing.assert_allclose(interpolate_data_along_wavelength(data, wavelengths, new_wavelengths, 3), reference, rtol=1e-12, atol=1e-12)
+
+        # cubic resampling is exact for cubic spectra
+        cubic_spectrum = 1e-6 * (wavelengths - 500) ** 3 - 1e-3 * wavelengths ** 2
+        np.testing.assert_allclose(spectral_resampling_matrix(wavelengths, new_wavelengths, "cubic") @ cubic_spectrum,
+                                   1e-6 * (new_wavelengths - 500) ** 3 - 1e-3 * new_wavelengths ** 2, rtol=1e-9)
+
+        # band integration preserves flat spectra
+        for kind in ["box", "gaussian"]:
+            resampling_matrix = spectral_resampling_matrix(wavelengths, new_wavelengths, kind, bandwidth=25)
+            self.assertLess(resampling_matrix.nnz, resampling_matrix.shape[0] * resampling_matrix.shape[1])
+            np.testing.assert_allclose(resampling_matrix @ np.ones(40), np.ones(11))
+
+        # the bands used by the CassiSystem interpolation give the same result as the whole dataset
+        cassi_system = CassiSystem(system_config=self.config_system)
+        cassi_system.dataset = data
+        cassi_system.dataset_wavelengths = wavelengths
+        for kind in ["linear", "cubic"]:
+            np.testing.assert_allclose(cassi_system.interpolate_dataset_along_wavelengths(new_wavelengths, 3, kind=kind),
+                                       interpolate_data_along_wavelength(data, wavelengths, new_wavelengths, kind=kind), rtol=1e-12, atol=1e-12)
+
+    def test_compiled_instrument(self):
+
+        for system_type in ["DD-CASSI", "SD-CASSI"]:
+            self.config_system["system architecture"]["system type"] = system_type
+
+            cassi_system = CassiSystem(system_config=self.config_system)
+            cassi_system.generate_2D_pattern(self.config_pattern)
+            cassi_system.propagate_coded_aperture_grid()
+            cassi_system.generate_filtering_cube()
+
+            scenes = [np.random.rand(60, 70, 40) for _ in range(5)]
+            wavelengths = np.linspace(350, 750, 40)
+
+            cassi_system.dataset_wavelengths = wavelengths
+            cassi_system.dataset_labels = None
+
+            references = []
+            for scene in scenes:
+                cassi_system.dataset = scene
+                references.append(cassi_system.image_acquisition(chunck_size=50).copy())
+
+            compiled_instrument = cassi_system.compile_instrument(wavelengths, scene_shape=scenes[0].shape[:2])
+
+            np.testing.assert_allclose(compiled_instrument.apply(scenes[0]), references[0], rtol=1e-10, atol=1e-10)
+
+            # the scenes are consumed as the measurements are yielded, in order
+            measurements = list(compiled_instrument.map(iter(scenes), batch_size=2, nb_of_threads=2))
+            self.assertEqual(len(measurements), 5)
+            for measurement, reference in zip(measurements, references):
+                np.testing.assert_allclose(measurement, reference, rtol=1e-10, atol=1e-10)
+
+        # scenes with other bands than the compiled sampling are rejected
+        with self.assertRaises(ValueError):
+            compiled_instrument.apply(np.random.rand(60, 70, 20))
+
+if __name__ == '__main__':
+    unittest.main()
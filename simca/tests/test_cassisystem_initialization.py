@@ -6,6 +6,7 @@ from simca.functions_general_purpose import load_yaml_config
 from simca.CassiSystem import CassiSystem
 import h5py as h5
 import os
+from unittest import mock
 
 class TestCassiSystemInitialization(unittest.TestCase):
 
@@ -83,6 +84,22 @@ class TestCassiSystemInitialization(unittest.TestCase):
             self.assertIsInstance(pattern, np.ndarray)
             self.assertEqual(pattern.shape, (self.config_system["coded aperture"]["number of pixels along Y"], self.config_system["coded aperture"]["number of pixels along X"]))
 
+    def test_seeded_patterns(self):
+
+        cassi_system = CassiSystem(system_config=self.config_system)
+
+        for config_file in glob.glob('./simca/tests/test_configs/filtering_multiple*.yml') + ['./simca/tests/test_configs/filtering_simple_random.yml']:
+            config_pattern = load_yaml_config(config_file)
+            config_pattern["pattern"]["seed"] = 3
+
+            # the seed gives the same patterns, and does not change the global numpy random generator
+            global_state = np.random.get_state()
+            patterns = [cassi_system.generate_multiple_patterns(config_pattern, 2) for _ in range(2)]
+            self.assertEqual(np.random.get_state()[1].tolist(), global_state[1].tolist())
+
+            for pattern, other_pattern in zip(*patterns):
+                np.testing.assert_array_equal(pattern, other_pattern)
+
     def test_generate_multiple_patterns(self,num_tests=4,number_of_pattern=3):
 
         config_system_files = glob.glob('./simca/tests/test_configs/cassi_system*.yml')
@@ -156,6 +173,63 @@ class TestCassiSystemInitialization(unittest.TestCase):
             self.assertEqual(Y_grid.shape[2], W_list.shape[0])
 
 
+    def test_incremental_config_update(self):
+
+        config_pattern = load_yaml_config('./simca/tests/test_configs/filtering_simple_random.yml')
+
+        cassi_system = CassiSystem(system_config=self.config_system)
+        cassi_system.generate_2D_pattern(config_pattern)
+        X_propagated, _, _ = cassi_system.propagate_coded_aperture_grid()
+        cassi_system.generate_filtering_cube()
+        X_coded_aper_coordinates = cassi_system.X_coded_aper_coordinates
+
+        # an unchanged configuration invalidates nothing
+        cassi_system.update_config(system_config=self.config_system)
+        self.assertIs(cassi_system.X_coordinates_propagated_coded_aperture, X_propagated)
+        self.assertIsNotNone(cassi_system.interpolation_plan)
+
+        # the detector does not change the propagated grids, the filtering cube is generated again on its first access
+        self.config_system["detector"]["number of pixels along X"] += 2
+        with mock.patch.object(CassiSystem, "propagate_coded_aperture_grid", side_effect=AssertionError):
+            cassi_system.update_config(system_config=self.config_system)
+
+            self.assertIs(cassi_system.X_coordinates_propagated_coded_aperture, X_propagated)
+            self.assertIs(cassi_system.X_coded_aper_coordinates, X_coded_aper_coordinates)
+            self.assertIsNone(cassi_system.interpolation_plan)
+            self.assertEqual(cassi_system.filtering_cube.shape[:2], cassi_system.X_detector_coordinates_grid.shape)
+            self.assertEqual(cassi_system.X_detector_coordinates_grid.shape[1], self.config_system["detector"]["number of pixels along X"])
+
+        # the optics change the propagated grids, which are propagated again on their first access
+        cassi_system.update_config(system_config=dict(self.config_system, **{"spectral range": dict(self.config_system["spectral range"], **{"number of spectral samples": 7})}))
+        self.assertNotIn("X_coordinates_propagated_coded_aperture", vars(cassi_system))
+        self.assertNotIn("filtering_cube", vars(cassi_system))
+        self.assertEqual(cassi_system.X_coordinates_propagated_coded_aperture.shape[2], 7)
+        self.assertEqual(cassi_system.filtering_cube.shape[2], 7)
+
+        # the filtering cube of multiple patterns is generated again with its pattern
+        cassi_system = CassiSystem(system_config=load_yaml_config('./simca/tests/test_configs/cassi_system.yml'))
+        cassi_system.generate_multiple_patterns(load_yaml_config('./simca/tests/test_configs/filtering_multiple_LN_random.yml'), 2)
+        cassi_system.propagate_coded_aperture_grid()
+        cassi_system.generate_multiple_filtering_cubes(2)
+        config_system = cassi_system.system_config
+        config_system["system architecture"]["dispersive element"]["delta alpha c"] += 1
+        cassi_system.update_config(system_config=config_system)
+        self.assertNotIn("filtering_cube", vars(cassi_system))
+
+        reference_system = CassiSystem(system_config=config_system)
+        reference_system.list_of_patterns = cassi_system.list_of_patterns
+        reference_system.propagate_coded_aperture_grid()
+        np.testing.assert_array_equal(cassi_system.filtering_cube, reference_system.generate_multiple_filtering_cubes(2)[-1])
+
+        # an attribute regenerated explicitly is not stale anymore : once deleted, it is not generated again
+        cassi_system.update_config(system_config=dict(config_system, **{"detector": dict(config_system["detector"], **{"number of pixels along X": 20})}))
+        self.assertIn("filtering_cube", cassi_system.stale_attributes)
+        cassi_system.generate_multiple_filtering_cubes(2)
+        self.assertNotIn("filtering_cube", cassi_system.stale_attributes)
+        del cassi_system.filtering_cube
+        with self.assertRaises(AttributeError):
+            cassi_system.filtering_cube
+
     def test_generate_filtering_cube(self, num_tests=5):
 
         config_system_files = glob.glob('./simca/tests/test_configs/cassi_system*.yml')
@@ -0,0 +1,113 @@
+import unittest
+import numpy as np
+import glob
+from simca.functions_general_purpose import load_yaml_config
+from simca.CassiSystem import CassiSystem
+
+
+class TestOpticalModel(unittest.TestCase):
+
+    def test_vectorized_propagation_with_distorsions(self):
+
+        config_files = glob.glob('./simca/tests/test_configs/cassi_system*.yml')
+
+        for config_file in config_files:
+            config_system = load_yaml_config(config_file)
+
+            cassi_system = CassiSystem(system_config=config_system)
+            optical_model = cassi_system.optical_model
+            X_input_grid, Y_input_grid = cassi_system.X_coded_aper_coordinates, cassi_system.Y_coded_aper_coordinates
+
+            optical_model.ray_tracing_backend = "numpy"
+            X_propagated, Y_propagated = optical_model.propagation_with_distorsions(X_input_grid, Y_input_grid)
+
+            # small chunks give the same result
+            X_chunked, Y_chunked = optical_model.propagation_with_distorsions(X_input_grid, Y_input_grid, max_nb_of_rays=100)
+            np.testing.assert_array_equal(X_propagated, X_chunked)
+            np.testing.assert_array_equal(Y_propagated, Y_chunked)
+
+            # one wavelength at a time gives the same result
+            for idx, lba in enumerate(optical_model.system_wavelengths):
+                X_ref, Y_ref = optical_model.propagate_through_arm(X_input_grid.flatten(), Y_input_grid.flatten(),
+                                                                   n=np.full(X_input_grid.size, optical_model.sellmeier(lba)),
+                                                                   lba=np.full(X_input_grid.size, lba))
+
+                np.testing.assert_allclose(X_propagated[:, :, idx], X_ref.reshape(X_input_grid.shape), rtol=1e-12, atol=1e-9)
+                np.testing.assert_allclose(Y_propagated[:, :, idx], Y_ref.reshape(Y_input_grid.shape), rtol=1e-12, atol=1e-9)
+
+    def test_fused_ray_tracing(self):
+
+        config_files = glob.glob('./simca/tests/test_configs/cassi_system*.yml')
+
+        for config_file in config_files:
+            config_system = load_yaml_config(config_file)
+
+            cassi_system = CassiSystem(system_config=config_system)
+            optical_model = cassi_system.optical_model
+            X_input_grid, Y_input_grid = cassi_system.X_coded_aper_coordinates, cassi_system.Y_coded_aper_coordinates
+
+            optical_model.ray_tracing_backend = "numpy"
+            X_ref, Y_ref = optical_model.propagation_with_distorsions(X_input_grid, Y_input_grid)
+
+            # compiled kernels when numba is installed, pure python kernels otherwise
+            X_fused, Y_fused = optical_model.propagate_through_arm_fused(X_input_grid.flatten(), Y_input_grid.flatten(),
+                                                                        n=optical_model.sellmeier(optical_model.system_wavelengths),
+                                                                        lba=optical_model.system_wavelengths)
+
+            np.testing.assert_allclose(X_fused.reshape(X_ref.shape), X_ref, rtol=0, atol=1e-6)
+            np.testing.assert_allclose(Y_fused.reshape(Y_ref.shape), Y_ref, rtol=0, atol=1e-6)
+
+    def test_ray_tracing_backends(self):
+
+        config_files = glob.glob('./simca/tests/test_configs/cassi_system*.yml')
+        config_pattern = load_yaml_config('./simca/tests/test_configs/filtering_simple_random.yml')
+
+        for config_file in config_files:
+            filtering_cubes = {}
+            optics_hashes = {}
+
+            for backend in [None, "numpy", "numba"]:
+                config_system = load_yaml_config(config_file)
+                if backend is not None:
+                    config_system["system architecture"]["ray tracing backend"] = backend
+
+                cassi_system = CassiSystem(system_config=config_system)
+                # the numpy backend is used by default
+                self.assertEqual(cassi_system.optical_model.ray_tracing_backend, backend or "numpy")
+
+                np.random.seed(0)
+                cassi_system.generate_2D_pattern(config_pattern)
+                cassi_system.propagate_coded_aperture_grid()
+                filtering_cubes[backend] = cassi_system.generate_filtering_cube()
+                optics_hashes[backend] = cassi_system.get_optics_hash()
+
+            np.testing.assert_array_equal(filtering_cubes[None], filtering_cubes["numpy"])
+            np.testing.assert_allclose(filtering_cubes["numba"], filtering_cubes["numpy"], rtol=0, atol=1e-9)
+
+            # the grids traced by one backend are not reused for the other one
+            self.assertEqual(optics_hashes[None], optics_hashes["numpy"])
+            self.assertNotEqual(optics_hashes["numba"], optics_hashes["numpy"])
+
+    def test_inverse_propagation(self):
+
+        config_files = glob.glob('./simca/tests/test_configs/cassi_system*.yml')
+
+        for config_file in config_files:
+            config_system = load_yaml_config(config_file)
+
+            cassi_system = CassiSystem(system_config=config_system)
+            optical_model = cassi_system.optical_model
+            X_detector_grid, Y_detector_grid = cassi_system.X_detector_coordinates_grid, cassi_system.Y_detector_coordinates_grid
+
+            X_inverse, Y_inverse = optical_model.inverse_propagation_with_distorsions(X_detector_grid, Y_detector_grid)
+
+            # the coded aperture positions found are imaged back on the detector grid
+            lba = optical_model.system_wavelengths.reshape(1, 1, -1)
+            X_propagated, Y_propagated = optical_model.propagate_through_arm(X_inverse, Y_inverse, n=optical_model.sellmeier(lba), lba=lba)
+
+            np.testing.assert_allclose(X_propagated, np.broadcast_to(X_detector_grid[..., np.newaxis], X_propagated.shape), rtol=0, atol=1e-6)
+            np.testing.assert_allclose(Y_propagated, np.broadcast_to(Y_detector_grid[..., np.newaxis], Y_propagated.shape), rtol=0, atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
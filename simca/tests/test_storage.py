@@ -0,0 +1,436 @@
+import unittest
+import numpy as np
+import os
+import tempfile
+import subprocess
+import sys
+import yaml
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+import h5py as h5
+from simca.functions_general_purpose import load_yaml_config, save_data_in_hdf5_container, load_data_from_hdf5_container, downcast_losslessly, \
+    append_shot_in_hdf5
+from simca.CassiSystem import CassiSystem
+from simca.AcquisitionWriter import AcquisitionWriter
+from simca.LazyDataset import LazyDataset, LazyLabels
+from simca.functions_scenes import get_dataset, get_dataset_cache
+from simca.DatasetCache import DatasetCache, get_size_in_bytes
+from simca.functions_acquisition import match_dataset_to_instrument, match_dataset_labels_to_instrument, InterpolationPlan
+from simca.OpticalModel import OpticalModel
+from simca.functions_sweep import expand_parameter_grid, apply_overrides, run_sweep, read_completed_runs
+from simca import functions_sweep
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.config_system = load_yaml_config('./simca/tests/test_configs/cassi_system.yml')
+        self.config_pattern = load_yaml_config('./simca/tests/test_configs/filtering_simple_random.yml')
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.config_acquisition = {"acquisition name": "test_acquisition", "results directory": self.temporary_directory.name}
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_lossless_downcast(self):
+
+        self.assertEqual(downcast_losslessly(np.random.choice([0, 1], size=(5, 5))).dtype, bool)
+        self.assertEqual(downcast_losslessly(np.arange(5, dtype=np.float64) / 4).dtype, np.float32)
+        self.assertEqual(downcast_losslessly(np.random.rand(5, 5)).dtype, np.float64)
+
+    def test_hdf5_container(self):
+
+        datasets = {"cube": np.random.rand(20, 30, 11),
+                    "pattern": np.random.choice([0, 1], size=(20, 30)),
+                    "wavelengths": np.linspace(450, 650, 11),
+                    "missing": None}
+
+        file_path = os.path.join(self.temporary_directory.name, "container.h5")
+        save_data_in_hdf5_container(file_path, datasets, {"config_system": self.config_system}, compression="gzip")
+
+        with h5.File(file_path, 'r') as f:
+            self.assertEqual(f["cube"].chunks, (20, 30, 1))
+            self.assertEqual(f["cube"].compression, "gzip")
+            self.assertEqual(f["pattern"].dtype, bool)
+            self.assertNotIn("missing", f)
+
+        loaded_datasets, loaded_configs = load_data_from_hdf5_container(file_path)
+
+        self.assertEqual(loaded_configs["config_system"], self.config_system)
+        for name in ["cube", "pattern", "wavelengths"]:
+            self.assertEqual(loaded_datasets[name].dtype, datasets[name].dtype)
+            np.testing.assert_array_equal(loaded_datasets[name], datasets[name])
+
+    def test_save_acquisition(self):
+
+        cassi_system = CassiSystem(system_config=self.config_system)
+        cassi_system.generate_2D_pattern(self.config_pattern)
+        cassi_system.propagate_coded_aperture_grid()
+        cassi_system.generate_filtering_cube()
+
+        cassi_system.dataset = np.random.rand(15, 17, 30)
+        cassi_system.dataset_wavelengths = np.linspace(400, 650, 30)
+        cassi_system.dataset_labels = None
+        cassi_system.image_acquisition()
+
+        file_path = cassi_system.save_acquisition(self.config_pattern, self.config_acquisition)
+
+        self.assertEqual(os.listdir(cassi_system.result_directory), ["acquisition.h5"])
+
+        datasets, configs = load_data_from_hdf5_container(file_path)
+
+        self.assertEqual(configs["config_pattern"], self.config_pattern)
+        np.testing.assert_array_equal(datasets["measurement"], cassi_system.measurement)
+        np.testing.assert_array_equal(datasets["filtering_cube"], cassi_system.filtering_cube)
+        np.testing.assert_array_equal(datasets["pattern"], cassi_system.pattern)
+
+    def test_acquisition_writer(self):
+
+        file_path = os.path.join(self.temporary_directory.name, "container.h5")
+        arrays = [np.random.rand(20, 30, 11) for _ in range(5)]
+
+        with AcquisitionWriter(file_path, max_queue_size=2, compression="gzip") as writer:
+            writer.write_configs({"config_system": self.config_system})
+            for idx, array in enumerate(arrays):
+                writer.write(f"cube_{idx}", array)
+            # the arrays are copied : they can be modified once handed to the writer
+            arrays[0][...] = 0
+            writer.write("cube_4", arrays[4])
+            writer.flush()
+
+        datasets, configs = load_data_from_hdf5_container(file_path)
+
+        self.assertEqual(configs["config_system"], self.config_system)
+        self.assertEqual(len(datasets), 5)
+        np.testing.assert_array_equal(datasets["cube_3"], arrays[3])
+        self.assertNotEqual(np.abs(datasets["cube_0"]).sum(), 0)
+
+        # errors of the writer process are raised in the main process
+        writer = AcquisitionWriter(os.path.join(self.temporary_directory.name, "missing_directory", "container.h5"))
+        with self.assertRaises(RuntimeError):
+            # the error is raised by the first call made after the writer process reported it
+            writer.write("cube", arrays[1])
+            writer.close()
+        writer.close()
+
+        # a dead writer process raises an error instead of blocking
+        writer = AcquisitionWriter(os.path.join(self.temporary_directory.name, "killed.h5"), max_queue_size=1)
+        writer.process.kill()
+        writer.process.join()
+        with self.assertRaises(RuntimeError):
+            for array in arrays:
+                writer.write("cube", array)
+        with self.assertRaises(RuntimeError):
+            writer.flush()
+        with self.assertRaises(RuntimeError):
+            writer.close()
+
+        # the arrays still queued at exit are written
+        file_path = os.path.join(self.temporary_directory.name, "exit.h5")
+        script = ("import numpy as np; from simca.AcquisitionWriter import AcquisitionWriter; "
+                  f"writer = AcquisitionWriter({file_path!r}); [writer.write(f'cube_{{idx}}', np.ones((200, 200, 20))) for idx in range(5)]")
+        subprocess.run([sys.executable, "-c", script], check=True, env=dict(os.environ, PYTHONPATH=os.getcwd()))
+        datasets, _ = load_data_from_hdf5_container(file_path)
+        self.assertEqual(len(datasets), 5)
+
+    def test_asynchronous_save_acquisition(self):
+
+        cassi_system = CassiSystem(system_config=self.config_system)
+        cassi_system.generate_2D_pattern(self.config_pattern)
+        cassi_system.propagate_coded_aperture_grid()
+        cassi_system.generate_filtering_cube()
+
+        cassi_system.dataset = np.random.rand(15, 17, 30)
+        cassi_system.dataset_wavelengths = np.linspace(400, 650, 30)
+        cassi_system.dataset_labels = None
+        cassi_system.image_acquisition()
+
+        file_path = cassi_system.save_acquisition(self.config_pattern, self.config_acquisition, asynchronous=True)
+        cassi_system.close()
+
+        datasets, configs = load_data_from_hdf5_container(file_path)
+
+        self.assertEqual(configs["config_system"], self.config_system)
+        np.testing.assert_array_equal(datasets["measurement"], cassi_system.measurement)
+        np.testing.assert_array_equal(datasets["filtering_cube"], cassi_system.filtering_cube)
+
+    def test_appendable_shots(self):
+
+        file_path = os.path.join(self.temporary_directory.name, "container.h5")
+        measurements = np.random.rand(4, 20, 30)
+        filtering_cubes = np.random.rand(4, 20, 30, 11)
+
+        with h5.File(file_path, 'w') as f:
+            for idx in range(3):
+                append_shot_in_hdf5(f, {"measurements": measurements[idx], "filtering_cubes": filtering_cubes[idx]})
+
+            self.assertEqual(f["filtering_cubes"].chunks, (1, 20, 30, 1))
+
+            # interrupted shot : only one of the datasets was appended
+            f["measurements"].resize(4, axis=0)
+            f["measurements"][3] = measurements[3]
+
+        datasets, _ = load_data_from_hdf5_container(file_path)
+
+        np.testing.assert_array_equal(datasets["measurements"], measurements[:3])
+        np.testing.assert_array_equal(datasets["filtering_cubes"], filtering_cubes[:3])
+
+        # the interrupted shot is written again by the next run
+        with AcquisitionWriter(file_path, mode="a") as writer:
+            writer.write_shot({"measurements": measurements[3], "filtering_cubes": filtering_cubes[3]})
+
+        datasets, _ = load_data_from_hdf5_container(file_path)
+
+        np.testing.assert_array_equal(datasets["measurements"], measurements)
+        np.testing.assert_array_equal(datasets["filtering_cubes"], filtering_cubes)
+
+
+    def test_checkpointed_acquisitions(self):
+
+        config_patterns = load_yaml_config('./simca/tests/test_configs/filtering_multiple_LN_random.yml')
+        dataset = np.random.rand(15, 17, 30)
+
+        for system_type in ["DD-CASSI", "SD-CASSI"]:
+            self.config_system["system architecture"]["system type"] = system_type
+            file_path = os.path.join(self.temporary_directory.name, system_type + ".h5")
+
+            cassi_system = CassiSystem(system_config=self.config_system)
+            cassi_system.dataset = dataset
+            cassi_system.dataset_wavelengths = np.linspace(400, 650, 30)
+            cassi_system.dataset_labels = None
+
+            cassi_system.checkpointed_image_acquisitions(file_path, config_patterns, 3, self.config_acquisition)
+            datasets, _ = load_data_from_hdf5_container(file_path)
+
+            # interrupted run : the last shot is lost
+            with h5.File(file_path, 'a') as f:
+                f.attrs["completed shots"] = 1
+
+            resumed_system = CassiSystem(system_config=self.config_system)
+            resumed_system.dataset = cassi_system.dataset
+            resumed_system.dataset_wavelengths = cassi_system.dataset_wavelengths
+            resumed_system.dataset_labels = None
+
+            # the patterns and the propagated grids (cropped to the dataset for SD-CASSI) are reloaded from the checkpoint
+            with mock.patch.object(CassiSystem, "propagate_coded_aperture_grid", side_effect=AssertionError):
+                resumed_system.checkpointed_image_acquisitions(file_path, config_patterns, 3, self.config_acquisition)
+
+            resumed_datasets, _ = load_data_from_hdf5_container(file_path)
+
+            self.assertEqual(resumed_datasets["list_of_compressed_measurements"].shape[0], 3)
+            self.assertEqual("list_of_filtering_cubes" in datasets, system_type == "DD-CASSI")
+            for name in ["list_of_patterns", "list_of_compressed_measurements", "list_of_filtering_cubes"]:
+                if name in datasets:
+                    np.testing.assert_allclose(resumed_datasets[name], datasets[name])
+
+            with self.assertRaises(ValueError):
+                resumed_system.checkpointed_image_acquisitions(file_path, config_patterns, 4, self.config_acquisition)
+
+            # the filtering cubes of the resumed shots would not match the saved ones
+            with self.assertRaises(ValueError):
+                resumed_system.checkpointed_image_acquisitions(file_path, config_patterns, 3, self.config_acquisition, drop_filtering_cubes=True)
+
+    def test_lazy_dataset(self):
+
+        scene = np.random.rand(40, 50, 30)
+        scene[3, 4, 10] = np.nan
+        scene[30, 45, :] = np.nan
+        labels = np.random.randint(1, 4, size=(40, 50))
+
+        for dataset_name, chunks in [("contiguous", None), ("chunked", (16, 16, 30))]:
+            os.makedirs(os.path.join(self.temporary_directory.name, dataset_name))
+            with h5.File(os.path.join(self.temporary_directory.name, dataset_name, dataset_name + ".h5"), 'w') as f:
+                f.create_dataset("scene", data=scene, chunks=chunks)
+                f.create_dataset("wavelengths", data=np.linspace(400, 650, 30)[np.newaxis, :])
+                f.create_dataset("labels", data=labels)
+                f.create_dataset("label_names", data=np.array([["unlabeled"], ["a"], ["b"], ["c"]], dtype=h5.string_dtype()))
+                f.create_dataset("ignored_labels", data=np.array([0]))
+
+            folder = self.temporary_directory.name + "/"
+            dataset, wavelengths, dataset_labels, _, _ = get_dataset(dataset_name, folder)
+            lazy_dataset, lazy_wavelengths, lazy_labels, _, _ = get_dataset(dataset_name, folder, lazy=True)
+
+            # the labels of the NaN pixels are reset in both modes
+            self.assertIsInstance(lazy_labels, LazyLabels)
+            self.assertEqual(dataset_labels[3, 4], 0)
+            np.testing.assert_array_equal(np.asarray(lazy_labels), dataset_labels)
+            np.testing.assert_array_equal(lazy_labels[25:35, 40:], dataset_labels[25:35, 40:])
+            np.testing.assert_array_equal(match_dataset_labels_to_instrument(lazy_labels, np.broadcast_to(0., (20, 60, 25))),
+                                          match_dataset_labels_to_instrument(dataset_labels, np.broadcast_to(0., (20, 60, 25))))
+
+            self.assertIsInstance(lazy_dataset, LazyDataset)
+            self.assertEqual(isinstance(lazy_dataset.source, np.memmap), chunks is None)
+            self.assertEqual(lazy_dataset.shape, dataset.shape)
+            np.testing.assert_array_equal(lazy_wavelengths, wavelengths)
+
+            lazy_dataset.tile_size = 7
+            np.testing.assert_array_equal(np.asarray(lazy_dataset), dataset)
+            np.testing.assert_array_equal(lazy_dataset[30, 40:, 2], dataset[30, 40:, 2])
+            # the pixels with a NaN in a band which is not read are set to 0 too
+            np.testing.assert_array_equal(lazy_dataset[:10, :10, 0:5], dataset[:10, :10, 0:5])
+            self.assertEqual(lazy_dataset[3, 4, 0], 0)
+
+            # region larger than the dataset along the columns, and smaller along the rows and wavelengths
+            filtering_cube_shape = np.broadcast_to(0., (20, 60, 25))
+            np.testing.assert_array_equal(match_dataset_to_instrument(lazy_dataset, filtering_cube_shape),
+                                          match_dataset_to_instrument(dataset, filtering_cube_shape))
+
+        # only the pixels of the region read are loaded, with all their bands for the NaN mask
+        source = mock.MagicMock(wraps=scene, shape=scene.shape)
+        source.__getitem__.side_effect = scene.__getitem__
+        lazy_dataset = LazyDataset(source, tile_size=7)
+        np.testing.assert_array_equal(lazy_dataset[:10, :10, 0:5], dataset[:10, :10, 0:5])
+        for (key,), _ in source.__getitem__.call_args_list:
+            self.assertLessEqual(key[0].stop, 10)
+            self.assertLessEqual(key[1].stop, 10)
+        self.assertEqual(len(lazy_dataset.nan_masks), 4)
+
+    def test_dataset_cache(self):
+
+        os.makedirs(os.path.join(self.temporary_directory.name, "scene"))
+        file_path = os.path.join(self.temporary_directory.name, "scene", "scene.h5")
+        with h5.File(file_path, 'w') as f:
+            f.create_dataset("scene", data=np.random.rand(30, 40, 30))
+            f.create_dataset("wavelengths", data=np.linspace(400, 650, 30)[np.newaxis, :])
+
+        dataset_cache = get_dataset_cache()
+        dataset_cache.clear()
+
+        cassi_systems = [CassiSystem(system_config=self.config_system) for _ in range(2)]
+        for cassi_system in cassi_systems:
+            cassi_system.load_dataset("scene", self.temporary_directory.name + "/", use_cache=True)
+            cassi_system.interpolate_dataset_along_wavelengths(cassi_system.optical_model.system_wavelengths, 10,
+                                                               region_of_interest=cassi_system.get_region_of_interest())
+
+        self.assertEqual(dataset_cache.get_statistics()["hits"], 2)
+        self.assertEqual(dataset_cache.get_statistics()["misses"], 2)
+        self.assertIs(cassi_systems[0].dataset, cassi_systems[1].dataset)
+        self.assertIs(cassi_systems[0].dataset_interpolated, cassi_systems[1].dataset_interpolated)
+        self.assertFalse(cassi_systems[0].dataset.flags.writeable)
+
+        # a modified file is loaded again
+        os.utime(file_path, ns=(0, 0))
+        cassi_systems[0].load_dataset("scene", self.temporary_directory.name + "/", use_cache=True)
+        self.assertEqual(dataset_cache.get_statistics()["misses"], 3)
+
+        # the cache is opt-in : the arrays of another system are not shared and stay writable
+        uncached_system = CassiSystem(system_config=self.config_system)
+        uncached_system.load_dataset("scene", self.temporary_directory.name + "/")
+        uncached_system.interpolate_dataset_along_wavelengths(uncached_system.optical_model.system_wavelengths, 10)
+        self.assertEqual(dataset_cache.get_statistics()["misses"], 3)
+        self.assertTrue(uncached_system.dataset.flags.writeable)
+        self.assertTrue(uncached_system.dataset_interpolated.flags.writeable)
+
+        # a dataset set by hand is not cached
+        cassi_systems[1].dataset = np.random.rand(30, 40, 30)
+        cassi_systems[1].interpolate_dataset_along_wavelengths(cassi_systems[1].optical_model.system_wavelengths, 10)
+        self.assertTrue(cassi_systems[1].dataset_interpolated.flags.writeable)
+
+        # the least recently used entries are evicted first
+        dataset_key = cassi_systems[0].dataset_cache_key[1]
+        dataset_cache.resize(get_size_in_bytes(dataset_cache.get(dataset_key)))
+        self.assertEqual(len(dataset_cache), 1)
+        self.assertIs(dataset_cache.get(dataset_key)[0], cassi_systems[0].dataset)
+
+        dataset_cache.resize(DatasetCache().max_bytes)
+        dataset_cache.clear()
+
+    def test_disk_cache(self):
+
+        cache_directory = os.path.join(self.temporary_directory.name, "cache")
+        self.config_system["system architecture"]["propagation type"] = "simca"
+
+        cassi_system = CassiSystem(system_config=self.config_system, cache_directory=cache_directory)
+        cassi_system.generate_2D_pattern(self.config_pattern)
+        cassi_system.propagate_coded_aperture_grid()
+        filtering_cube = cassi_system.generate_filtering_cube()
+
+        self.assertEqual(len(os.listdir(cache_directory)), 2)
+
+        # another system with the same optics loads the grids and the plan from the cache
+        cached_system = CassiSystem(system_config=load_yaml_config('./simca/tests/test_configs/cassi_system.yml'), cache_directory=cache_directory)
+        cached_system.pattern = cassi_system.pattern
+        with mock.patch.object(OpticalModel, "propagation_with_distorsions", side_effect=AssertionError), \
+                mock.patch.object(InterpolationPlan, "__init__", side_effect=AssertionError):
+            cached_system.propagate_coded_aperture_grid()
+            cached_filtering_cube = cached_system.generate_filtering_cube()
+
+        self.assertEqual(cached_system.get_optics_hash(), cassi_system.get_optics_hash())
+        self.assertIsInstance(cached_system.X_coordinates_propagated_coded_aperture, np.memmap)
+        np.testing.assert_array_equal(cached_system.X_coordinates_propagated_coded_aperture, cassi_system.X_coordinates_propagated_coded_aperture)
+        np.testing.assert_array_equal(cached_filtering_cube, filtering_cube)
+        self.assertEqual(cached_system.disk_cache.hits, 2)
+
+        # other optics give another entry
+        other_config = load_yaml_config('./simca/tests/test_configs/cassi_system.yml')
+        other_config["detector"]["number of pixels along X"] += 1
+        other_system = CassiSystem(system_config=other_config, cache_directory=cache_directory)
+        self.assertNotEqual(other_system.get_optics_hash(), cassi_system.get_optics_hash())
+        other_system.propagate_coded_aperture_grid()
+        self.assertEqual(other_system.disk_cache.misses, 1)
+
+    def test_sweep(self):
+
+        os.makedirs(os.path.join(self.temporary_directory.name, "scene"))
+        with h5.File(os.path.join(self.temporary_directory.name, "scene", "scene.h5"), 'w') as f:
+            f.create_dataset("scene", data=np.random.rand(30, 40, 30))
+            f.create_dataset("wavelengths", data=np.linspace(400, 650, 30)[np.newaxis, :])
+
+        list_of_overrides = expand_parameter_grid({("config_pattern", "pattern", "seed"): [1, 2],
+                                                   ("config_system", "detector", "number of pixels along X"): [30, 31]})
+        self.assertEqual(len(list_of_overrides), 4)
+
+        configs = apply_overrides({"config_system": self.config_system, "config_pattern": self.config_pattern}, list_of_overrides[1])
+        self.assertEqual(configs["config_system"]["detector"]["number of pixels along X"], 31)
+        self.assertNotIn("seed", self.config_pattern["pattern"])
+
+        file_path = os.path.join(self.temporary_directory.name, "sweep.h5")
+        run_sweep(file_path, self.config_system, self.config_pattern, list_of_overrides[:3], "scene", self.temporary_directory.name + "/",
+                  nb_of_workers=2, runs_per_task=1)
+        self.assertEqual(read_completed_runs(file_path), {0, 1, 2})
+
+        # the runs already saved are skipped when the sweep is resumed
+        with mock.patch.object(ProcessPoolExecutor, "submit", autospec=True, side_effect=ProcessPoolExecutor.submit) as submit:
+            run_sweep(file_path, self.config_system, self.config_pattern, list_of_overrides, "scene", self.temporary_directory.name + "/", nb_of_workers=1)
+        self.assertEqual(submit.call_count, 1)
+        self.assertEqual(read_completed_runs(file_path), {0, 1, 2, 3})
+
+        with h5.File(file_path, 'r') as f:
+            self.assertEqual(f["runs/000001/measurement"].shape[1], 31)
+            # the same seed gives the same pattern
+            np.testing.assert_array_equal(f["runs/000000/pattern"][()], f["runs/000001/pattern"][()])
+            self.assertEqual(yaml.safe_load(f["runs/000002"].attrs["config_pattern"])["pattern"]["seed"], 2)
+
+    def test_sweep_task_reuses_optics(self):
+
+        os.makedirs(os.path.join(self.temporary_directory.name, "scene"))
+        with h5.File(os.path.join(self.temporary_directory.name, "scene", "scene.h5"), 'w') as f:
+            f.create_dataset("scene", data=np.random.rand(30, 40, 30))
+            f.create_dataset("wavelengths", data=np.linspace(400, 650, 30)[np.newaxis, :])
+
+        self.config_system["system architecture"]["system type"] = "SD-CASSI"
+        runs = [(index, apply_overrides({"config_system": self.config_system, "config_pattern": self.config_pattern}, overrides))
+                for index, overrides in enumerate(expand_parameter_grid({("config_pattern", "pattern", "seed"): [1, 2, 3]}))]
+        task = (runs, "scene", self.temporary_directory.name + "/", False, 50, None, False, False)
+
+        functions_sweep._sweep_system = None
+        with mock.patch.object(CassiSystem, "propagate_coded_aperture_grid", autospec=True, side_effect=CassiSystem.propagate_coded_aperture_grid) as propagate, \
+                mock.patch.object(InterpolationPlan, "__init__", autospec=True, side_effect=InterpolationPlan.__init__) as triangulate, \
+                mock.patch.object(CassiSystem, "load_dataset", autospec=True, side_effect=CassiSystem.load_dataset) as load_dataset:
+            results = functions_sweep.worker_sweep_task(task)
+        functions_sweep._sweep_system = None
+
+        # the full grid is propagated when the system is created, the cropped grid is propagated and triangulated for the first run only
+        self.assertEqual(propagate.call_count, 2)
+        self.assertEqual(triangulate.call_count, 1)
+        self.assertEqual(load_dataset.call_count, 1)
+
+        # the last run gives the same measurement as a new system
+        cassi_system = CassiSystem(system_config=runs[-1][1]["config_system"])
+        cassi_system.load_dataset("scene", self.temporary_directory.name + "/")
+        cassi_system.generate_2D_pattern(runs[-1][1]["config_pattern"])
+        cassi_system.propagate_coded_aperture_grid()
+        np.testing.assert_allclose(results[-1][2]["measurement"], cassi_system.image_acquisition(keep_filtered_scene=False))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
-from simca.tests import test_cassisystem_initialization
+from simca.tests import test_cassisystem_initialization, test_acquisition, test_optical_model, test_storage
 import unittest
 
 if __name__ == '__main__':
     unittest.main(test_cassisystem_initialization, exit=False)
+    unittest.main(test_acquisition, exit=False)
+    unittest.main(test_optical_model, exit=False)
+    unittest.main(test_storage, exit=False)